@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+ARCHIVE = 'tests.archive'
+
+BLOB = 'blob'
+TEST = 'test'
+
+# kinds of chunks
+STREAM_START = 1
+STREAM_CONTINUATION = 0
+CHUNK_HEADER = struct.Struct('>BI')
+
+# an append-only file with generated tests
+#
+# the file consists of chunks, every chunk is a kind, a size and a piece of a zlib stream,
+# every process which appends to the archive starts a new stream, and flushes it after every test,
+# so that similar tests are compressed well, and tests are not lost if the process crashes
+#
+# a stream contains records, every record is a header on a single line, blobs are followed by code:
+#
+#   {"type": "blob", "digest": "<sha1 of code>", "size": <size of code>}
+#   <code>
+#   {"type": "test", "subdir": "_io/StringIO", "key": "StringIO_read", "index": 3,
+#    "target": "_io.StringIO.read", "case": "_io.StringIO.read:call:1=17", "digest": "<sha1 of code>"}
+#
+# the same code is stored only once, tests refer to code by its digest,
+# an archive is opened either for reading, then tests are indexed by targets and case IDs,
+# or for appending, then only digests of code and next indexes of keys are kept, so that memory doesn't grow with tests,
+# an incomplete chunk at the end (for example, the process was killed) is dropped when the archive is opened for appending,
+# readers never change the file
+class Archive:
+
+    def __init__(self, filename, append = False):
+        self.filename = filename
+        self.appending = append
+        self.digests = set()
+        self.indexes = {}
+        self.tests = []
+        self.by_target = {}
+        self.by_case = {}
+        self.file = None
+        self.compressor = None
+        if os.path.isfile(filename): self.load()
+
+    # reads all records, and truncates an incomplete chunk at the end if the archive is opened for appending
+    def load(self):
+        end = 0
+        for data, end in self.chunks():
+            for header, code in records(data):
+                if header['type'] == BLOB: self.digests.add(header['digest'])
+                elif header['type'] == TEST: self.add(header)
+        if self.appending and end < os.path.getsize(self.filename):
+            os.truncate(self.filename, end)
+
+    # yields decompressed chunks and offsets of their ends
+    def chunks(self):
+        decompressor = None
+        with open(self.filename, 'rb') as f:
+            while True:
+                header = f.read(CHUNK_HEADER.size)
+                if len(header) < CHUNK_HEADER.size: return
+                kind, size = CHUNK_HEADER.unpack(header)
+                payload = f.read(size)
+                if len(payload) < size: return
+                if kind == STREAM_START: decompressor = zlib.decompressobj()
+                if decompressor == None: return
+                try:
+                    data = decompressor.decompress(payload)
+                except zlib.error:
+                    return
+                yield data, f.tell()
+
+    # tests which were merged from directories don't have targets, their subdirectories are used instead
+    def add(self, test):
+        self.indexes[test['key']] = max(self.indexes.get(test['key'], 0), test['index'] + 1)
+        if self.appending: return
+        self.tests.append(test)
+        target = test['target'] or test['subdir'].replace('/', '.')
+        self.by_target.setdefault(target, []).append(test)
+        if test['case'] != None: self.by_case[test['case']] = test
+
+    # appends a test, its code is stored only if the same code was not stored before
+    def append(self, subdir, key, index, code, target = None, case = None):
+        if not self.appending: raise Exception('Archive is opened for reading: {0}'.format(self.filename))
+        kind = STREAM_CONTINUATION
+        if self.file == None:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory): os.makedirs(directory)
+            self.file = open(self.filename, 'ab')
+            self.compressor = zlib.compressobj()
+            kind = STREAM_START
+        data = b''
+        code = code.encode('utf-8')
+        digest = hashlib.sha1(code).hexdigest()
+        if not digest in self.digests:
+            self.digests.add(digest)
+            data = header_of({ 'type': BLOB, 'digest': digest, 'size': len(code) }) + code
+        test = { 'type': TEST, 'subdir': subdir, 'key': key, 'index': index,
+                 'target': target, 'case': case, 'digest': digest }
+        data = data + header_of(test)
+        # flush every test, so that tests which ran before a crash are not lost
+        payload = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.file.write(CHUNK_HEADER.pack(kind, len(payload)) + payload)
+        self.file.flush()
+        self.add(test)
+
+    # returns code of a test
+    def code(self, test):
+        return next(self.read([test]))[1]
+
+    # yields specified tests with their code, the archive is read only once
+    def read(self, tests):
+        if self.file != None: self.file.flush()
+        wanted = set(test['digest'] for test in tests)
+        codes = {}
+        for data, end in self.chunks():
+            for header, code in records(data):
+                if header['type'] == BLOB and header['digest'] in wanted:
+                    codes[header['digest']] = code.decode('utf-8')
+        for test in tests:
+            yield test, codes[test['digest']]
+
+    # returns a next index for every key, so that new tests don't reuse indexes of stored tests
+    def next_indexes(self):
+        return dict(self.indexes)
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+            self.compressor = None
+
+def header_of(record):
+    return (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+
+# yields headers and code of records in a decompressed chunk
+def records(data):
+    position = 0
+    while position < len(data):
+        end = data.index(b'\n', position)
+        header = json.loads(data[position:end].decode('utf-8'))
+        position = end + 1
+        code = None
+        if header['type'] == BLOB:
+            code = data[position:position + header['size']]
+            position = position + header['size']
+        yield header, code
+
+# returns an archive in specified directory, or None if there is no archive
+def archive_in(path):
+    filename = os.path.join(path, ARCHIVE)
+    if not os.path.isfile(filename): return None
+    return Archive(filename)
+
+# restores tests from an archive to <path>/<subdir>/<key>_<index>.py files, returns paths to the files
+def extract_tests(archive, tests, path):
+    filenames = []
+    for test, code in archive.read(tests):
+        directory = os.path.join(path, test['subdir'])
+        if not os.path.isdir(directory): os.makedirs(directory)
+        filename = os.path.join(directory, '{0:s}_{1:d}.py'.format(test['key'], test['index']))
+        with open(filename, 'w') as f: f.write(code)
+        filenames.append(filename)
+    return filenames
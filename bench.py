@@ -0,0 +1,279 @@
+#!/usr/bin/python
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import core
+
+from core import ConstructorCaller, FunctionCaller, MethodCaller, SubsequentMethodCaller
+from core import Stats, TargetClass, TargetFunction, TargetMethod
+from cases import apply_case, single_position_cases, combination_cases, parameter_types_of
+from cases import coroutine_cases, Shard
+from strategy import parse_strategy
+from fuzzer import DEFAULT_FUZZING_VALUES
+from fuzzer import CorrectParametersFuzzer, CoroutineFuzzer, SmartFunctionFuzzer, SmartMethodFuzzer
+from targets import TargetFinder
+
+# fixed workloads, they use native modules which are available in every CPython build
+MODULES = ('_json', '_struct', '_io', 'math', 'binascii')
+FUNCTION_MODULES = ('_json', '_struct', 'math', 'binascii')
+CLASSES = ('_io.StringIO', '_io.BytesIO')
+COROUTINES = ('_io.StringIO.__enter__', '_io.BytesIO.__enter__')
+
+# only a deterministic slice of cases is run for fuzzing workloads to keep the suite short
+SAMPLE = Shard(1, 4)
+COROUTINE_STRATEGY = 'pairwise'
+
+DEFAULT_THRESHOLD = 0.2
+
+# name -> (description, true if bigger values are better)
+METRICS = {
+    'discovery_seconds':          ('discovery of targets in all modules, seconds', False),
+    'search_seconds':             ('search for correct parameters, seconds', False),
+    'search_cases':               ('search for correct parameters, cases', False),
+    'function_cases_per_second':  ('function fuzzing, cases per second', True),
+    'method_cases_per_second':    ('method fuzzing, cases per second', True),
+    'coroutine_cases_per_second': ('coroutine fuzzing, cases per second', True),
+    'method_rendering_us':        ('rendering of a method case, us', False),
+    'throw_rendering_us':         ('rendering of a throw() case with pairwise strategy, us', False),
+    'case_bytes':                 ('memory per queued case, bytes', False),
+    'method_bytes':               ('memory of targets and callers per method, bytes', False),
+    'peak_rss_kb':                ('peak RSS, KB', False),
+}
+
+# replaces execution of generated code, so that only rendering is measured
+def no_execution(code):
+    return { 'r': None }
+
+# creates a class with a constructor which takes one parameter,
+# and a method which takes specified number of parameters
+def create_class(number_of_parameters):
+    clazz = TargetClass(None, 'module', 'Class')
+    constructor = TargetMethod('__init__', 'module', clazz)
+    constructor.set_parameters(1)
+    clazz.add_method(constructor)
+    method = TargetMethod('method', 'module', clazz)
+    method.set_parameters(number_of_parameters)
+    clazz.add_method(method)
+    return clazz, method
+
+# renders code for method cases the same way as SmartMethodFuzzer does,
+# returns time per case in microseconds
+def bench_method_rendering(number_of_parameters, repeat):
+    clazz, method = create_class(number_of_parameters)
+    caller = MethodCaller(method, ConstructorCaller(clazz))
+    base_values = list(caller.get_parameter_values())
+    values = DEFAULT_FUZZING_VALUES
+    cases = list(single_position_cases(method.fullname(), 'call', number_of_parameters, len(values)))
+    start = time.perf_counter()
+    for i in range(repeat):
+        for case in cases:
+            apply_case(caller, case, base_values, values)
+            caller.prepare()
+            caller.call()
+    return (time.perf_counter() - start) / (repeat * len(cases)) * 1000000
+
+# renders code for throw() cases the same way as CoroutineFuzzer does
+def bench_subsequent_rendering(strategy, repeat):
+    clazz, method = create_class(1)
+    caller = MethodCaller(method, ConstructorCaller(clazz))
+    subsequent_caller = SubsequentMethodCaller(caller, 'throw', parameter_types_of('throw'))
+    values = DEFAULT_FUZZING_VALUES
+    cases = list(combination_cases(method.fullname(), 'throw', 3, len(values), parse_strategy(strategy)))
+    start = time.perf_counter()
+    for i in range(repeat):
+        for case in cases:
+            apply_case(subsequent_caller, case, [], values)
+            subsequent_caller.prepare()
+            subsequent_caller.call()
+    return (time.perf_counter() - start) / (repeat * len(cases)) * 1000000
+
+# queues cases for a method the same way as they would be queued for parallel execution:
+# every case of the method is followed by cases for coroutines,
+# returns memory per queued case in bytes
+def bench_case_memory(number_of_parameters, number_of_values, strategy):
+    strategy = parse_strategy(strategy)
+    tracemalloc.start()
+    cases = []
+    for case in single_position_cases('module.Class.method', 'call', number_of_parameters, number_of_values):
+        cases.append(case)
+        cases.extend(coroutine_cases(case, number_of_values, strategy))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(cases)
+
+# creates targets and callers for a class with specified number of methods,
+# returns memory per method in bytes
+def bench_target_memory(number_of_methods):
+    tracemalloc.start()
+    callers = []
+    for i in range(number_of_methods):
+        clazz, method = create_class(3)
+        callers.append(MethodCaller(method, ConstructorCaller(clazz)))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / number_of_methods
+
+# runs a workload, and returns a number of run cases and spent time
+def measure(workload):
+    tests = Stats.get().tests
+    start = time.perf_counter()
+    workload()
+    return Stats.get().tests - tests, time.perf_counter() - start
+
+def rate(tests, seconds):
+    if seconds == 0: return 0
+    return tests / seconds
+
+# fuzzing workloads against real native modules, they don't store tests
+class Suite:
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self):
+        self.bench_discovery()
+        self.bench_search()
+        self.bench_functions()
+        self.bench_methods()
+        self.bench_coroutines()
+        self.bench_rendering()
+        self.results['case_bytes'] = bench_case_memory(3, 20, 'exhaustive')
+        self.results['method_bytes'] = bench_target_memory(1000)
+        self.results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return self.results
+
+    def bench_discovery(self):
+        start = time.perf_counter()
+        targets = TargetFinder(None, list(MODULES)).run('')
+        self.results['discovery_seconds'] = time.perf_counter() - start
+        self.targets = {}
+        for target in targets: self.targets[target.fullname()] = target
+
+    def functions(self):
+        for target in self.targets.values():
+            if isinstance(target, TargetFunction) and target.module in FUNCTION_MODULES:
+                yield target
+
+    def bench_search(self):
+        def workload():
+            for function in self.functions():
+                if function.has_unknown_parameters() or function.number_of_parameters() < 2: continue
+                fuzzer = CorrectParametersFuzzer(FunctionCaller(function))
+                fuzzer.set_output_path(None)
+                fuzzer.run()
+        tests, seconds = measure(workload)
+        self.results['search_seconds'] = seconds
+        self.results['search_cases'] = tests
+
+    def bench_functions(self):
+        def workload():
+            for function in self.functions():
+                fuzzer = SmartFunctionFuzzer(function)
+                fuzzer.set_output_path(None)
+                fuzzer.set_case_filter(SAMPLE)
+                fuzzer.run()
+        self.results['function_cases_per_second'] = rate(*measure(workload))
+
+    # returns a caller for a constructor of specified class which creates an instance
+    def constructor_caller(self, clazz):
+        fuzzer = CorrectParametersFuzzer(ConstructorCaller(clazz))
+        fuzzer.set_output_path(None)
+        fuzzer.run()
+        if not fuzzer.success():
+            raise Exception('could not create an instance of {0:s}'.format(clazz.fullname()))
+        return fuzzer.get_caller()
+
+    def bench_methods(self):
+        callers = [self.constructor_caller(self.targets[name]) for name in CLASSES]
+        def workload():
+            for constructor_caller in callers:
+                for method in constructor_caller.clazz.get_methods():
+                    fuzzer = SmartMethodFuzzer(method, constructor_caller)
+                    fuzzer.disable_coroutine_fuzzing()
+                    fuzzer.set_output_path(None)
+                    fuzzer.set_case_filter(SAMPLE)
+                    fuzzer.run()
+        self.results['method_cases_per_second'] = rate(*measure(workload))
+
+    def bench_coroutines(self):
+        callers = []
+        for name in COROUTINES:
+            classname, method_name = name.rsplit('.', 1)
+            clazz = self.targets[classname]
+            callers.append(MethodCaller(clazz.methods[method_name], self.constructor_caller(clazz)))
+        def workload():
+            for caller in callers:
+                fuzzer = CoroutineFuzzer(caller)
+                fuzzer.set_output_path(None)
+                fuzzer.set_strategy(parse_strategy(COROUTINE_STRATEGY))
+                fuzzer.run()
+        self.results['coroutine_cases_per_second'] = rate(*measure(workload))
+
+    # rendering is measured without execution of generated code
+    def bench_rendering(self):
+        store_and_execute = core.store_and_execute
+        core.store_and_execute = no_execution
+        try:
+            self.results['method_rendering_us'] = bench_method_rendering(3, self.repeat)
+            self.results['throw_rendering_us'] = bench_subsequent_rendering('pairwise', 1)
+        finally:
+            core.store_and_execute = store_and_execute
+
+# compares results with a baseline, returns a list of regressions
+def compare(results, baseline, threshold):
+    regressions = []
+    for name in METRICS:
+        description, bigger_is_better = METRICS[name]
+        if not name in results: continue
+        value = results[name]
+        if not name in baseline or baseline[name] == 0:
+            print('{0:s}: {1:.1f}'.format(description, value))
+            continue
+        change = (value - baseline[name]) / baseline[name]
+        print('{0:s}: {1:.1f} (baseline {2:.1f}, {3:+.1f}%)'.format(description, value, baseline[name], change * 100))
+        if bigger_is_better: change = -change
+        if change > threshold: regressions.append(name)
+    return regressions
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--repeat',    help='how many times rendering workloads are repeated', type=int, default=20)
+parser.add_argument('--baseline',  help='path to results of a previous run to compare with')
+parser.add_argument('--save',      help='path to a file where results should be stored')
+parser.add_argument('--threshold', help='relative change which is treated as a regression',
+                    type=float, default=DEFAULT_THRESHOLD)
+args = parser.parse_args()
+
+baseline = {}
+if args.baseline:
+    with open(args.baseline) as f: baseline = json.load(f)
+if args.save: args.save = os.path.abspath(args.save)
+
+# generated code is executed in a temporary directory,
+# fuzzers print a lot, so their output is discarded
+directory = tempfile.mkdtemp(prefix='pyconfusion-bench-')
+cwd = os.getcwd()
+os.chdir(directory)
+try:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = Suite(args.repeat).run()
+finally:
+    os.chdir(cwd)
+    shutil.rmtree(directory, ignore_errors=True)
+
+regressions = compare(results, baseline, args.threshold)
+
+if args.save:
+    with open(args.save, 'w') as f: json.dump(results, f, indent=4, sort_keys=True)
+
+if regressions:
+    print('regressions: {0:s}'.format(', '.join(regressions)))
+    exit(1)
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from core import print_with_prefix, Stats
+
+COMPLETED_MODULES = 'fuzzed_modules'
+PROGRESS = 'progress'
+LOG = 'fuzzer.log'
+CRASHES = 'crashes'
+LATEST_TEST = 'latest_test.py'
+
+BEGIN = 'begin'
+END = 'end'
+
+DEFAULT_ASAN_OPTIONS = 'detect_leaks=0 allocator_may_return_null=1'
+
+PYCONFUSION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pyconfusion.py')
+
+# writes content to a file atomically, readers see either the old file or the new one
+def write_atomically(filename, content):
+    temporary = '{0:s}.tmp-{1:d}'.format(filename, os.getpid())
+    with open(temporary, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, filename)
+
+def read_lines(filename):
+    if not os.path.isfile(filename): return []
+    with open(filename, encoding='utf-8', errors='ignore') as f:
+        return [line.strip() for line in f if line.strip()]
+
+# records which targets a fuzzer began and finished,
+# every line is appended and flushed before the target runs, so that the record survives a crash
+#
+# begin _io.StringIO
+# end _io.StringIO
+# begin _io.BytesIO       <- the fuzzer crashed while fuzzing this target
+class Progress:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.begun = []
+        self.ended = set()
+        for line in read_lines(filename):
+            state, separator, target = line.partition(' ')
+            if state == BEGIN: self.begun.append(target)
+            if state == END: self.ended.add(target)
+
+    # returns true if a target was already run, a target which crashed the fuzzer is not run again
+    def seen(self, target):
+        return target in self.begun
+
+    # returns the last target which began but didn't end, or None
+    def crashed(self):
+        for target in reversed(self.begun):
+            if not target in self.ended: return target
+        return None
+
+    def begin(self, target):
+        self.append(BEGIN, target)
+        self.begun.append(target)
+
+    def end(self, target):
+        self.append(END, target)
+        self.ended.add(target)
+
+    def append(self, state, target):
+        with open(self.filename, 'a') as f:
+            f.write('{0:s} {1:s}\n'.format(state, target))
+            f.flush()
+            os.fsync(f.fileno())
+
+# fuzzes modules in parallel, every module is fuzzed by a separate interpreter in its own directory:
+#
+#   out/fuzzed_modules          - modules which are done, the file is replaced atomically
+#   out/<module>/fuzzer.log     - output of the fuzzer
+#   out/<module>/progress       - targets which the fuzzer began and finished
+#   out/<module>/crashes/       - latest tests of targets which crashed the fuzzer
+#   out/<module>/...            - generated tests
+#
+# if a fuzzer crashes, it's restarted, and goes on with the next target,
+# a module is given up if the fuzzer crashes before it begins a new target
+class Campaign:
+
+    def __init__(self, modules, out, jobs, options, python = sys.executable, environment = {}, name = 'Campaign'):
+        self.name = name
+        self.modules = modules
+        self.out = os.path.abspath(out)
+        self.jobs = jobs
+        self.options = options
+        self.python = python
+        self.environment = environment
+        self.completed_filename = os.path.join(self.out, COMPLETED_MODULES)
+        self.completed = read_lines(self.completed_filename)
+        self.failed = []
+        self.crashes = []
+        self.pending = [module for module in modules if not module in self.completed]
+        self.attempted = len(self.pending)
+        self.lock = threading.Lock()
+
+    def run(self):
+        if not os.path.isdir(self.out): os.makedirs(self.out)
+        skipped = len(self.modules) - len(self.pending)
+        if skipped > 0:
+            self.log('skip {0:d} modules listed in {1:s}'.format(skipped, self.completed_filename))
+        if len(self.pending) == 0:
+            self.warn('no modules to fuzz! exiting ...')
+            return
+        self.log('fuzz {0:d} modules with {1:d} jobs'.format(len(self.pending), self.jobs))
+        threads = [threading.Thread(target=self.work) for i in range(min(self.jobs, len(self.pending)))]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.report()
+
+    def work(self):
+        while True:
+            with self.lock:
+                if len(self.pending) == 0: return
+                module = self.pending.pop(0)
+            if self.fuzz(module): self.complete(module)
+            else:
+                with self.lock: self.failed.append(module)
+
+    # runs a fuzzer for a module until it exits normally, returns false if the module was given up
+    def fuzz(self, module):
+        directory = os.path.join(self.out, module)
+        if not os.path.isdir(directory): os.makedirs(directory)
+        progress_filename = os.path.join(directory, PROGRESS)
+        while True:
+            begun = len(Progress(progress_filename).begun)
+            self.log('fuzz {0:s}'.format(module))
+            start = time.time()
+            code = self.run_fuzzer(module, directory)
+            if code == 0:
+                self.log('{0:s} is done in {1:.0f} seconds'.format(module, time.time() - start))
+                return True
+            progress = Progress(progress_filename)
+            target = progress.crashed()
+            if target == None or len(progress.begun) == begun:
+                self.warn('fuzzer crashed on {0:s} before it began a new target (exit code {1:d}), give up'.format(module, code))
+                return False
+            self.warn('{0:s} crashed the fuzzer (exit code {1:d}), restart {2:s}'.format(target, code, module))
+            self.save_crash(directory, target)
+
+    def run_fuzzer(self, module, directory):
+        command = [self.python, PYCONFUSION, '--command', 'fuzzer', '--modules', module,
+                   '--out', directory, '--progress', os.path.join(directory, PROGRESS)]
+        command.extend(self.options)
+        environment = dict(os.environ)
+        environment.setdefault('ASAN_OPTIONS', DEFAULT_ASAN_OPTIONS)
+        environment.update(self.environment)
+        with open(os.path.join(directory, LOG), 'a') as log:
+            return subprocess.call(command, cwd=directory, env=environment,
+                                   stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+
+    # keeps the latest test which most likely crashed the fuzzer
+    def save_crash(self, directory, target):
+        latest_test = os.path.join(directory, LATEST_TEST)
+        with self.lock: self.crashes.append(target)
+        if not os.path.isfile(latest_test): return
+        crashes = os.path.join(directory, CRASHES)
+        if not os.path.isdir(crashes): os.makedirs(crashes)
+        shutil.move(latest_test, os.path.join(crashes, target + '.py'))
+
+    def complete(self, module):
+        with self.lock:
+            self.completed.append(module)
+            write_atomically(self.completed_filename, ''.join(m + '\n' for m in self.completed))
+
+    def report(self):
+        for module in self.modules:
+            directory = os.path.join(self.out, module)
+            if os.path.isfile(os.path.join(directory, Stats.filename)):
+                Stats.get().load(directory)
+        self.log('{0:d} of {1:d} modules are done'.format(len(self.completed), len(self.modules)))
+        for target in self.crashes:
+            self.warn('{0:s} crashed the fuzzer, see {1:s} directory of its module'.format(target, CRASHES))
+        for module in self.failed:
+            self.warn('could not fuzz {0:s}, see {1:s}'.format(module, os.path.join(self.out, module, LOG)))
+        Stats.get().save(self.out)
+
+    # returns true if modules were run, but none of them could be fuzzed, for example, options are wrong
+    def failed_all(self):
+        return self.attempted > 0 and len(self.failed) == self.attempted
+
+    def log(self, message):
+        print_with_prefix(self.name, message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
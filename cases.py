@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+import functools
+import itertools
+import zlib
+
+from collections import namedtuple
+
+from core import ParameterType
+
+# subsequent methods which are called for coroutines, and their parameter types
+# TODO: what does throw() expect in the third parameter? TracebackException?
+COROUTINE_METHODS = (('close', ()),
+                     ('send',  (ParameterType.any_object,)),
+                     ('throw', (ParameterType.exception_type, ParameterType.exception, ParameterType.any_object)))
+
+# protocols which are used to drive asynchronous objects on an event loop,
+# and attributes which an object must have to support them
+ASYNC_PROTOCOLS = (('await',      '__await__'),
+                   ('async_for',  '__anext__'),
+                   ('async_with', '__aenter__'))
+
+SEARCH_PHASE = 'search'
+CALL_PHASE = 'call'
+SEQUENCE_PHASE = 'sequence'
+THREADS_PHASE = 'threads'
+LEAK_PHASE = 'leak'
+COMPLEXITY_PHASE = 'complexity'
+
+# a compact description of a single test case
+#   target    - full name of a fuzzed callable
+#   phase     - 'search' (looking for correct parameters), 'call' (fuzzing the callable),
+#               'sequence' (calling several methods of a class on the same instance),
+#               'leak' (calling the callable many times and watching memory),
+#               'complexity' (timing calls with inputs of growing size),
+#               or a name of subsequent method called for an object returned by parent case
+#   positions - parameter positions (starting from 1) which get values from a value table,
+#               or positions of steps in a sequence
+#   values    - indexes in the value table (or indexes of methods for sequences), one per position
+#   parent    - a case which returns an object for a subsequent method, None otherwise
+class Case(namedtuple('Case', ['target', 'phase', 'positions', 'values', 'parent'])):
+
+    __slots__ = ()
+
+    # returns an ID which is the same from run to run, for example
+    #   _io.StringIO.read:call:1=17
+    #   _io.StringIO.read:call:1=17/throw:1=0,2=5,3=7
+    def id(self):
+        values = ','.join('{0:d}={1:d}'.format(p, v) for p, v in zip(self.positions, self.values))
+        if self.parent != None:
+            return '{0:s}/{1:s}:{2:s}'.format(self.parent.id(), self.phase, values)
+        return '{0:s}:{1:s}:{2:s}'.format(self.target, self.phase, values)
+
+# sets values from a case to a caller, other parameters get base values
+def apply_case(caller, case, base_values, value_table):
+    for arg_number, value in enumerate(base_values, 1):
+        caller.set_parameter_value(arg_number, value)
+    for position, index in zip(case.positions, case.values):
+        caller.set_parameter_value(position, value_table[index])
+
+# cases for looking for correct parameters: all combinations of values for specified positions,
+# the last position changes first
+def search_cases(target, positions, number_of_values):
+    positions = tuple(positions)
+    for row in itertools.product(range(number_of_values), repeat=len(positions)):
+        yield Case(target, SEARCH_PHASE, positions, row, None)
+
+# cases which change one parameter at once
+# (tuples of positions and values are shared by all cases, so that queued cases stay small)
+def single_position_cases(target, phase, number_of_parameters, number_of_values, parent = None):
+    values = [(index,) for index in range(number_of_values)]
+    for position in range(1, number_of_parameters + 1):
+        positions = (position,)
+        for index in range(number_of_values):
+            yield Case(target, phase, positions, values[index], parent)
+
+# cases which change all parameters at once, combinations of values are built by a strategy
+def combination_cases(target, phase, number_of_parameters, number_of_values, strategy, parent = None):
+    positions = tuple(range(1, number_of_parameters + 1))
+    for row in strategy_rows(strategy, (number_of_values,) * number_of_parameters):
+        yield Case(target, phase, positions, row, parent)
+
+# returns rows of a strategy for sizes, rows which a strategy builds in memory (covering arrays)
+# are built once, and then shared by cases of all parents and targets,
+# for example, all throw() cases use the same rows, other rows are generated lazily
+def strategy_rows(strategy, sizes):
+    if strategy.builds_rows(list(sizes)): return shared_rows(strategy, sizes)
+    return strategy.rows(list(sizes))
+
+# strategies are equal if they have the same description, so that a strategy which is parsed for every target
+# finds rows which were built for previous targets
+@functools.lru_cache(maxsize=32)
+def shared_rows(strategy, sizes):
+    return tuple(tuple(row) for row in strategy.rows(list(sizes)))
+
+# cases for subsequent methods which are called for a coroutine returned by parent case
+def coroutine_cases(parent, number_of_values, strategy):
+    for method_name, parameter_types in COROUTINE_METHODS:
+        if len(parameter_types) == 0:
+            yield Case(parent.target, method_name, (), (), parent)
+        else:
+            yield from combination_cases(parent.target, method_name, len(parameter_types),
+                                         number_of_values, strategy, parent)
+
+# cases for driving an asynchronous object returned by parent case on an event loop,
+# one case per protocol which the type of the object supports
+def async_cases(parent, result_type):
+    for phase in async_protocols_of(result_type):
+        yield Case(parent.target, phase, (), (), parent)
+
+def async_protocols_of(result_type):
+    if result_type == None: return []
+    return [phase for phase, attribute in ASYNC_PROTOCOLS if hasattr(result_type, attribute)]
+
+def is_async_phase(phase):
+    return phase in [name for name, attribute in ASYNC_PROTOCOLS]
+
+# a case which runs parent case from several threads at once
+def thread_cases(parent):
+    yield Case(parent.target, THREADS_PHASE, (), (), parent)
+
+# cases for a method, expand(case) returns cases which follow a case of the method
+# (for example, cases for coroutines), expand is called after the case was consumed
+# if the method doesn't have parameters, only cases returned by expand are produced
+def method_cases(target, number_of_parameters, number_of_values, expand = None):
+    if number_of_parameters == 0:
+        case = Case(target, CALL_PHASE, (), (), None)
+        if expand: yield from expand(case)
+        return
+    for case in single_position_cases(target, CALL_PHASE, number_of_parameters, number_of_values):
+        yield case
+        if expand: yield from expand(case)
+
+# cases for sequences of method calls on the same instance of a class,
+# values are indexes of methods, sequences are built by a strategy in prefix order,
+# so that sequences with the same prefix follow each other
+# (lazy strategies generate rows in this order, and rows which are built in memory are sorted)
+def sequence_cases(target, length, number_of_methods, strategy):
+    positions = tuple(range(1, length + 1))
+    sizes = (number_of_methods,) * length
+    rows = strategy_rows(strategy, sizes)
+    if strategy.builds_rows(list(sizes)): rows = sorted(rows)
+    for row in rows:
+        yield Case(target, SEQUENCE_PHASE, positions, row, None)
+
+# accepts a deterministic slice of cases, so that a campaign may be split between several hosts,
+# cases for subsequent methods go to the same shard as their parent case,
+# so that a parent case never needs to be run on several hosts
+class Shard:
+
+    def __init__(self, index, count):
+        if count < 1 or index < 1 or index > count:
+            raise Exception('unexpected shard: {0}/{1}'.format(index, count))
+        self.index = index
+        self.count = count
+
+    def accept(self, case):
+        while case.parent != None: case = case.parent
+        return zlib.crc32(case.id().encode('utf-8')) % self.count == self.index - 1
+
+    def __str__(self):
+        return '{0:d}/{1:d}'.format(self.index, self.count)
+
+# creates a shard from a string like '2/8' (shards are numbered from 1)
+def parse_shard(string):
+    if not string: return None
+    try:
+        index, count = string.split('/')
+        return Shard(int(index), int(count))
+    except ValueError:
+        raise Exception('unexpected shard: {0}'.format(string))
+
+def parameter_types_of(method_name):
+    for name, parameter_types in COROUTINE_METHODS:
+        if name == method_name: return list(parameter_types)
+    raise Exception('unknown subsequent method: {0}'.format(method_name))
@@ -0,0 +1,285 @@
+#!/usr/bin/python
+
+import json
+import os
+
+from string import Template
+
+from core import MethodCaller, FunctionCaller, Imports
+from core import Stats, print_with_prefix, store_and_execute
+from cases import COMPLEXITY_PHASE, single_position_cases
+from fuzzer import TargetCallersFuzzer
+
+DEFAULT_MAX_INPUT_SIZE = 2 ** 16
+
+# sizes of inputs grow twice from this size
+MIN_INPUT_SIZE = 2 ** 6
+
+# a sweep stops after a call which takes longer
+MAX_CALL_SECONDS = 0.5
+
+# a growth exponent is fitted on the biggest sizes where a constant overhead of a call doesn't matter
+FIT_POINTS = 4
+
+# exponents which are reported: 1 is linear, n * log(n) is a bit more than 1, 2 is quadratic
+SUPERLINEAR_EXPONENT = 1.5
+
+# the biggest input should take at least this time, faster calls are too noisy
+MIN_SECONDS = 0.0001
+
+COMPLEXITY = 'complexity'
+REPORT = 'complexity.json'
+
+# a family of inputs of growing size, the template takes a size
+class Sweep:
+
+    __slots__ = ('name', 'template', 'limit', 'import_statement')
+
+    def __init__(self, name, template, limit = None, import_statement = None):
+        self.name = name
+        self.template = template
+        self.limit = limit
+        self.import_statement = import_statement
+
+    # returns sizes from the minimal size to the limit of the family or to specified limit
+    def sizes(self, max_size):
+        if self.limit != None: max_size = min(max_size, self.limit)
+        sizes = []
+        size = MIN_INPUT_SIZE
+        while size <= max_size:
+            sizes.append(size)
+            size = size * 2
+        return sizes
+
+# nesting is limited, so that C code which recurses over nested objects doesn't overflow the stack
+SWEEPS = (Sweep('string', '"x" * {0}'),
+          Sweep('digits', '"1" * {0}'),
+          Sweep('bytes', 'b"x" * {0}'),
+          Sweep('bytearray', 'bytearray(b"x" * {0})'),
+          Sweep('list', '[42] * {0}'),
+          Sweep('tuple', '(42,) * {0}'),
+          Sweep('distinct list', 'list(range({0}))'),
+          Sweep('dict', 'dict.fromkeys(range({0}))'),
+          Sweep('nested list', 'functools.reduce(lambda value, i: [value], range({0}), [])', 2 ** 10, 'import functools'),
+          Sweep('nested dict', 'functools.reduce(lambda value, i: {{"a": value}}, range({0}), {{}})', 2 ** 10,
+                'import functools'))
+
+# code which times calls with inputs of growing size, and fits a growth exponent,
+# it's a part of reproducers, so that they print a timing curve when they run as scripts
+COMPLEXITY_PROBE = """
+import gc
+import math
+import time
+
+# returns average time of a call with an input of specified size, or None if the call failed,
+# inputs and instances are created before calls, so that creating them is not timed
+def complexity_time(make, call, size, min_time = 0.01, max_calls = 100):
+    seconds = 0.0
+    calls = 0
+    while seconds < min_time and calls < max_calls:
+        object, value = make(size)
+        start = time.perf_counter()
+        try: call(object, value)
+        except Exception: return None
+        seconds = seconds + time.perf_counter() - start
+        calls = calls + 1
+    return seconds / calls
+
+# returns a list of sizes and times, it stops after a slow call, or after a call which failed
+def complexity_curve(make, call, sizes, max_seconds):
+    curve = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for size in sizes:
+            seconds = complexity_time(make, call, size)
+            if seconds == None: break
+            curve.append((size, seconds))
+            if seconds > max_seconds: break
+    finally:
+        if enabled: gc.enable()
+    return curve
+
+# returns a slope of log(time) over log(size) on the last points of a curve
+def complexity_exponent(curve, points):
+    curve = [(size, seconds) for size, seconds in curve[-points:] if seconds > 0]
+    if len(curve) < points: return None
+    xs = [math.log(size) for size, seconds in curve]
+    ys = [math.log(seconds) for size, seconds in curve]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+"""
+
+# calls a function or a method with inputs of growing size in one position, and times the calls,
+# a method is called on a new instance every time
+class ComplexityCaller:
+
+    __slots__ = ('caller', 'position', 'sweep', 'sizes', 'code')
+
+    template = """
+$imports
+$extra
+$probe
+$parameter_definitions
+
+def make(size):
+$make
+
+def call(object, value):
+    $call
+
+curve = complexity_curve(make, call, $sizes, $max_seconds)
+exponent = complexity_exponent(curve, $points)
+if __name__ == '__main__':
+    for size, seconds in curve: print('{0:d}\\t{1:.9f}'.format(size, seconds))
+    print('exponent: {0}'.format(exponent))
+"""
+
+    def __init__(self, caller, position, sweep, sizes):
+        self.caller = caller
+        self.position = position
+        self.sweep = sweep
+        self.sizes = sizes
+        self.prepare()
+
+    def target(self):
+        return self.caller.target()
+
+    def prepare(self):
+        self.caller.prepare()
+        imports = Imports()
+        imports.merge(self.caller.imports)
+        imports.add(self.sweep.import_statement)
+        value = self.sweep.template.format('size')
+        if type(self.caller) == MethodCaller:
+            parameter_definitions = self.caller.constructor_parameter_definitions + self.caller.method_parameter_definitions
+            make = ['object = {0:s}({1:s})'.format(self.caller.constructor_caller.classname(),
+                                                   ', '.join(self.caller.constructor_arguments)),
+                    'return object, {0:s}'.format(value)]
+            call = 'object.{0:s}({1:s})'.format(self.caller.method.name, self.arguments(self.caller.method_arguments))
+        elif type(self.caller) == FunctionCaller:
+            parameter_definitions = self.caller.parameter_definitions
+            make = ['return None, {0:s}'.format(value)]
+            call = '{0:s}.{1:s}({2:s})'.format(self.caller.function.module, self.caller.function.name,
+                                               self.arguments(self.caller.function_arguments))
+        else:
+            raise Exception('Unknown caller')
+        template = Template(ComplexityCaller.template)
+        self.code = template.substitute(imports = imports.code(),
+                                        extra = '\n'.join(sorted(self.caller.extra)),
+                                        probe = COMPLEXITY_PROBE,
+                                        parameter_definitions = '\n'.join(parameter_definitions),
+                                        make = '\n'.join('    ' + line for line in make),
+                                        call = call,
+                                        sizes = repr(self.sizes),
+                                        max_seconds = MAX_CALL_SECONDS,
+                                        points = FIT_POINTS)
+
+    # the parameter in the position gets an input, other parameters keep their values
+    def arguments(self, arguments):
+        arguments = list(arguments)
+        arguments[self.position - 1] = 'value'
+        return ', '.join(arguments)
+
+    # returns a timing curve and a growth exponent (None if the curve is too short)
+    def call(self):
+        self.prepare()
+        namespace = store_and_execute(self.code)
+        return namespace['curve'], namespace['exponent']
+
+    def log(self, message):
+        print_with_prefix('ComplexityCaller', message)
+
+# returns true if a curve grows clearly faster than linear
+def is_superlinear(curve, exponent):
+    return exponent != None and exponent >= SUPERLINEAR_EXPONENT and curve[-1][1] >= MIN_SECONDS
+
+# looks for parameter values which result to a successful call of a function or methods of a class
+# like other fuzzers do, then replaces a parameter with inputs of growing size, one position at once,
+# and fits a growth exponent of time per call on the biggest inputs,
+# an input is reported if the exponent is clearly above linear in two runs in a row
+# (a single run may be disturbed by other processes)
+class ComplexityFuzzer(TargetCallersFuzzer):
+
+    def __init__(self, target):
+        super().__init__(target, self.check)
+        self.max_input_size = DEFAULT_MAX_INPUT_SIZE
+        self.findings = []
+
+    def set_max_input_size(self, size):
+        self.max_input_size = size
+
+    # returns found inputs, every finding is a dictionary with a case ID, a position, a name of an input,
+    # a growth exponent, a timing curve and code of a reproducer
+    def get_findings(self): return self.findings
+
+    def check(self, caller):
+        target = caller.target()
+        self.log('time calls of {0:s} with growing inputs'.format(target.fullname()))
+        for case in single_position_cases(target.fullname(), COMPLEXITY_PHASE,
+                                          target.number_of_parameters(), len(SWEEPS)):
+            if not self.accept(case): continue
+            self.check_case(caller, case)
+
+    def check_case(self, caller, case):
+        position, sweep = case.positions[0], SWEEPS[case.values[0]]
+        complexity_caller = ComplexityCaller(caller, position, sweep, sweep.sizes(self.max_input_size))
+        for attempt in range(2):
+            result = self.measure(complexity_caller)
+            if result == None: return
+            curve, exponent = result
+            if not is_superlinear(curve, exponent): return
+        self.warn('time grows as n ** {0:.2f} in {1:s} with {2:s} in position {3:d}'
+                  .format(exponent, case.id(), sweep.name, position))
+        self.findings.append({ 'target': case.target, 'case': case.id(), 'position': position,
+                               'input': sweep.name, 'exponent': exponent, 'curve': curve,
+                               'code': complexity_caller.code })
+
+    def measure(self, complexity_caller):
+        try:
+            return complexity_caller.call()
+        except Exception as err:
+            self.log('exception {0}: {1}'.format(type(err), str(err)))
+            return None
+        finally:
+            Stats.get().increment_tests()
+
+    def log(self, message):
+        print_with_prefix('ComplexityFuzzer', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
+
+# collects inputs which make targets run in super-linear time
+#
+#   out/complexity.json     - targets, case IDs, inputs, growth exponents and timing curves
+#   out/complexity/<n>.py   - reproducers which print timing curves
+class ComplexityReport:
+
+    def __init__(self, out):
+        self.out = out
+        self.findings = []
+
+    def add(self, finding):
+        directory = os.path.join(self.out, COMPLEXITY)
+        if not os.path.isdir(directory): os.makedirs(directory)
+        finding = dict(finding)
+        code = finding.pop('code')
+        filename = os.path.join(directory, '{0:d}.py'.format(len(self.findings) + 1))
+        with open(filename, 'w') as f:
+            f.write('# case: {0:s}\n'.format(finding['case']))
+            f.write('# input: {0:s} in position {1:d}\n'.format(finding['input'], finding['position']))
+            f.write('# time grows as n ** {0:.2f}\n'.format(finding['exponent']))
+            f.write(code)
+        finding['reproducer'] = filename
+        self.findings.append(finding)
+
+    def save(self):
+        if not os.path.isdir(self.out): os.makedirs(self.out)
+        with open(os.path.join(self.out, REPORT), 'w') as f:
+            json.dump(self.findings, f, indent=4)
+        self.log('found {0:d} super-linear inputs, see {1:s}'.format(len(self.findings), os.path.join(self.out, REPORT)))
+
+    def log(self, message):
+        print_with_prefix('ComplexityReport', message)
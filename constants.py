@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+import ast
+import collections
+import re
+import warnings
+
+DEFAULT_MAX_CONSTANTS = 32
+
+MAX_STRING_LENGTH = 64
+MAX_INTEGER = 2 ** 64
+
+# these integers are everywhere, and don't tell anything about a module
+TRIVIAL_INTEGERS = (0, 1)
+
+COMMENTS = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+STRINGS = re.compile(r'"((?:[^"\\\n]|\\.)*)"')
+CHARACTERS = re.compile(r"'(?:[^'\\\n]|\\.)+'")
+INTEGERS = re.compile(r'(?<![\w.])(0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*(?![\w.])')
+DEFINES = re.compile(r'^\s*#\s*define\s+\w+\s+\(?\s*(0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*\s*\)?\s*$', re.MULTILINE)
+INCLUDES = re.compile(r'^\s*#\s*include[^\n]*$', re.MULTILINE)
+
+# looks for integer and string constants in C sources,
+# and returns them as code of fuzzing values, the most frequent constants go first:
+#   - integer literals, for example, flags and magic numbers
+#   - values of integer macros and their neighbours, for example, sizes of buffers
+#   - string literals, for example, format strings and keywords
+# a half of values are integers, and another half are strings
+def harvest_constants(sources, max_constants = DEFAULT_MAX_CONSTANTS):
+    integers = collections.Counter()
+    strings = collections.Counter()
+    for source in sources:
+        source = INCLUDES.sub('', COMMENTS.sub('', source))
+        for match in DEFINES.finditer(source):
+            value = int(match.group(1), 0)
+            for neighbour in (value - 1, value + 1): integers[neighbour] += 1
+        for match in STRINGS.finditer(source):
+            value = string_value(match.group(0))
+            if value != None: strings[value] += 1
+        source = CHARACTERS.sub('', STRINGS.sub('', source))
+        for match in INTEGERS.finditer(source):
+            integers[int(match.group(1), 0)] += 1
+    values = []
+    for value, count in integers.most_common():
+        if len(values) >= max_constants // 2: break
+        if value in TRIVIAL_INTEGERS or value > MAX_INTEGER: continue
+        values.append(str(value))
+    for value, count in strings.most_common():
+        if len(values) >= max_constants: break
+        values.append(value)
+    return values
+
+# returns Python code for a C string literal, or None if it's not a valid Python literal
+def string_value(literal):
+    if len(literal) < 3 or len(literal) > MAX_STRING_LENGTH + 2: return None
+    try:
+        # C allows escapes which are invalid in Python, and Python warns about them
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            value = ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(value, str): return None
+    return repr(value)
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+import collections
+import json
+import os
+import shutil
+import socket
+import socketserver
+import threading
+import time
+
+from core import print_with_prefix, read_tests, Stats, TestDump
+from cases import Shard
+
+DEFAULT_ADDRESS = 'localhost:7341'
+DEFAULT_UNITS_PER_TARGET = 4
+DEFAULT_LEASE_TIMEOUT = 30
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_DELAY = 1
+
+# parses 'host:port' for a TCP socket, anything else is treated as a path to a Unix socket
+def parse_address(address):
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return (host or 'localhost', int(port))
+    return address
+
+def connect(address):
+    if isinstance(address, tuple):
+        return socket.create_connection(address)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(address)
+    return s
+
+# sends a request to a coordinator, and returns a reply,
+# every request and reply is a JSON object on a single line
+def send_request(address, request):
+    with connect(address) as s:
+        with s.makefile('rw', encoding='utf-8') as f:
+            f.write(json.dumps(request) + '\n')
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise Exception('no reply from coordinator')
+    return json.loads(line)
+
+# a part of a campaign which is given to a worker: a slice of cases for a single target
+class WorkUnit:
+
+    def __init__(self, number, target, index, count):
+        self.number = number
+        self.target = target
+        self.index = index
+        self.count = count
+        self.attempts = 0
+        self.done = False
+        self.failed = False
+
+    def to_dict(self):
+        return { 'number': self.number, 'target': self.target, 'index': self.index, 'count': self.count }
+
+    def __str__(self):
+        return '{0:s} {1:d}/{2:d}'.format(self.target, self.index, self.count)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line: return
+        reply = self.server.coordinator.handle(json.loads(line.decode('utf-8')))
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+# serves work units to workers, every unit is leased to a worker for a while,
+# and the worker has to renew the lease until it uploads results,
+# if a lease expires (for example, the worker crashed), the unit is given to another worker
+class Coordinator:
+
+    def __init__(self, address, targets, out, units_per_target = DEFAULT_UNITS_PER_TARGET,
+                 lease_timeout = DEFAULT_LEASE_TIMEOUT, max_attempts = DEFAULT_MAX_ATTEMPTS):
+        self.address = parse_address(address)
+        self.out = out
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.units = []
+        for target in targets:
+            for index in range(1, units_per_target + 1):
+                self.units.append(WorkUnit(len(self.units), target, index, units_per_target))
+        self.pending = collections.deque(self.units)
+        self.leases = {}
+        self.next_lease = 1
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.dump = TestDump(out)
+
+    def run(self):
+        if len(self.units) == 0:
+            self.warn('no work units! exiting ...')
+            return
+        server = self.create_server()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.log('serve {0:d} work units on {1}'.format(len(self.units), self.address))
+        try:
+            while not self.finished.wait(RETRY_DELAY):
+                with self.lock: self.reap()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            if not isinstance(self.address, tuple) and os.path.exists(self.address):
+                os.unlink(self.address)
+        self.report()
+        if self.out: Stats.get().save(self.out)
+
+    def create_server(self):
+        if isinstance(self.address, tuple):
+            server = TCPServer(self.address, RequestHandler)
+        else:
+            if os.path.exists(self.address): os.unlink(self.address)
+            server = UnixServer(self.address, RequestHandler)
+        server.coordinator = self
+        return server
+
+    def handle(self, request):
+        with self.lock:
+            self.reap()
+            operation = request.get('op')
+            if operation == 'lease':    return self.lease(request['worker'])
+            if operation == 'renew':    return self.renew(request['lease'])
+            if operation == 'complete': return self.complete(request)
+            return { 'error': 'unknown operation: {0}'.format(operation) }
+
+    def lease(self, worker):
+        if len(self.pending) > 0:
+            unit = self.pending.popleft()
+            unit.attempts = unit.attempts + 1
+            lease = self.next_lease
+            self.next_lease = self.next_lease + 1
+            self.leases[lease] = [unit, worker, time.time() + self.lease_timeout]
+            self.log('give {0} to {1} (attempt {2:d})'.format(unit, worker, unit.attempts))
+            return { 'lease': lease, 'unit': unit.to_dict(), 'timeout': self.lease_timeout }
+        if len(self.leases) > 0:
+            return { 'wait': RETRY_DELAY }
+        return { 'done': True }
+
+    def renew(self, lease):
+        if not lease in self.leases:
+            return { 'expired': True }
+        self.leases[lease][2] = time.time() + self.lease_timeout
+        return { 'ok': True }
+
+    # stores uploaded tests, results of a unit are accepted only once
+    def complete(self, request):
+        if request['lease'] in self.leases:
+            del self.leases[request['lease']]
+        unit = self.units[request['unit']]
+        if unit.done:
+            return { 'ok': True }
+        unit.done = True
+        unit.failed = False
+        if unit in self.pending: self.pending.remove(unit)
+        self.log('{0} is done, {1:d} tests'.format(unit, request['tests']))
+        if self.out:
+            for subdir, key, code in request['files']:
+                self.dump.store_code_once(subdir, key, code)
+        Stats.get().merge(request['tests'], request['seconds'])
+        self.check_finished()
+        return { 'ok': True }
+
+    # re-issues units whose leases expired, a unit is given up after several attempts
+    # because most likely it crashes workers
+    def reap(self):
+        now = time.time()
+        for lease, (unit, worker, expiration) in list(self.leases.items()):
+            if expiration > now: continue
+            del self.leases[lease]
+            if unit.done: continue
+            if unit.attempts >= self.max_attempts:
+                unit.failed = True
+                self.warn('{0} failed on {1:d} workers, give up'.format(unit, unit.attempts))
+            else:
+                self.warn('lease of {0} expired on {1}, re-issue it'.format(unit, worker))
+                self.pending.appendleft(unit)
+        self.check_finished()
+
+    def check_finished(self):
+        if len(self.pending) == 0 and len(self.leases) == 0:
+            self.finished.set()
+
+    def report(self):
+        done = [unit for unit in self.units if unit.done]
+        failed = [unit for unit in self.units if unit.failed]
+        self.log('{0:d} of {1:d} work units are done'.format(len(done), len(self.units)))
+        for unit in failed:
+            self.warn('{0} crashed or hung workers, see latest_test.py in their directories'.format(unit))
+
+    def log(self, message):
+        print_with_prefix('Coordinator', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
+
+# takes work units from a coordinator, runs them with specified task, and uploads results,
+# every worker runs in its own directory, so that workers on the same host don't interfere
+# (a path to a Unix socket is made absolute before a worker goes to its directory)
+class Worker:
+
+    def __init__(self, address, task):
+        self.address = parse_address(address)
+        if not isinstance(self.address, tuple): self.address = os.path.abspath(self.address)
+        self.task = task
+        self.name = '{0:s}-{1:d}'.format(socket.gethostname(), os.getpid())
+        self.lease = None
+        self.lease_timeout = DEFAULT_LEASE_TIMEOUT
+        self.renewed = 0
+        self.progress = 0
+
+    def run(self):
+        self.task.load_targets()
+        directory = 'worker-{0:d}'.format(os.getpid())
+        if not os.path.isdir(directory): os.makedirs(directory)
+        os.chdir(directory)
+        heartbeat = threading.Thread(target=self.renew_leases, daemon=True)
+        heartbeat.start()
+        while True:
+            try:
+                reply = send_request(self.address, { 'op': 'lease', 'worker': self.name })
+            except OSError as err:
+                self.warn('coordinator is not available, exiting: {0}'.format(err))
+                break
+            if 'done' in reply:
+                self.log('no more work units')
+                break
+            if 'wait' in reply:
+                time.sleep(reply['wait'])
+                continue
+            self.lease_timeout = reply['timeout']
+            self.renewed = time.time()
+            self.progress = Stats.get().tests
+            self.lease = reply['lease']
+            self.run_unit(reply['unit'])
+            self.lease = None
+
+    def run_unit(self, unit):
+        self.log('run {0:s} {1:d}/{2:d}'.format(unit['target'], unit['index'], unit['count']))
+        out = 'unit-{0:d}'.format(unit['number'])
+        tests = Stats.get().tests
+        start = time.time()
+        self.task.fuzz_unit(unit['target'], Shard(unit['index'], unit['count']), out)
+        files = []
+        if os.path.isdir(out): files = read_tests(out)
+        send_request(self.address, { 'op': 'complete', 'lease': self.lease, 'unit': unit['number'],
+                                     'tests': Stats.get().tests - tests, 'seconds': time.time() - start,
+                                     'files': files })
+        shutil.rmtree(out, ignore_errors=True)
+
+    # renews current lease three times per lease timeout if tests were run since the previous renewal,
+    # so that a lease of a worker which hangs in a test expires, and the unit is given to another worker
+    def renew_leases(self):
+        while True:
+            time.sleep(min(RETRY_DELAY, self.lease_timeout / 3))
+            lease = self.lease
+            if lease == None or time.time() - self.renewed < self.lease_timeout / 3: continue
+            tests = Stats.get().tests
+            if tests == self.progress: continue
+            try:
+                send_request(self.address, { 'op': 'renew', 'lease': lease })
+                self.renewed = time.time()
+                self.progress = tests
+            except Exception as err:
+                self.warn('could not renew lease: {0}'.format(err))
+
+    def log(self, message):
+        print_with_prefix('Worker', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
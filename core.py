@@ -1,13 +1,22 @@
 #!/usr/bin/python
 
+import cProfile
 import datetime
+import hashlib
+import itertools
+import json
+import re
+import sys
 import textwrap
+import threading
 import time
 import os
 
 from enum import Enum
 from string import Template
 
+from archive import Archive, archive_in, ARCHIVE
+
 # print out a message with prefix
 def print_with_prefix(prefix, message):
     print('[{0:s}] {1}'.format(prefix, message))
@@ -24,14 +33,26 @@ def print_with_indent(prefix, first_message, other_messages):
             print(wrapper.fill(message))
 
 # logs specified code to a temporary file, runs the code, and delete the file
+# returns a dict with variables defined by the code
 def store_and_execute(code):
+    return execute_with_log(code, code, {})
+
+# logs 'logged_code' to a temporary file, runs 'code' in specified namespace, and delete the file,
+# the logged code may be bigger than the code which is run, for example,
+# it may contain previous calls of a sequence which have already been run in the namespace
+def execute_with_log(code, logged_code, namespace):
     filename = 'latest_test.py'
-    with open(filename, 'w') as text_file:
-        text_file.write(code)
+    with stage_timer(LATEST_TEST_STAGE):
+        with open(filename, 'w') as text_file:
+            text_file.write(logged_code)
     try:
-        exec(code)
+        with stage_timer(COMPILE_STAGE):
+            compiled = compile(code, '<string>', 'exec')
+        with stage_timer(EXECUTION_STAGE):
+            exec(compiled, namespace)
     finally:
         os.unlink(filename)
+    return namespace
 
 class Singleton(type):
     _instances = {}
@@ -42,6 +63,8 @@ class Singleton(type):
 
 class Stats(metaclass=Singleton):
 
+    filename = 'stats.json'
+
     template = """
 Summary
 Total number of tests = $tests
@@ -59,13 +82,184 @@ Time = $time
     def increment_tests(self):
         self.tests = self.tests + 1
 
+    def seconds(self):
+        return time.time() - self.start_time
+
+    # adds results of another run which was running in parallel with this one
+    def merge(self, tests, seconds):
+        self.tests = self.tests + tests
+        self.start_time = min(self.start_time, time.time() - seconds)
+
+    # stores the stats to a file in specified directory
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, Stats.filename), 'w') as f:
+            json.dump({ 'tests': self.tests, 'seconds': self.seconds() }, f)
+
+    # loads stats which were stored to specified directory by save(),
+    # and merges them to the current stats
+    def load(self, path):
+        with open(os.path.join(path, Stats.filename)) as f:
+            data = json.load(f)
+        self.merge(data['tests'], data['seconds'])
+
     def print(self):
-        total_time = round(time.time() - self.start_time)
+        total_time = round(self.seconds())
         time_str = str(datetime.timedelta(seconds=total_time))
         template = Template(Stats.template)
         out = template.substitute(tests = self.tests, time = time_str)
         print(out)
 
+# stages which are measured by profiler
+DISCOVERY_STAGE = 'discovery'
+RENDERING_STAGE = 'rendering'
+LATEST_TEST_STAGE = 'latest_test'
+COMPILE_STAGE = 'compile'
+EXECUTION_STAGE = 'execution'
+DUMP_STAGE = 'dump'
+
+# measures time spent in fuzzing stages, and optionally runs cProfile
+# results are stored to a directory:
+#   stages.json  - total time and number of calls per stage
+#   trace.json   - spans (for example, targets) in Chrome trace format,
+#                  stages are aggregated per span, so that the file stays small
+#   cprofile.out - cProfile results which can be read by pstats module
+class Profiler:
+
+    # a profiler which is currently running, or None
+    current = None
+
+    template = """
+Profile
+$stages
+Other = $other
+"""
+
+    def __init__(self, path, use_cprofile = False):
+        self.path = os.path.abspath(path)
+        self.cprofile = None
+        if use_cprofile: self.cprofile = cProfile.Profile()
+        self.totals = {}
+        self.spans = []
+
+    def start(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.trace = open(os.path.join(self.path, 'trace.json'), 'w')
+        self.trace.write('[\n')
+        self.origin = time.perf_counter()
+        Profiler.current = self
+        if self.cprofile: self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(os.path.join(self.path, 'cprofile.out'))
+        Profiler.current = None
+        self.seconds = time.perf_counter() - self.origin
+        self.write_event({ 'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': { 'name': 'pyconfusion' } }, ']\n')
+        self.trace.close()
+        with open(os.path.join(self.path, 'stages.json'), 'w') as f:
+            stages = {}
+            for name in self.totals:
+                seconds, count = self.totals[name]
+                stages[name] = { 'seconds': seconds, 'count': count }
+            json.dump({ 'seconds': self.seconds, 'stages': stages }, f, indent=4, sort_keys=True)
+
+    # adds time spent in a stage to the totals and to the innermost span,
+    # if there is no span, the stage goes to the trace as is
+    def add(self, stage, start, end):
+        add_to_totals(self.totals, stage, end - start)
+        if len(self.spans) > 0:
+            add_to_totals(self.spans[-1][2], stage, end - start)
+        else:
+            self.write_span(stage, start, end - start, 'stage')
+
+    def open_span(self, name):
+        self.spans.append((name, time.perf_counter(), {}))
+
+    # stages of a span are put one after another inside the span in the trace
+    def close_span(self):
+        name, start, totals = self.spans.pop()
+        self.write_span(name, start, time.perf_counter() - start, 'span')
+        for stage in sorted(totals):
+            seconds, count = totals[stage]
+            self.write_span(stage, start, seconds, 'stage', { 'count': count })
+            start = start + seconds
+            if len(self.spans) > 0:
+                add_to_totals(self.spans[-1][2], stage, seconds, count)
+
+    def write_span(self, name, start, seconds, category, args = None):
+        event = { 'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                  'ts': (start - self.origin) * 1000000, 'dur': seconds * 1000000 }
+        if args: event['args'] = args
+        self.write_event(event)
+
+    def write_event(self, event, end = ',\n'):
+        self.trace.write(json.dumps(event) + end)
+
+    def print(self):
+        lines = []
+        profiled = 0
+        for name in sorted(self.totals, key=lambda name: -self.totals[name][0]):
+            seconds, count = self.totals[name]
+            profiled = profiled + seconds
+            lines.append('{0:s} = {1:.3f}s in {2:d} calls'.format(name, seconds, count))
+        template = Template(Profiler.template)
+        print(template.substitute(stages = '\n'.join(lines), other = '{0:.3f}s'.format(self.seconds - profiled)))
+
+def add_to_totals(totals, name, seconds, count = 1):
+    if name in totals:
+        totals[name][0] = totals[name][0] + seconds
+        totals[name][1] = totals[name][1] + count
+    else:
+        totals[name] = [seconds, count]
+
+class StageTimer:
+
+    __slots__ = ('profiler', 'stage', 'start')
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.add(self.stage, self.start, time.perf_counter())
+
+class SpanTimer:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.open_span(self.name)
+
+    def __exit__(self, *args):
+        self.profiler.close_span()
+
+# used instead of timers if profiling is off
+class NoTimer:
+
+    def __enter__(self): pass
+    def __exit__(self, *args): pass
+
+NO_TIMER = NoTimer()
+
+# returns a context manager which measures time spent in a stage
+def stage_timer(stage):
+    if Profiler.current == None: return NO_TIMER
+    return StageTimer(Profiler.current, stage)
+
+# returns a context manager which puts everything inside it to a span with specified name
+def span_timer(name):
+    if Profiler.current == None: return NO_TIMER
+    return SpanTimer(Profiler.current, name)
+
 class ParameterType(Enum):
     unknown = 'unknown'
     byte_like_object = 'byte-like object'
@@ -76,6 +270,15 @@ class ParameterType(Enum):
     string = 'string'
     exception = 'exception'
     exception_type = 'exception type'
+    byte_array = 'bytearray'
+    buffer = 'buffer'
+    writable_buffer = 'writable buffer'
+    byte = 'byte'
+    character = 'character'
+    complex = 'complex'
+    tuple = 'tuple'
+    list = 'list'
+    dictionary = 'dictionary'
 
     def __str__(self):
         return self.value
@@ -98,12 +301,32 @@ class ParameterType(Enum):
             return 'Exception()'
         if ptype == ParameterType.exception_type:
             return 'Exception'
+        if ptype == ParameterType.byte_array:
+            return 'bytearray()'
+        if ptype == ParameterType.buffer:
+            return 'b\'buffer\''
+        if ptype == ParameterType.writable_buffer:
+            return 'bytearray(16)'
+        if ptype == ParameterType.byte:
+            return 'b\'x\''
+        if ptype == ParameterType.character:
+            return '\'x\''
+        if ptype == ParameterType.complex:
+            return '1j'
+        if ptype == ParameterType.tuple:
+            return '(1, 2, 3)'
+        if ptype == ParameterType.list:
+            return '[1, 2, 3]'
+        if ptype == ParameterType.dictionary:
+            return '{\'a\': 1}'
 
         # TODO: anything better?
         return '(1, 2, 3)'
 
 class ParameterValue:
 
+    __slots__ = ('value', 'extra', 'imports')
+
     def __init__(self, value, extra = '', import_statement = None):
         self.value = value
         self.extra = extra
@@ -118,6 +341,8 @@ class ParameterValue:
 # contains import statements for caller classes
 class Imports:
 
+    __slots__ = ('froms', 'imports')
+
     def __init__(self):
         self.froms = set()
         self.imports = set()
@@ -137,10 +362,14 @@ class Imports:
         for string in imports.froms:   self.froms.add(string)
         for string in imports.imports: self.imports.add(string)
 
+    # returns a hashable description of the imports
+    def key(self):
+        return (frozenset(self.imports), frozenset(self.froms))
+
     # generate Python code with imports
     # 'import ...' startements go first, then 'from ...' startements go
     def code(self):
-        return '{0:s}\n{1:s}'.format('\n'.join(self.imports), '\n'.join(self.froms))
+        return '{0:s}\n{1:s}'.format('\n'.join(sorted(self.imports)), '\n'.join(sorted(self.froms)))
 
     def log(self, message):
         print_with_prefix('Imports', message)
@@ -148,13 +377,43 @@ class Imports:
     def warn(self, message):
         self.log('warning: {0:s}'.format(message))
 
+# every rendering of a caller gets a new stamp,
+# so that callers which depend on it can find out if they need to be rendered again
+rendering_stamps = itertools.count(1)
+
+# renders a definition of a parameter, returns a tuple (imports, extra, definition),
+# imports and extra are None if the value is not a ParameterValue
+def render_parameter(name, value):
+    if isinstance(value, ParameterValue):
+        return (value.imports, value.extra, '{0:s} = {1}\n'.format(name, value.value))
+    return (None, None, '{0:s} = {1}\n'.format(name, value))
+
+# renders parameters which changed since the last rendering,
+# 'slots' contains rendered parameters, and None for parameters which need to be rendered
+def render_parameters(parameter_values, slots, imports, extra, parameter_definitions, arguments):
+    arg_number = 1
+    for value in parameter_values:
+        name = 'p' + str(arg_number)
+        if slots[arg_number - 1] == None:
+            slots[arg_number - 1] = render_parameter(name, value)
+        value_imports, value_extra, pstr = slots[arg_number - 1]
+        if value_imports != None:
+            imports.merge(value_imports)
+            extra.add(value_extra)
+        parameter_definitions.append(pstr)
+        arguments.append(name)
+        arg_number = arg_number + 1
+
 class FunctionCaller:
 
+    __slots__ = ('function', 'parameter_values', 'slots', 'code', 'stamp',
+                 'imports', 'extra', 'parameter_definitions', 'function_arguments')
+
     basic_template = """
 $imports
 $extra
 $parameter_definitions
-$module_name.$function_name($function_arguments)
+r = $module_name.$function_name($function_arguments)
 """
 
     def __init__(self, function):
@@ -169,9 +428,15 @@ $module_name.$function_name($function_arguments)
         cloned = FunctionCaller(self.function)
         cloned.parameter_values = []
         for value in self.parameter_values: cloned.parameter_values.append(value)
+        cloned.slots = list(self.slots)
+        cloned.code = None
         return cloned
 
+    # the code is rendered again only if parameter values changed since the last call,
+    # only changed parameters are rendered again
     def prepare(self):
+        if self.code != None: return
+
         if self.function.has_unknown_parameters():
             raise Exception('function has unknown parameters')
         if self.function.number_of_parameters() != len(self.parameter_values):
@@ -184,29 +449,17 @@ $module_name.$function_name($function_arguments)
 
         self.imports.add('import ' + self.function.module)
 
-        arg_number = 1
-        for parameter_type in self.function.parameter_types:
-            value = self.parameter_values[arg_number-1]
-            name = 'p' + str(arg_number)
-
-            if type(value) is ParameterValue:
-                self.imports.merge(value.imports)
-                self.extra.add(value.extra)
-                pstr = '{0:s} = {1}\n'.format(name, value.value)
-            else:
-                pstr = '{0:s} = {1}\n'.format(name, value)
-
-            self.parameter_definitions.append(pstr)
-            self.function_arguments.append(name)
-            arg_number = arg_number + 1
+        render_parameters(self.parameter_values, self.slots, self.imports, self.extra,
+                          self.parameter_definitions, self.function_arguments)
 
         template = Template(FunctionCaller.basic_template)
         self.code = template.substitute(imports = self.imports.code(),
-                                        extra = '\n'.join(self.extra),
+                                        extra = '\n'.join(sorted(self.extra)),
                                         parameter_definitions = '\n'.join(self.parameter_definitions),
                                         module_name = self.function.module,
                                         function_name = self.function.name,
                                         function_arguments = ', '.join(self.function_arguments))
+        self.stamp = next(rendering_stamps)
 
     def set_parameters(self, n):
         self.function.set_parameters(n)
@@ -216,22 +469,32 @@ $module_name.$function_name($function_arguments)
         self.parameter_values = []
         for parameter_type in self.function.parameter_types:
             self.parameter_values.append(ParameterType.default_value(parameter_type))
+        self.slots = [None] * len(self.parameter_values)
+        self.code = None
 
+    # only marks the parameter as changed, the code is rendered in prepare()
     def set_parameter_value(self, arg_number, value):
+        if self.parameter_values[arg_number - 1] is value: return
         self.parameter_values[arg_number - 1] = value
+        self.slots[arg_number - 1] = None
+        self.code = None
 
     def get_parameter_values(self):
         return self.parameter_values
 
+    # returns an object which the function returned
     def call(self):
         self.prepare()
-        store_and_execute(self.code)
+        return store_and_execute(self.code)['r']
 
     def log(self, message):
         print_with_prefix('FunctionCaller', message)
 
 class ConstructorCaller:
 
+    __slots__ = ('clazz', 'constructor', 'caller', 'rendered', 'code', 'stamp',
+                 'imports', 'extra', 'parameter_definitions', 'constructor_arguments')
+
     basic_template = """
 $imports
 $extra
@@ -243,17 +506,20 @@ object = $class_name($constructor_arguments)
         self.clazz = clazz
         self.constructor = clazz.get_constructor()
         self.caller = FunctionCaller(self.constructor)
+        self.rendered = None
         self.prepare()
 
     def target(self):
         return self.constructor
 
+    # the code is rendered again only if the code of constructor call changed
     def prepare(self):
         if self.constructor == None:
-            self.warn('could not find a constructor of class: {0}'.format(clazz.name))
+            self.warn('could not find a constructor of class: {0}'.format(self.clazz.name))
             return
 
         self.caller.prepare()
+        if self.rendered == self.caller.stamp: return
 
         self.imports = Imports()
         self.imports.merge(self.caller.imports)
@@ -269,10 +535,12 @@ object = $class_name($constructor_arguments)
 
         template = Template(ConstructorCaller.basic_template)
         self.code = template.substitute(imports = self.imports.code(),
-                                        extra = '\n'.join(self.extra),
+                                        extra = '\n'.join(sorted(self.extra)),
                                         parameter_definitions = '\n'.join(self.caller.parameter_definitions),
                                         class_name = self.clazz.name,
                                         constructor_arguments = ', '.join(self.caller.function_arguments))
+        self.rendered = self.caller.stamp
+        self.stamp = next(rendering_stamps)
 
     def set_parameters(self, n):
         self.caller.set_parameters(n)
@@ -284,15 +552,16 @@ object = $class_name($constructor_arguments)
         return self.caller.get_parameter_values()
 
     def get_fuzzing_value(self):
+        self.prepare()
         template = Template('$class_name($constructor_arguments)')
         value = template.substitute(class_name = self.clazz.name,
                                     constructor_arguments = ', '.join(self.caller.function_arguments))
-        extra = '\n'.join(self.extra) + '\n'.join(self.caller.parameter_definitions)
+        extra = '\n'.join(sorted(self.extra)) + '\n'.join(self.caller.parameter_definitions)
         return ParameterValue(value, extra, self.imports)
 
     def call(self):
         if self.constructor == None:
-            self.warn('could not find a constructor of class: {0}'.format(clazz.name))
+            self.warn('could not find a constructor of class: {0}'.format(self.clazz.name))
             return
         self.prepare()
         store_and_execute(self.code)
@@ -308,6 +577,11 @@ object = $class_name($constructor_arguments)
 
 class MethodCaller:
 
+    __slots__ = ('method', 'constructor_caller', 'caller', 'rendered', 'code', 'stamp',
+                 'last_values', 'result_type', 'imports', 'extra',
+                 'constructor_parameter_definitions', 'constructor_arguments',
+                 'method_parameter_definitions', 'method_arguments')
+
     basic_template = """
 $imports
 $extra
@@ -321,6 +595,9 @@ r = object.$method_name($method_arguments)
         self.method = method
         self.constructor_caller = constructor_caller
         self.caller = FunctionCaller(method)
+        self.rendered = None
+        self.last_values = None
+        self.result_type = None
 
         # it needs to be called here because TestDump requests the code before execution
         # to prevent data lose if python crashes
@@ -329,15 +606,24 @@ r = object.$method_name($method_arguments)
     def clone(self):
         cloned = MethodCaller(self.method, self.constructor_caller)
         cloned.caller = self.caller.clone()
+        cloned.last_values = self.last_values
+        cloned.result_type = self.result_type
         return cloned
 
     def target(self):
         return self.method
 
-    def prepare(self, imports = Imports(), extra = set()):
+    # the code is rendered again only if the code of constructor or method call changed,
+    # or if other imports and extra code are passed
+    def prepare(self, imports = None, extra = None):
         self.constructor_caller.prepare()
         self.caller.prepare()
 
+        if imports == None: imports = Imports()
+        if extra == None: extra = set()
+        key = (self.constructor_caller.stamp, self.caller.stamp, imports.key(), frozenset(extra))
+        if self.rendered == key: return
+
         self.imports = Imports()
         self.imports.merge(imports)
         self.imports.merge(self.constructor_caller.imports)
@@ -355,13 +641,15 @@ r = object.$method_name($method_arguments)
 
         template = Template(MethodCaller.basic_template)
         self.code = template.substitute(imports = self.imports.code(),
-                                        extra = '\n'.join(self.extra),
+                                        extra = '\n'.join(sorted(self.extra)),
                                         class_name = self.constructor_caller.classname(),
                                         constructor_parameter_definitions = '\n'.join(self.constructor_parameter_definitions),
                                         constructor_arguments = ', '.join(self.constructor_arguments),
                                         method_name = self.method.name,
                                         method_parameter_definitions = '\n'.join(self.method_parameter_definitions),
                                         method_arguments = ', '.join(self.method_arguments))
+        self.rendered = key
+        self.stamp = next(rendering_stamps)
 
     def set_parameters(self, n):
         self.caller.set_parameters(n)
@@ -372,42 +660,67 @@ r = object.$method_name($method_arguments)
     def get_parameter_values(self):
         return self.caller.get_parameter_values()
 
+    # returns true if the method has already been called with current parameter values
+    def has_result(self):
+        return self.last_values == self.values_key()
+
+    def values_key(self):
+        return (tuple(self.constructor_caller.get_parameter_values()), tuple(self.get_parameter_values()))
+
+    # remembers a type of returned object (None if the call failed),
+    # so that CoroutineChecker doesn't have to run the same code again,
+    # returns the object
     def call(self):
         self.prepare()
-        store_and_execute(self.code)
+        self.last_values = self.values_key()
+        self.result_type = None
+        namespace = store_and_execute(self.code)
+        self.result_type = type(namespace['r'])
+        return namespace['r']
 
     def log(self, message):
         print_with_prefix('MethodCaller', message)
 
 class CoroutineChecker:
 
-    template = """
-$base_caller_code
-if not 'throw' in dir(r) and not 'send' in dir(r) and not 'close' in dir(r):
-    raise Exception('not a coroutine')
-"""
+    # results of previous checks: (method name, type of returned object) -> bool
+    cache = {}
 
     def __init__(self, caller):
         self.caller = caller
 
-    def prepare(self):
-        self.caller.prepare()
-        template = Template(CoroutineChecker.template)
-        self.code = template.substitute(base_caller_code = self.caller.code)
-
     def is_coroutine(self):
-        self.prepare()
-        try:
-            store_and_execute(self.code)
-            return True
-        except Exception:
-            return False
+        result_type = self.get_result_type()
+        key = (self.caller.target().fullname(), result_type)
+        if key not in CoroutineChecker.cache:
+            CoroutineChecker.cache[key] = looks_like_coroutine(result_type)
+        return CoroutineChecker.cache[key]
+
+    # the method is called only if it hasn't been called yet with current parameter values,
+    # otherwise the result of the previous call is used
+    def get_result_type(self):
+        with stage_timer(RENDERING_STAGE):
+            self.caller.prepare()
+        if not self.caller.has_result():
+            try:
+                self.caller.call()
+            except Exception:
+                pass
+        return self.caller.result_type
 
     def log(self, message):
         print_with_prefix('CoroutineChecker', message)
 
+# returns true if objects of specified type look like a coroutine (None means no object)
+def looks_like_coroutine(result_type):
+    if result_type == None: return False
+    return hasattr(result_type, 'throw') or hasattr(result_type, 'send') or hasattr(result_type, 'close')
+
 class SubsequentMethodCaller:
 
+    __slots__ = ('caller', 'method_name', 'parameter_types', 'parameter_values', 'slots',
+                 'dirty', 'rendered', 'code', 'imports', 'extra', 'parameter_definitions', 'method_arguments')
+
     template = """
 $base_caller_code
 $parameter_definitions
@@ -421,52 +734,293 @@ r.$method_name($method_arguments)
         self.parameter_values = []
         for parameter_type in parameter_types:
             self.parameter_values.append(ParameterType.default_value(parameter_type))
+        self.slots = [None] * len(self.parameter_values)
+        self.dirty = True
+        self.rendered = None
         self.prepare()
 
-    def prepare(self):
-        self.imports = Imports()
-        self.extra = set()
-        self.parameter_definitions = list()
-        self.method_arguments = list()
-
-        arg_number = 1
-        for parameter_type in self.parameter_types:
-            value = self.parameter_values[arg_number-1]
-            name = 'p' + str(arg_number)
-
-            if type(value) is ParameterValue:
-                self.imports.merge(value.imports)
-                self.extra.add(value.extra)
-                pstr = '{0:s} = {1}\n'.format(name, value.value)
-            else:
-                pstr = '{0:s} = {1}\n'.format(name, value)
+    def target(self):
+        return self.caller.target()
 
-            self.parameter_definitions.append(pstr)
-            self.method_arguments.append(name)
-            arg_number = arg_number + 1
+    # the code is rendered again only if parameter values or the base caller changed
+    def prepare(self):
+        if self.dirty:
+            self.imports = Imports()
+            self.extra = set()
+            self.parameter_definitions = list()
+            self.method_arguments = list()
+            render_parameters(self.parameter_values, self.slots, self.imports, self.extra,
+                              self.parameter_definitions, self.method_arguments)
 
         self.caller.prepare(self.imports, self.extra)
+        if not self.dirty and self.rendered == self.caller.stamp: return
 
         template = Template(SubsequentMethodCaller.template)
         self.code = template.substitute(base_caller_code = self.caller.code,
                                         parameter_definitions = '\n'.join(self.parameter_definitions),
                                         method_name = self.method_name,
                                         method_arguments = ', '.join(self.method_arguments))
+        self.dirty = False
+        self.rendered = self.caller.stamp
 
     def call(self):
         self.prepare()
         store_and_execute(self.code)
 
+    # only marks the parameter as changed, the code is rendered in prepare()
     def set_parameter_value(self, arg_number, value):
+        if self.parameter_values[arg_number - 1] is value: return
         self.parameter_values[arg_number - 1] = value
-        # TODO: can it be called in call()
-        self.prepare()
+        self.slots[arg_number - 1] = None
+        self.dirty = True
 
     def log(self, message):
         print_with_prefix('SubsequentMethodCaller', message)
 
+# runs a method from several threads at once on the same instance,
+# the threads wait for each other on a barrier, and then call the method several times,
+# so that races can be found on builds without GIL, for example, with ThreadSanitizer,
+# the code doesn't depend on timing, so that it can be run again and again under a race detector
+THREAD_ITERATIONS = 100
+
+class ConcurrentCaller:
+
+    __slots__ = ('caller', 'threads', 'code')
+
+    template = """
+$imports
+$extra
+$constructor_parameter_definitions
+object = $class_name($constructor_arguments)
+$method_parameter_definitions
+barrier = threading.Barrier($threads)
+
+def run():
+    barrier.wait()
+    for i in range($iterations):
+        try:
+            object.$method_name($method_arguments)
+        except Exception:
+            pass
+
+threads = [threading.Thread(target=run) for i in range($threads)]
+for thread in threads: thread.start()
+for thread in threads: thread.join()
+"""
+
+    def __init__(self, caller, threads):
+        self.caller = caller
+        self.threads = threads
+        self.prepare()
+
+    def target(self):
+        return self.caller.target()
+
+    def prepare(self):
+        self.caller.prepare()
+        imports = Imports()
+        imports.merge(self.caller.imports)
+        imports.add('import threading')
+        template = Template(ConcurrentCaller.template)
+        self.code = template.substitute(imports = imports.code(),
+                                        extra = '\n'.join(sorted(self.caller.extra)),
+                                        class_name = self.caller.constructor_caller.classname(),
+                                        constructor_parameter_definitions = '\n'.join(self.caller.constructor_parameter_definitions),
+                                        constructor_arguments = ', '.join(self.caller.constructor_arguments),
+                                        method_parameter_definitions = '\n'.join(self.caller.method_parameter_definitions),
+                                        method_name = self.caller.method.name,
+                                        method_arguments = ', '.join(self.caller.method_arguments),
+                                        threads = self.threads,
+                                        iterations = THREAD_ITERATIONS)
+
+    def call(self):
+        self.prepare()
+        store_and_execute(self.code)
+
+    def log(self, message):
+        print_with_prefix('ConcurrentCaller', message)
+
+# returns true if Python runs without GIL (free-threaded build)
+def gil_disabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled != None and not is_gil_enabled()
+
+# an asynchronous object is driven with one of the following coroutines,
+# hangs are interrupted by a timeout
+ASYNC_TIMEOUT = 1
+ASYNC_MAX_ITERATIONS = 100
+
+ASYNC_DRIVER = """
+import asyncio
+
+async def drive_await(r):
+    await r
+
+async def drive_async_for(r):
+    n = 0
+    async for x in r:
+        n = n + 1
+        if n == {0:d}: break
+
+async def drive_async_with(r):
+    async with r: pass
+""".format(ASYNC_MAX_ITERATIONS)
+
+# drives an asynchronous object returned by a method on an event loop,
+# 'protocol' is 'await', 'async_for' or 'async_with'
+class AsyncCaller:
+
+    __slots__ = ('caller', 'protocol', 'code')
+
+    template = """
+$base_caller_code
+$driver
+asyncio.run(asyncio.wait_for(drive_$protocol(r), $timeout))
+"""
+
+    # the case is run in a coroutine, so that many cases can be run concurrently
+    case_template = """
+async def $name():
+$base_caller_code
+    await asyncio.wait_for(drive_$protocol(r), $timeout)
+"""
+
+    batch_template = """
+$driver
+$cases
+async def run_cases():
+    await asyncio.gather($calls, return_exceptions=True)
+
+asyncio.run(run_cases())
+"""
+
+    def __init__(self, caller, protocol):
+        self.caller = caller
+        self.protocol = protocol
+        self.prepare()
+
+    def target(self):
+        return self.caller.target()
+
+    def prepare(self):
+        self.caller.prepare()
+        template = Template(AsyncCaller.template)
+        self.code = template.substitute(base_caller_code = self.caller.code,
+                                        driver = ASYNC_DRIVER,
+                                        protocol = self.protocol,
+                                        timeout = ASYNC_TIMEOUT)
+
+    def call(self):
+        self.prepare()
+        store_and_execute(self.code)
+
+    # returns code of a coroutine function which runs the case
+    def case_code(self, name):
+        self.caller.prepare()
+        template = Template(AsyncCaller.case_template)
+        return template.substitute(name = name,
+                                   base_caller_code = textwrap.indent(self.caller.code, '    '),
+                                   protocol = self.protocol,
+                                   timeout = ASYNC_TIMEOUT)
+
+    def log(self, message):
+        print_with_prefix('AsyncCaller', message)
+
+# returns code which runs specified cases concurrently on an event loop,
+# 'cases' is a list of codes returned by AsyncCaller.case_code()
+def async_batch_code(cases):
+    names = ['case_{0:d}()'.format(i) for i in range(len(cases))]
+    template = Template(AsyncCaller.batch_template)
+    return template.substitute(driver = ASYNC_DRIVER,
+                               cases = ''.join(cases),
+                               calls = ', '.join(names))
+
+# calls a sequence of methods on the same instance of a class,
+# every method is called with parameters which resulted to a successful call,
+# exceptions don't stop the sequence
+class SequenceCaller:
+
+    __slots__ = ('constructor_caller', 'callers', 'steps', 'prefix', 'step_codes', 'code')
+
+    prefix_template = """
+$imports
+$extra
+$constructor_parameter_definitions
+object = $class_name($constructor_arguments)
+"""
+
+    step_template = """
+try:
+$parameter_definitions
+    object.$method_name($method_arguments)
+except Exception: pass
+"""
+
+    # 'callers' are MethodCallers for the class, steps of a sequence are indexes in this list
+    def __init__(self, constructor_caller, callers):
+        self.constructor_caller = constructor_caller
+        self.callers = callers
+        self.steps = ()
+        self.render()
+        self.prepare()
+
+    def target(self):
+        return self.constructor_caller.target()
+
+    # parameter values don't change, so that the code of every step is rendered only once,
+    # imports and extra code of all methods go to the prefix,
+    # so that any step can be run after the prefix
+    def render(self):
+        self.constructor_caller.prepare()
+        imports = Imports()
+        imports.merge(self.constructor_caller.imports)
+        extra = set(self.constructor_caller.extra)
+        self.step_codes = []
+        for caller in self.callers:
+            caller.caller.prepare()
+            imports.merge(caller.caller.imports)
+            extra = extra.union(caller.caller.extra)
+            template = Template(SequenceCaller.step_template)
+            definitions = textwrap.indent('\n'.join(caller.caller.parameter_definitions), '    ')
+            self.step_codes.append(template.substitute(parameter_definitions = definitions,
+                                                       method_name = caller.method.name,
+                                                       method_arguments = ', '.join(caller.caller.function_arguments)))
+        template = Template(SequenceCaller.prefix_template)
+        self.prefix = template.substitute(imports = imports.code(),
+                                          extra = '\n'.join(sorted(extra)),
+                                          constructor_parameter_definitions = '\n'.join(self.constructor_caller.parameter_definitions),
+                                          class_name = self.constructor_caller.classname(),
+                                          constructor_arguments = ', '.join(self.constructor_caller.constructor_arguments))
+
+    def set_sequence(self, steps):
+        self.steps = tuple(steps)
+
+    def prepare(self):
+        self.code = self.code_of(self.steps)
+
+    # returns code for specified steps
+    def code_of(self, steps):
+        return self.prefix + ''.join(self.step_codes[step] for step in steps)
+
+    def call(self):
+        self.prepare()
+        store_and_execute(self.code)
+
+    # runs a prefix in specified namespace, so that steps can be run one by one
+    def call_prefix(self, namespace):
+        execute_with_log(self.prefix, self.prefix, namespace)
+
+    # runs the last of specified steps in a namespace where previous steps have already been run
+    def call_step(self, steps, namespace):
+        execute_with_log(self.step_codes[steps[-1]], self.code_of(steps), namespace)
+
+    def log(self, message):
+        print_with_prefix('SequenceCaller', message)
+
 class TargetCallable:
 
+    __slots__ = ('filename', 'module', 'name', 'unknown_parameters', 'parameter_types', 'default_values')
+
     def __init__(self, filename, module, name):
         self.filename = filename
         self.module = module
@@ -490,9 +1044,13 @@ class TargetCallable:
         self.parameter_types = []
         self.default_values = []
 
+    # known types of first parameters are kept
     def set_parameters(self, n):
+        parameter_types = self.parameter_types
         self.reset_parameter_types()
-        for i in range(0, n): self.add_parameter(ParameterType.any_object)
+        for i in range(0, n):
+            if i < len(parameter_types): self.add_parameter(parameter_types[i])
+            else: self.add_parameter(ParameterType.any_object)
         self.no_unknown_parameters()
 
     def number_of_parameters(self):
@@ -504,12 +1062,20 @@ class TargetCallable:
             if value == None: result = result + 1
         return result
 
+    # returns true if at least one parameter has a known type
+    def has_parameter_types(self):
+        for parameter_type in self.parameter_types:
+            if not parameter_type in (ParameterType.any_object, ParameterType.unknown): return True
+        return False
+
     def add_parameter(self, parameter_type, default_value = None):
         self.parameter_types.append(parameter_type)
         self.default_values.append(default_value)
 
 class TargetFunction(TargetCallable):
 
+    __slots__ = ()
+
     def __init__(self, filename, module, name):
         super().__init__(filename, module, name)
 
@@ -518,6 +1084,8 @@ class TargetFunction(TargetCallable):
 
 class TargetClass:
 
+    __slots__ = ('filename', 'module', 'name', 'methods')
+
     def __init__(self, filename, module, name):
         self.filename = filename
         self.module = module
@@ -547,6 +1115,8 @@ class TargetClass:
 
 class TargetMethod(TargetCallable):
 
+    __slots__ = ('clazz',)
+
     def __init__(self, name, module, clazz):
         super().__init__(None, module, name)
         self.clazz = clazz
@@ -556,14 +1126,40 @@ class TargetMethod(TargetCallable):
 
 class TestDump:
 
+    # next indexes of tests are shared by all instances,
+    # so that fuzzers which write to the same directory don't overwrite each other's tests
+    next_indexes = {}
+
+    # archives which store tests instead of separate files, by output path
+    archives = {}
+
     def __init__(self, path):
         self.path = path
-        self.next_indexes = {}
-
-    def store(self, caller):
+        self.stored = set()
+
+    # makes all dumps with specified path store tests to a single archive in the path
+    def open_archive(path):
+        if path in TestDump.archives: return TestDump.archives[path]
+        archive = Archive(os.path.join(path, ARCHIVE), append = True)
+        TestDump.archives[path] = archive
+        for key, index in archive.next_indexes().items():
+            TestDump.next_indexes[(path, key)] = index
+        return archive
+
+    def close_archives():
+        for archive in TestDump.archives.values(): archive.close()
+        TestDump.archives = {}
+
+    def store(self, caller, case = None):
         if self.path == None: return
+        subdir, key = self.location(caller)
+        case_id = None
+        if case != None: case_id = case.id()
+        self.store_code(subdir, key, caller.code, target_of(caller), case_id)
+
 
-        key = None
+    # returns a subdirectory and a key for tests of specified caller
+    def location(self, caller):
         if type(caller) == FunctionCaller:
             subdir = '{0:s}'.format(caller.function.module)
             key = '{0:s}_{1:s}'.format(caller.function.module, caller.function.name)
@@ -573,14 +1169,45 @@ class TestDump:
         elif type(caller) == SubsequentMethodCaller:
             subdir = '{0:s}/{1:s}'.format(caller.caller.method.module, caller.caller.method.clazz.name)
             key = '{0:s}_{1:s}_{2:s}'.format(caller.caller.method.clazz.name, caller.caller.method.name, caller.method_name)
+        elif type(caller) == ConstructorCaller:
+            subdir = '{0:s}/{1:s}'.format(caller.clazz.module, caller.clazz.name)
+            key = '{0:s}_{1:s}'.format(caller.clazz.name, caller.constructor.name)
+        elif type(caller) == ConcurrentCaller:
+            subdir, key = self.location(caller.caller)
+            key = '{0:s}_threads'.format(key)
+        elif type(caller) == AsyncCaller:
+            subdir, key = self.location(caller.caller)
+            key = '{0:s}_{1:s}'.format(key, caller.protocol)
+        elif type(caller) == SequenceCaller:
+            subdir = '{0:s}/{1:s}'.format(caller.constructor_caller.clazz.module, caller.constructor_caller.clazz.name)
+            key = '{0:s}_sequence'.format(caller.constructor_caller.clazz.name)
         else:
             raise Exception('Unknown caller')
+        return subdir, key
 
+    # stores code only if the same code has not been stored with the same key yet
+    def store_code_once(self, subdir, key, code, target = None, case_id = None):
+        digest = hashlib.sha1('{0}\0{1}\0{2}'.format(subdir, key, code).encode('utf-8')).digest()
+        if digest in self.stored: return
+        self.stored.add(digest)
+        self.store_code(subdir, key, code, target, case_id)
+
+    # stores code to <path>/<subdir>/<key>_<index>.py, or to an archive if it was opened for the path
+    def store_code(self, subdir, key, code, target = None, case_id = None):
+        with stage_timer(DUMP_STAGE):
+            self.write_code(subdir, key, code, target, case_id)
+
+    def write_code(self, subdir, key, code, target = None, case_id = None):
         key = key.replace('.', '_')
 
         next_index = 0
-        if key in self.next_indexes:
-            next_index = self.next_indexes[key]
+        if (self.path, key) in TestDump.next_indexes:
+            next_index = TestDump.next_indexes[(self.path, key)]
+
+        if self.path in TestDump.archives:
+            TestDump.next_indexes[(self.path, key)] = next_index + 1
+            TestDump.archives[self.path].append(subdir, key, next_index, code, target, case_id)
+            return
 
         directory = '{0:s}/{1:s}'.format(self.path, subdir)
         if os.path.isfile(directory):
@@ -591,16 +1218,46 @@ class TestDump:
 
         fullpath = '{0:s}/{1:s}_{2:d}.py'.format(directory, key, next_index)
         next_index += 1
-        self.next_indexes[key] = next_index
+        TestDump.next_indexes[(self.path, key)] = next_index
 
         self.log('save code to ' + fullpath)
 
         with open(fullpath, "w") as text_file:
-            text_file.write(caller.code)
+            text_file.write(code)
 
     def log(self, message):
         print_with_prefix('TestDump', message)
 
+# returns a full name of a target which is called by specified caller
+def target_of(caller):
+    if type(caller) == FunctionCaller:          return caller.function.fullname()
+    if type(caller) == MethodCaller:            return caller.method.fullname()
+    if type(caller) == SubsequentMethodCaller:  return caller.caller.method.fullname()
+    if type(caller) == ConstructorCaller:       return caller.clazz.fullname()
+    if type(caller) == SequenceCaller:          return caller.constructor_caller.clazz.fullname()
+    if type(caller) in (ConcurrentCaller, AsyncCaller): return target_of(caller.caller)
+    raise Exception('Unknown caller')
+
+# reads tests stored by TestDump to specified directory,
+# returns a list of (subdir, key, code) tuples, tests with the same key are sorted by their indexes
+def read_tests(path):
+    result = []
+    archive = archive_in(path)
+    if archive != None:
+        for test, code in archive.read(archive.tests):
+            result.append((test['subdir'], test['key'], code))
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        subdir = os.path.relpath(root, path)
+        tests = []
+        for filename in files:
+            match = re.match(r'^(.+)_(\d+)\.py$', filename)
+            if match: tests.append((match.group(1), int(match.group(2)), filename))
+        for key, index, filename in sorted(tests):
+            with open(os.path.join(root, filename)) as f:
+                result.append((subdir, key, f.read()))
+    return result
+
 class FunctionCallerFactory:
 
     def __init__(self, function):   self.function = function
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+import json
+import os
+import threading
+
+from archive import archive_in
+from campaign import Campaign
+from core import print_with_prefix
+from results import compare, common_cases, cases_without_ids
+
+RESULTS = 'results.db'
+MISMATCHES = 'mismatches'
+REPORT = 'mismatches.json'
+
+# hash randomization changes order of sets and dicts from run to run,
+# so that it's fixed for both interpreters
+ENVIRONMENT = { 'PYTHONHASHSEED': '0' }
+
+# runs the same cases on two interpreters, and compares their outcomes:
+# exception types and reprs of returned objects
+#
+#   out/a/, out/b/              - campaigns for both interpreters, they run at the same time
+#   out/a/results.db            - outcomes of cases on the first interpreter
+#   out/mismatches.json         - cases which have different outcomes
+#   out/mismatches/<n>.py       - reproducers of the cases
+#
+# case IDs don't depend on an interpreter, so that the same case has the same ID in both databases
+class Differential:
+
+    def __init__(self, modules, out, jobs, options, pythons):
+        if len(pythons) != 2:
+            raise Exception('Differential mode needs two interpreters, but got {0:d}'.format(len(pythons)))
+        self.modules = modules
+        self.out = os.path.abspath(out)
+        self.campaigns = []
+        for name, python in zip(('a', 'b'), pythons):
+            directory = os.path.join(self.out, name)
+            # objects returned by calls may differ from interpreter to interpreter,
+            # so that they are not used as fuzzing values, and a case ID means the same values in both campaigns
+            campaign_options = options + ['--archive', '--return_values', '--results', os.path.join(directory, RESULTS),
+                                          '--value_pool', '0']
+            self.campaigns.append(Campaign(modules, directory, jobs, campaign_options, python, ENVIRONMENT,
+                                           'Campaign {0:s}'.format(name)))
+
+    def run(self):
+        for campaign in self.campaigns: self.log('run {0:s} in {1:s}'.format(campaign.python, campaign.out))
+        threads = [threading.Thread(target=campaign.run) for campaign in self.campaigns]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        for campaign in self.campaigns:
+            if campaign.failed_all():
+                raise Exception('{0:s} could not fuzz any module, see {1:s}'.format(campaign.name, campaign.out))
+        self.compare()
+
+    def compare(self):
+        a, b = [os.path.join(campaign.out, RESULTS) for campaign in self.campaigns]
+        for filename in (a, b):
+            if not os.path.isfile(filename):
+                self.warn('no results in {0:s}, nothing to compare'.format(filename))
+                return
+        for filename in (a, b):
+            count = cases_without_ids(filename)
+            if count > 0: self.warn('{0:d} cases without IDs in {1:s} are not compared'.format(count, filename))
+        mismatches = compare(a, b)
+        self.log('compared {0:d} cases, found {1:d} mismatches'.format(common_cases(a, b), len(mismatches)))
+        report = []
+        for target, case_id, *outcomes in mismatches:
+            mismatch = { 'target': target, 'case': case_id, 'reproducer': None,
+                         'a': outcome_of(*outcomes[:3]), 'b': outcome_of(*outcomes[3:]) }
+            self.warn('{0:s}: {1:s} vs {2:s}'.format(case_id, mismatch['a'], mismatch['b']))
+            report.append(mismatch)
+        self.store_reproducers(report)
+        with open(os.path.join(self.out, REPORT), 'w') as f:
+            json.dump(report, f, indent=4)
+
+    # stores code of mismatched cases from archives of the first campaign,
+    # every archive is read only once
+    def store_reproducers(self, report):
+        directory = os.path.join(self.out, MISMATCHES)
+        numbers = {}
+        for number, mismatch in enumerate(report, 1): numbers[mismatch['case']] = (number, mismatch)
+        for module in self.modules:
+            archive = archive_in(os.path.join(self.campaigns[0].out, module))
+            if archive == None: continue
+            tests = [archive.by_case[case_id] for case_id in numbers if case_id in archive.by_case]
+            for test, code in archive.read(tests):
+                number, mismatch = numbers[test['case']]
+                if not os.path.isdir(directory): os.makedirs(directory)
+                filename = os.path.join(directory, '{0:d}.py'.format(number))
+                with open(filename, 'w') as f:
+                    f.write('# case: {0:s}\n'.format(mismatch['case']))
+                    for campaign, name in zip(self.campaigns, ('a', 'b')):
+                        f.write('# {0:s}: {1:s}\n'.format(campaign.python, mismatch[name]))
+                    f.write(code)
+                mismatch['reproducer'] = filename
+        for mismatch in report:
+            if mismatch['reproducer'] == None:
+                self.warn('could not find a reproducer for {0:s}'.format(mismatch['case']))
+
+    def log(self, message):
+        print_with_prefix('Differential', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
+
+def outcome_of(outcome, exception_type, result):
+    if exception_type != None: return '{0:s} {1:s}'.format(outcome, exception_type)
+    if result != None: return '{0:s} {1:s}'.format(outcome, result)
+    return outcome
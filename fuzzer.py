@@ -1,7 +1,13 @@
 #!/usr/bin/python
 
+import collections
+import itertools
+import json
 import textwrap
+import time
 import os
+import signal
+import sys
 import core
 
 from core import ParameterType
@@ -12,14 +18,32 @@ from core import ConstructorCaller
 from core import TestDump
 from core import CoroutineChecker
 from core import SubsequentMethodCaller
+from core import SequenceCaller
+from core import AsyncCaller, async_batch_code
+from core import ConcurrentCaller
 from core import Stats
 from core import FunctionCallerFactory, MethodCallerFactory
+from core import TargetFunction, TargetClass
+from strategy import DEFAULT_STRATEGY, DEFAULT_SEQUENCE_STRATEGY
+from cases import Case, CALL_PHASE, SEARCH_PHASE, apply_case, search_cases, single_position_cases
+from cases import combination_cases, coroutine_cases, method_cases, parameter_types_of, sequence_cases
+from cases import async_cases, is_async_phase, thread_cases, THREADS_PHASE
+from selection import Selection, selection_of
+from results import ResultsDB
+from sizes import LadderState, SizedValue, SIZED_VALUES, outcome_of
+from pool import ValuePool
 
 NO_PATH = None
 NO_EXCLUDES = []
+
+# functions in these modules may kill or hang the fuzzer
+FUNCTION_EXCLUDES = Selection(excludes=['module:os', 'module:signal', 'module:_signal', 'module:faulthandler'])
 NO_VALUES = []
+NO_CASE_FILTER = None
 DISABLE_COROUTINE_FUZZING = False
 ENABLE_COROUTINE_FUZZING = True
+ENABLE_ASYNC_FUZZING = True
+DEFAULT_ASYNC_BATCH = 1000
 
 GET_TRACEBACK_CODE = """
 try:
@@ -30,10 +54,8 @@ except: tb = sys.exc_info()[2]
 DEFAULT_FUZZING_VALUES = ('42', '42.3', '2 ** 16', '-1 * 2 ** 16', 'True', 'False', '()', '[]', '{}', '{"a":10}', 'bytes()', 'None',
                           'bytearray()', '"ololo"', 'frozenset()', 'set()',
                           'Exception', 'Exception()',
-                          'float("inf")', 'float("-inf")',
-                          '"x" * 2 ** 20', 'range(0, 2**20)',
-                          '("ololo",) * 2 ** 20', '(42,) * 2 ** 20', 'bytes("x" * 2**20)', 'bytearray("x" * 2**20)',
-                          '[(0), (0)]', '([0], [0])',
+                          'float("inf")', 'float("-inf")') + SIZED_VALUES + \
+                         ('[(0), (0)]', '([0], [0])',
                           ParameterValue('A()', 'class A: pass'),
                           ParameterValue('tb', GET_TRACEBACK_CODE, 'import sys'))
 
@@ -45,24 +67,54 @@ DEFAULT_GENERAL_PARAMETER_VALUES = ('42', '"test"', 'True', '(1,2)', '[1,2]', '{
                                     ParameterValue('tb', GET_TRACEBACK_CODE, 'import sys'))
 
 DEFAULT_MAX_PARAM_NUMBER = 3
+NO_SEQUENCES = 0
+
+# sequences are stored and run in batches, so that they are never kept in memory all at once
+SEQUENCE_BATCH = 1000
+
+# a child process which runs a step of a sequence longer is killed by SIGALRM, and reported as a hang
+SEQUENCE_STEP_TIMEOUT = 10
+NO_THREADS = 0
 
 # base class for fuzzers, contains common methods
 class BaseFuzzer:
 
     def __init__(self):
-        self.excludes = NO_EXCLUDES
+        self.excludes = selection_of(NO_EXCLUDES)
         self.path = NO_PATH
+        self.extra_values = []
         self.set_fuzzing_values(DEFAULT_FUZZING_VALUES)
         self.set_general_parameter_values(DEFAULT_GENERAL_PARAMETER_VALUES)
+        self.strategy = DEFAULT_STRATEGY
+        self.case_filter = NO_CASE_FILTER
+        self.ladders = LadderState()
 
     # sets a path where the fuzzer should dump generated code to
     def set_output_path(self, path):
         self.path = path
         self.dump = TestDump(path)
 
-    # sets an exclude list
+    # sets an exclude list, it may be a list of patterns, a single pattern, or a compiled Selection
     def set_excludes(self, excludes):
-        self.excludes = excludes
+        self.excludes = selection_of(excludes)
+
+    # sets a strategy which builds cases for fuzzing several parameters at once
+    def set_strategy(self, strategy):
+        self.strategy = strategy
+
+    # sets a filter which selects cases to run, for example, a shard
+    def set_case_filter(self, case_filter):
+        self.case_filter = case_filter
+
+    # returns true if a case should be run, bigger sizes of a value are not run if the ladder of the value stopped
+    def accept(self, case):
+        if self.case_filter != None and not self.case_filter.accept(case): return False
+        rung = self.rung_of(case)
+        if rung == None: return True
+        key, index = rung
+        if self.ladders.allows(key, index): return True
+        self.ladders.skip(key, index)
+        return False
 
     def set_fuzzing_values(self, values):
         self.fuzzing_values = []
@@ -70,6 +122,30 @@ class BaseFuzzer:
 
     def add_fuzzing_values(self, values):
         self.fuzzing_values.extend(values)
+        self.table = None
+
+    # adds values which are used only by cases which change one parameter, for example, constants of a module
+    def add_extra_values(self, values):
+        self.extra_values.extend(values)
+        self.table = None
+
+    # returns fuzzing values followed by bigger sizes of sized values and by extra values,
+    # cases which change one parameter take values from the table,
+    # cases which change several parameters take only fuzzing values, so that the number of combinations doesn't grow
+    def value_table(self):
+        if self.table == None:
+            self.table = list(self.fuzzing_values)
+            for value in self.fuzzing_values:
+                if isinstance(value, SizedValue) and value.rung == 0: self.table.extend(value.ladder.bigger_values())
+            self.table.extend(self.extra_values)
+        return self.table
+
+    # returns a key of a ladder and a rung if a case changes one parameter to a sized value, or None
+    def rung_of(self, case):
+        if case == None or case.parent != None or case.phase != CALL_PHASE or len(case.positions) != 1: return None
+        value = self.value_table()[case.values[0]]
+        if not isinstance(value, SizedValue): return None
+        return (case.target, case.positions[0], value.ladder.name), value.rung
 
     def set_general_parameter_values(self, values):
         self.general_parameter_values = []
@@ -80,30 +156,35 @@ class BaseFuzzer:
 
     # runs and stores generated code to specified location
     # all exceptions are caught and logged in this method
-    def run_and_dump_code(self, caller):
+    def run_and_dump_code(self, caller, case = None):
         result = False
-        self.dump.store(caller)
+        # render current parameter values before the code is stored
+        with core.stage_timer(core.RENDERING_STAGE):
+            caller.prepare()
+        self.dump.store(caller, case)
+        exception = None
+        value = None
+        start = time.perf_counter()
         try:
-            caller.call()
+            value = caller.call()
             self.log('wow, it succeded')
             result = True
         except Exception as err:
-            self.exception = err
+            self.exception = exception = err
             self.log('exception {0}: {1}'.format(type(err), str(err)))
+        if ResultsDB.current != None:
+            ResultsDB.current.add(caller, case, exception, time.perf_counter() - start, value)
+        if result and ValuePool.current != None:
+            ValuePool.current.add(caller, value)
+        rung = self.rung_of(case)
+        if rung != None: self.ladders.record(*rung, outcome_of(exception))
         Stats.get().increment_tests()
         return result
 
     # checks if a target should be skipped
     # returns true if a target should not be fuzzed, false otherwise
     def skip(self, target):
-        if self.excludes:
-            if isinstance(self.excludes, list):
-                for exclude in self.excludes:
-                    if exclude in target.fullname(): return True
-            else:
-                if self.excludes in target.fullname(): return True
-
-        return False
+        return self.excludes.skips(target.fullname())
 
     def get_exception(self): return self.exception
 
@@ -120,19 +201,8 @@ class BaseFunctionFuzzer(BaseFuzzer):
             self.log('function "{0:s}" doesn\'t have parameters, skip'.format(self.function.fullname()))
             return True
 
-        # TODO: those ifs are ugly
-        #       need to define a class wich check if we should skip module/function/method/etc,
-        #       and check instances of this class in a loop
-        if self.function.module == 'os':
-            self.log('skip \'os\' module')
-            return True
-
-        if self.function.module == 'signal' or self.function.module == '_signal':
-            self.log('skip \'signal\' module')
-            return True
-
-        if self.function.module == 'faulthandler':
-            self.log('skip \'faulthandler\' module')
+        if FUNCTION_EXCLUDES.skips(self.function.fullname()):
+            self.log('skip \'{0:s}\' module'.format(self.function.module))
             return True
 
         return False
@@ -162,7 +232,7 @@ class CorrectParametersFuzzer(BaseFuzzer):
         while True:
             if self.caller.target().has_no_parameters():
                 self.log('no parameters, try to call it')
-                if self.could_make_successful_call(self.caller):
+                if self.could_make_successful_call(self.caller, self.defaults_case()):
                     self.found = True
                     break
                 if not self.changed_parameters_number:
@@ -172,32 +242,36 @@ class CorrectParametersFuzzer(BaseFuzzer):
                      .format(self.caller.target().name, self.caller.target().number_of_parameters()))
             self.changed_parameters_number = False
             self.found = False
-            self.search(self.caller, 1, self.caller.target().number_of_parameters())
+            self.search(self.caller)
             if self.changed_parameters_number:
                 self.changed_parameters_number = False
                 continue
             break
 
-    # recursive search
-    def search(self, caller, current_arg_number, number_of_parameters):
-        if self.found: return
-        if current_arg_number == number_of_parameters:
-            if self.could_set_default_value(caller, current_arg_number):
-                if self.could_make_successful_call(caller): return
-                if self.changed_parameters_number: return
-            else:
-                for value in self.general_parameter_values:
-                    caller.set_parameter_value(current_arg_number, value)
-                    if self.could_make_successful_call(caller): return
-                    if self.changed_parameters_number: return
-        else:
-            if self.could_set_default_value(caller, current_arg_number):
-                self.search(caller, current_arg_number + 1, number_of_parameters)
-            else:
-                for value in self.general_parameter_values:
-                    caller.set_parameter_value(current_arg_number, value)
-                    self.search(caller, current_arg_number + 1, number_of_parameters)
-                    if self.found: return
+    # returns a lazy stream of cases, parameters with default values are not changed
+    def cases(self):
+        target = self.caller.target()
+        positions = [arg_number for arg_number in range(1, target.number_of_parameters() + 1)
+                     if not target.has_default_value(arg_number)]
+        return search_cases(target.fullname(), positions, len(self.general_parameter_values))
+
+    # returns a case which calls a target without parameters, or with default values of its parameters,
+    # for example, _io.StringIO.write:search:
+    def defaults_case(self):
+        return Case(self.caller.target().fullname(), SEARCH_PHASE, (), (), None)
+
+    # runs cases until a successful call, or until the number of parameters is changed
+    def search(self, caller):
+        for arg_number in range(1, caller.target().number_of_parameters() + 1):
+            self.could_set_default_value(caller, arg_number)
+        # if types of parameters are known, their default values are likely to be correct
+        if caller.target().has_parameter_types():
+            if self.could_make_successful_call(caller, self.defaults_case()): return
+            if self.changed_parameters_number: return
+        for case in self.cases():
+            apply_case(caller, case, [], self.general_parameter_values)
+            if self.could_make_successful_call(caller, case): return
+            if self.changed_parameters_number: return
 
     # if a parameter has a default value, it's set to a caller, and true is returned
     # false otherwise
@@ -211,8 +285,8 @@ class CorrectParametersFuzzer(BaseFuzzer):
     # run a caller, and checks if the call was successful (no exception thrown)
     # if an exception was thrown, it tries to analyze it to figure out
     # if the callable has wrong parameters number
-    def could_make_successful_call(self, caller):
-        self.found = self.run_and_dump_code(caller)
+    def could_make_successful_call(self, caller, case):
+        self.found = self.run_and_dump_code(caller, case)
         if self.found:
             self.log('found correct parameter values: {0}'.format(caller.get_parameter_values()))
             return True
@@ -317,11 +391,20 @@ class SmartFunctionFuzzer(BaseFunctionFuzzer):
             return
         self.log('run fuzzing for function {0:s} with {1:d} parameters'
                  .format(self.function.name, self.function.number_of_parameters()))
-        for parameter_index in range(1, self.function.number_of_parameters()+1):
-            caller = successful_caller.clone()
-            for value in self.fuzzing_values:
-                caller.set_parameter_value(parameter_index, value)
-                self.run_and_dump_code(caller)
+        self.caller = successful_caller.clone()
+        self.base_values = list(successful_caller.get_parameter_values())
+        for case in self.cases():
+            if self.accept(case): self.execute(case)
+
+    # returns a lazy stream of cases, every case changes one parameter
+    def cases(self):
+        return single_position_cases(self.function.fullname(), CALL_PHASE,
+                                     self.function.number_of_parameters(), len(self.value_table()))
+
+    # other parameters keep values which resulted to a successful call
+    def execute(self, case):
+        apply_case(self.caller, case, self.base_values, self.value_table())
+        self.run_and_dump_code(self.caller, case)
 
     def log(self, message):
         core.print_with_prefix('SmartFunctionFuzzer', message)
@@ -334,6 +417,26 @@ class SmartClassFuzzer(BaseFuzzer):
     def __init__(self, clazz):
         super().__init__()
         self.clazz = clazz
+        self.sequence_length = NO_SEQUENCES
+        self.sequence_strategy = DEFAULT_SEQUENCE_STRATEGY
+        self.async_batch_size = DEFAULT_ASYNC_BATCH
+        self.threads = NO_THREADS
+
+    # enables fuzzing with sequences of method calls of specified length
+    def set_sequence_length(self, length):
+        self.sequence_length = length
+
+    # sets a strategy which builds sequences of method calls
+    def set_sequence_strategy(self, strategy):
+        self.sequence_strategy = strategy
+
+    # sets how many asynchronous cases are run concurrently
+    def set_async_batch_size(self, size):
+        self.async_batch_size = size
+
+    # sets how many threads call a method at once, 0 means that methods are called from one thread
+    def set_threads(self, threads):
+        self.threads = threads
 
     def run(self):
         self.log('try to fuzz class: ' + self.clazz.name)
@@ -355,14 +458,34 @@ class SmartClassFuzzer(BaseFuzzer):
         constructor_caller = fuzzer.get_caller()
 
         # start actual fuzzing
+        # methods which could be called successfully are used in sequences,
+        # asynchronous cases of all methods are run in the same batches
+        callers = []
+        async_fuzzer = AsyncFuzzer()
+        async_fuzzer.set_batch_size(self.async_batch_size)
+        async_fuzzer.set_output_path(self.path)
         for method in self.clazz.get_methods():
             fuzzer = SmartMethodFuzzer(method, constructor_caller)
             fuzzer.enable_coroutine_fuzzing()
+            fuzzer.set_async_fuzzer(async_fuzzer)
+            fuzzer.set_threads(self.threads)
             fuzzer.set_fuzzing_values(self.fuzzing_values)
+            fuzzer.add_extra_values(self.extra_values)
             fuzzer.set_general_parameter_values(self.general_parameter_values)
+            fuzzer.set_strategy(self.strategy)
+            fuzzer.set_case_filter(self.case_filter)
             fuzzer.set_output_path(self.path)
             fuzzer.set_excludes(self.excludes)
             fuzzer.run()
+            if fuzzer.get_caller(): callers.append(fuzzer.get_caller())
+        async_fuzzer.flush()
+
+        if self.sequence_length > 0:
+            fuzzer = SequenceFuzzer(self.clazz, constructor_caller, callers, self.sequence_length)
+            fuzzer.set_strategy(self.sequence_strategy)
+            fuzzer.set_case_filter(self.case_filter)
+            fuzzer.set_output_path(self.path)
+            fuzzer.run()
 
     def log(self, message):
         core.print_with_prefix('SmartClassFuzzer', message)
@@ -377,9 +500,23 @@ class SmartMethodFuzzer(BaseFuzzer):
         self.method = method
         self.constructor_caller = constructor_caller
         self.fuzz_coroutine = ENABLE_COROUTINE_FUZZING
+        self.fuzz_async = ENABLE_ASYNC_FUZZING
+        self.async_fuzzer = None
+        self.threads = NO_THREADS
+        self.successful_caller = None
 
     def disable_coroutine_fuzzing(self): self.fuzz_coroutine = False
     def enable_coroutine_fuzzing(self):  self.fuzz_coroutine = True
+    def disable_async_fuzzing(self):     self.fuzz_async = False
+
+    # sets a fuzzer which runs asynchronous cases, so that they can be run in batches with cases of other methods
+    def set_async_fuzzer(self, async_fuzzer): self.async_fuzzer = async_fuzzer
+
+    # every case is also run from specified number of threads at once if it's not 0
+    def set_threads(self, threads): self.threads = threads
+
+    # returns a caller with parameters which resulted to a successful call, or None
+    def get_caller(self): return self.successful_caller
 
     def run(self):
         if self.skip(self.method):
@@ -407,23 +544,57 @@ class SmartMethodFuzzer(BaseFuzzer):
             return
         self.log('run fuzzing for method {0:s} with {1:d} parameters'
                  .format(self.method.fullname(), self.method.number_of_parameters()))
-        if self.method.has_no_parameters() and self.fuzz_coroutine:
-            fuzzer = CoroutineFuzzer(successful_caller.clone())
-            fuzzer.set_fuzzing_values(self.fuzzing_values)
-            fuzzer.set_general_parameter_values(self.general_parameter_values)
-            fuzzer.set_output_path(self.path)
-            fuzzer.run()
-        for parameter_index in range(1, self.method.number_of_parameters()+1):
-            caller = successful_caller.clone()
-            for value in self.fuzzing_values:
-                caller.set_parameter_value(parameter_index, value)
-                self.run_and_dump_code(caller)
-                if self.fuzz_coroutine:
-                    fuzzer = CoroutineFuzzer(caller)
-                    fuzzer.set_fuzzing_values(self.fuzzing_values)
-                    fuzzer.set_general_parameter_values(self.general_parameter_values)
-                    fuzzer.set_output_path(self.path)
-                    fuzzer.run()
+        self.successful_caller = successful_caller
+        self.caller = successful_caller.clone()
+        self.base_values = list(successful_caller.get_parameter_values())
+        self.coroutine_fuzzer = CoroutineFuzzer(self.caller)
+        self.coroutine_fuzzer.set_fuzzing_values(self.fuzzing_values)
+        self.coroutine_fuzzer.set_general_parameter_values(self.general_parameter_values)
+        self.coroutine_fuzzer.set_strategy(self.strategy)
+        self.coroutine_fuzzer.set_output_path(self.path)
+        own_async_fuzzer = self.async_fuzzer == None
+        if own_async_fuzzer:
+            self.async_fuzzer = AsyncFuzzer()
+            self.async_fuzzer.set_output_path(self.path)
+        for case in self.cases():
+            if self.accept(case): self.execute(case)
+        if own_async_fuzzer: self.async_fuzzer.flush()
+
+    # returns a lazy stream of cases, every case changes one parameter,
+    # a case which runs it from several threads may follow a case,
+    # cases for coroutines and asynchronous objects follow a case if it returned such an object
+    def cases(self):
+        expand = None
+        if self.fuzz_coroutine or self.fuzz_async or self.threads > 0: expand = self.follow_up
+        return method_cases(self.method.fullname(), self.method.number_of_parameters(),
+                            len(self.value_table()), expand)
+
+    # the case is not run again if it has just been run
+    def follow_up(self, case):
+        if not self.accept(case): return []
+        apply_case(self.caller, case, self.base_values, self.value_table())
+        cases = []
+        if self.threads > 0:
+            cases.append(thread_cases(case))
+        if self.fuzz_coroutine and self.coroutine_fuzzer.is_coroutine():
+            cases.append(coroutine_cases(case, len(self.fuzzing_values), self.strategy))
+        if self.fuzz_async:
+            cases.append(async_cases(case, CoroutineChecker(self.caller).get_result_type()))
+        return itertools.chain(*cases)
+
+    def execute(self, case):
+        if case.parent == None:
+            apply_case(self.caller, case, self.base_values, self.value_table())
+            self.run_and_dump_code(self.caller, case)
+        elif case.phase == THREADS_PHASE:
+            apply_case(self.caller, case.parent, self.base_values, self.value_table())
+            self.run_and_dump_code(ConcurrentCaller(self.caller, self.threads), case)
+        elif is_async_phase(case.phase):
+            apply_case(self.caller, case.parent, self.base_values, self.value_table())
+            self.async_fuzzer.execute(case, self.caller)
+        else:
+            apply_case(self.caller, case.parent, self.base_values, self.value_table())
+            self.coroutine_fuzzer.execute(case)
 
     def log(self, message):
         core.print_with_prefix('SmartMethodFuzzer', message)
@@ -431,74 +602,319 @@ class SmartMethodFuzzer(BaseFuzzer):
     def warn(self, message):
         self.log('warning: {0:s}'.format(message))
 
+# drives asynchronous objects (awaitables, asynchronous iterators and context managers)
+# returned by methods on an event loop, cases are collected to batches,
+# and all cases of a batch are run concurrently on one event loop,
+# every case is stored as a standalone test, and a whole batch is logged to latest_test.py
+class AsyncFuzzer(BaseFuzzer):
+
+    def __init__(self):
+        super().__init__()
+        self.batch_size = DEFAULT_ASYNC_BATCH
+        self.batch = []
+
+    def set_batch_size(self, size):
+        self.batch_size = size
+
+    # 'caller' returns an asynchronous object for the case
+    def execute(self, case, caller):
+        async_caller = AsyncCaller(caller, case.phase)
+        self.dump.store(async_caller, case)
+        Stats.get().increment_tests()
+        self.batch.append(async_caller.case_code('case_{0:d}'.format(len(self.batch))))
+        if len(self.batch) >= self.batch_size: self.flush()
+
+    def flush(self):
+        if len(self.batch) == 0: return
+        self.log('run {0:d} cases concurrently'.format(len(self.batch)))
+        code = async_batch_code(self.batch)
+        self.batch = []
+        try:
+            core.store_and_execute(code)
+        except Exception as err:
+            self.log('exception: {0}'.format(err))
+
+    def log(self, message):
+        core.print_with_prefix('AsyncFuzzer', message)
+
+# calls sequences of methods on the same instance of a class,
+# for example, close() and then read(), every method gets parameters which resulted to a successful call
+#
+# sequences with the same prefix share it: the prefix is run once in a child process,
+# and then the process is forked for every next step, so that a sequence of length N
+# doesn't need N calls to be run again for every sequence,
+# sequences are generated lazily in prefix order, and run in batches,
+# crashes and hangs of child processes are reported, and reproducers are stored with '_crash' suffix
+class SequenceFuzzer(BaseFuzzer):
+
+    def __init__(self, clazz, constructor_caller, callers, length):
+        super().__init__()
+        self.clazz = clazz
+        self.constructor_caller = constructor_caller
+        self.callers = callers
+        self.length = length
+        self.report = None
+
+    def run(self):
+        if len(self.callers) == 0:
+            self.warn('no methods for sequences in class: ' + self.clazz.name)
+            return
+        self.caller = SequenceCaller(self.constructor_caller, self.callers)
+        cases = (case for case in self.cases() if self.accept(case))
+        self.log('run sequences of {0:d} calls for class {1:s}, use {2} strategy'
+                 .format(self.length, self.clazz.name, self.strategy))
+        if not hasattr(os, 'fork'):
+            self.log('fork() is not available, run every sequence from the beginning')
+            for case in cases:
+                self.caller.set_sequence(case.values)
+                self.run_and_dump_code(self.caller, case)
+            return
+        # sequences of a batch are stored right before the batch runs, the same way as other tests
+        while True:
+            batch = list(itertools.islice(cases, SEQUENCE_BATCH))
+            if len(batch) == 0: break
+            for case in batch:
+                self.caller.set_sequence(case.values)
+                self.caller.prepare()
+                self.dump.store(self.caller, case)
+                Stats.get().increment_tests()
+            self.run_in_child_processes(batch)
+
+    def cases(self):
+        return sequence_cases(self.clazz.fullname(), self.length, len(self.callers), self.strategy)
+
+    # child processes report crashes via a pipe, the reports are read while the children are running
+    def run_in_child_processes(self, cases):
+        read_end, write_end = os.pipe()
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            self.report = os.fdopen(write_end, 'w')
+            self.run_child(self.run_sequences, cases)
+        os.close(write_end)
+        with os.fdopen(read_end) as report:
+            for line in report:
+                crash = json.loads(line)
+                self.store_crash(crash['code'], crash['status'])
+        pid, status = os.waitpid(pid, 0)
+        if status != 0: self.child_crashed(status)
+
+    def run_sequences(self, cases):
+        namespace = {}
+        try:
+            signal.alarm(SEQUENCE_STEP_TIMEOUT)
+            self.caller.call_prefix(namespace)
+        except Exception as err:
+            self.warn('could not create an instance: {0}'.format(err))
+            return
+        finally:
+            signal.alarm(0)
+        self.explore(cases, 0, namespace)
+
+    # runs next steps of sequences which share first 'depth' steps which have already been run,
+    # a step is run in the current process if all sequences have the same next step,
+    # otherwise, a child process is forked for every next step
+    def explore(self, cases, depth, namespace):
+        if depth == self.length: return
+        groups = collections.OrderedDict()
+        for case in cases:
+            if not case.values[depth] in groups: groups[case.values[depth]] = []
+            groups[case.values[depth]].append(case)
+        for step in groups:
+            group = groups[step]
+            if len(groups) == 1:
+                self.run_step(group, depth, namespace)
+            else:
+                sys.stdout.flush()
+                pid = os.fork()
+                if pid == 0: self.run_child(self.run_step, group, depth, namespace)
+                pid, status = os.waitpid(pid, 0)
+                if status != 0: self.child_crashed(status)
+
+    # a step which hangs kills its process, the alarm is not inherited by child processes
+    def run_step(self, cases, depth, namespace):
+        signal.alarm(SEQUENCE_STEP_TIMEOUT)
+        try:
+            self.caller.call_step(cases[0].values[:depth + 1], namespace)
+        finally:
+            signal.alarm(0)
+        self.explore(cases, depth + 1, namespace)
+
+    # runs a function in a child process, and never returns
+    def run_child(self, function, *args):
+        try:
+            function(*args)
+        except BaseException as err:
+            self.warn('unexpected exception in child process: {0}'.format(err))
+        finally:
+            sys.stdout.flush()
+            if self.report: self.report.flush()
+            os._exit(0)
+
+    # the crashed process left code which it was running in latest_test.py
+    def child_crashed(self, status):
+        code = ''
+        if os.path.isfile('latest_test.py'):
+            with open('latest_test.py') as f: code = f.read()
+            os.unlink('latest_test.py')
+        if self.report:
+            self.report.write(json.dumps({ 'code': code, 'status': status }) + '\n')
+            self.report.flush()
+        else:
+            self.store_crash(code, status)
+
+    def store_crash(self, code, status):
+        if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGALRM:
+            reason = 'hung for {0:d} seconds'.format(SEQUENCE_STEP_TIMEOUT)
+        elif os.WIFSIGNALED(status): reason = 'killed by signal {0:d}'.format(os.WTERMSIG(status))
+        else: reason = 'exited with code {0:d}'.format(os.WEXITSTATUS(status))
+        self.warn('sequence crashed ({0:s}):\n{1:s}'.format(reason, code))
+        if self.path != None:
+            subdir, key = self.dump.location(self.caller)
+            self.dump.store_code(subdir, key + '_crash', code, core.target_of(self.caller))
+
+    def log(self, message):
+        core.print_with_prefix('SequenceFuzzer', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
+
 class CoroutineFuzzer(BaseFuzzer):
 
-    def __init__(self, caller):
+    # parent case describes how the caller was built, it's used only for case IDs
+    def __init__(self, caller, parent = None):
         super().__init__()
         self.caller = caller
+        if parent == None: parent = Case(caller.target().fullname(), CALL_PHASE, (), (), None)
+        self.parent = parent
+        self.fuzzers = {}
 
     def run(self):
+        if not self.is_coroutine(): return
+        for case in self.cases():
+            if self.accept(case): self.execute(case)
+
+    def is_coroutine(self):
         if not CoroutineChecker(self.caller).is_coroutine():
             self.log('it is not a coroutine, quit')
-            return
+            return False
         self.log('coroutine found')
-        close_caller = SubsequentMethodCaller(self.caller, 'close')
-        self.run_and_dump_code(close_caller)
-        fuzzer = SubsequentMethodFuzzer(self.caller, 'send', [ParameterType.any_object])
-        fuzzer.set_fuzzing_values(self.fuzzing_values)
-        fuzzer.set_general_parameter_values(self.general_parameter_values)
-        fuzzer.disable_coroutine_fuzzing()
-        fuzzer.set_output_path(self.path)
-        fuzzer.run()
-        # TODO: what does it expect in the third parameter? TracebackException?
-        fuzzer = SubsequentMethodFuzzer(self.caller, 'throw',
-                                        [ParameterType.exception_type, ParameterType.exception, ParameterType.any_object])
-        fuzzer.set_fuzzing_values(self.fuzzing_values)
-        fuzzer.set_general_parameter_values(self.general_parameter_values)
-        fuzzer.disable_coroutine_fuzzing()
-        fuzzer.set_output_path(self.path)
-        fuzzer.run()
+        return True
+
+    # returns a lazy stream of cases for close(), send() and throw()
+    def cases(self):
+        return coroutine_cases(self.parent, len(self.fuzzing_values), self.strategy)
+
+    # cases are passed to a fuzzer for the subsequent method
+    def execute(self, case):
+        if not case.phase in self.fuzzers:
+            fuzzer = SubsequentMethodFuzzer(self.caller, case.phase, parameter_types_of(case.phase), self.parent)
+            fuzzer.set_fuzzing_values(self.fuzzing_values)
+            fuzzer.set_general_parameter_values(self.general_parameter_values)
+            fuzzer.set_strategy(self.strategy)
+            fuzzer.disable_coroutine_fuzzing()
+            fuzzer.set_output_path(self.path)
+            self.fuzzers[case.phase] = fuzzer
+        self.fuzzers[case.phase].execute(case)
 
     def log(self, message):
         core.print_with_prefix('CoroutineFuzzer', message)
 
 class SubsequentMethodFuzzer(SmartMethodFuzzer):
 
-    def __init__(self, base_caller, subsequent_method_name, parameter_types = []):
+    def __init__(self, base_caller, subsequent_method_name, parameter_types = [], parent = None):
         super().__init__(base_caller.method, base_caller.constructor_caller)
         self.base_caller = base_caller
         self.subsequent_method_name = subsequent_method_name
         self.parameter_types = parameter_types
+        if parent == None: parent = Case(base_caller.target().fullname(), CALL_PHASE, (), (), None)
+        self.parent = parent
+        self.caller = SubsequentMethodCaller(self.base_caller, self.subsequent_method_name, self.parameter_types)
 
     def run(self):
         self.log('run fuzzing for method {0:s} with {1:d} parameters'
                  .format(self.base_caller.target().fullname() + '.' + self.subsequent_method_name, self.get_number_of_parameters()))
-        caller = SubsequentMethodCaller(self.base_caller, self.subsequent_method_name, self.parameter_types)
         if self.get_number_of_parameters() == 0:
             self.log('method does not have parameters, just call it')
-            self.run_and_dump_code(caller)
-            if self.fuzz_coroutine:
-                fuzzer = CoroutineFuzzer(caller)
-                fuzzer.set_output_path(self.path)
-                fuzzer.run()
         else:
-            self.fuzz_hard(caller, 1)
+            self.log('use {0} strategy'.format(self.strategy))
+        for case in self.cases():
+            if self.accept(case): self.execute(case)
 
-    def fuzz_hard(self, caller, current_arg_number):
-        if current_arg_number == self.get_number_of_parameters():
-            for value in self.fuzzing_values:
-                caller.set_parameter_value(current_arg_number, value)
-                self.run_and_dump_code(caller)
-                if self.fuzz_coroutine:
-                    fuzzer = CoroutineFuzzer(caller)
-                    fuzzer.set_output_path(self.path)
-                    fuzzer.run()
-        else:
-            for value in self.fuzzing_values:
-                caller.set_parameter_value(current_arg_number, value)
-                self.fuzz_hard(caller, current_arg_number + 1)
+    # returns a lazy stream of cases, every case sets all parameters at once
+    def cases(self):
+        if self.get_number_of_parameters() == 0:
+            return iter([Case(self.parent.target, self.subsequent_method_name, (), (), self.parent)])
+        return combination_cases(self.parent.target, self.subsequent_method_name, self.get_number_of_parameters(),
+                                 len(self.fuzzing_values), self.strategy, self.parent)
+
+    def execute(self, case):
+        apply_case(self.caller, case, [], self.fuzzing_values)
+        self.run_and_dump_code(self.caller, case)
+        if self.fuzz_coroutine:
+            fuzzer = CoroutineFuzzer(self.caller)
+            fuzzer.set_output_path(self.path)
+            fuzzer.run()
 
     def get_number_of_parameters(self): return len(self.parameter_types)
 
     def log(self, message):
         core.print_with_prefix('SubsequentMethodFuzzer', message)
+
+# base class for fuzzers which need parameter values that result to a successful call:
+# it looks for them for a function or for every method of a class like other fuzzers do,
+# and passes callers with these values to a check which takes a caller
+class TargetCallersFuzzer(BaseFuzzer):
+
+    def __init__(self, target, check):
+        super().__init__()
+        self.target = target
+        self.check_caller = check
+        self.set_output_path(NO_PATH)
+
+    def run(self):
+        if isinstance(self.target, TargetFunction):
+            if self.skip(self.target) or FUNCTION_EXCLUDES.skips(self.target.fullname()): return
+            caller = self.find_caller(FunctionCallerFactory(self.target))
+            if caller != None: self.check_caller(caller)
+        elif isinstance(self.target, TargetClass):
+            if not self.target.has_constructor():
+                self.warn('could not find a constructor of class: {0}'.format(self.target.name))
+                return
+            fuzzer = CorrectParametersFuzzer(ConstructorCaller(self.target))
+            fuzzer.set_general_parameter_values(self.general_parameter_values)
+            fuzzer.set_output_path(NO_PATH)
+            fuzzer.run()
+            if not fuzzer.success():
+                self.warn('could not create an instance of "{0:s}" class, skip'.format(self.target.name))
+                return
+            for method in self.target.get_methods():
+                if self.skip(method): continue
+                caller = self.find_caller(MethodCallerFactory(method, fuzzer.get_caller()))
+                if caller != None: self.check_caller(caller)
+        else: raise Exception('Unknown target: {0}'.format(self.target))
+
+    # looks for parameter values which result to a successful call like other fuzzers do,
+    # returns a caller, or None if nothing was found
+    def find_caller(self, factory):
+        target = factory.target()
+        if target.has_unknown_parameters():
+            fuzzer = HardCorrectParametersFuzzer(factory)
+        elif target.number_of_parameters() == 1:
+            return factory.create()
+        else:
+            fuzzer = CorrectParametersFuzzer(factory.create())
+        fuzzer.set_general_parameter_values(self.general_parameter_values)
+        fuzzer.set_output_path(NO_PATH)
+        fuzzer.run()
+        if not fuzzer.success():
+            self.warn('could not find correct parameter values, skip: ' + target.fullname())
+            return None
+        return fuzzer.get_caller()
+
+    def log(self, message):
+        core.print_with_prefix('TargetCallersFuzzer', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+import json
+import os
+
+from string import Template
+
+from core import ParameterValue, MethodCaller, FunctionCaller
+from core import Stats, print_with_prefix, store_and_execute
+from cases import Case, LEAK_PHASE, apply_case, single_position_cases
+from fuzzer import TargetCallersFuzzer
+
+DEFAULT_LEAK_ITERATIONS = 5000
+
+# memory is measured after every batch of calls, the first quarter of batches is a warm-up
+LEAK_SAMPLES = 20
+
+# smaller batches are too noisy: a few allocations of the interpreter look like growth per call
+MIN_LEAK_BATCH = 25
+MIN_LEAK_ITERATIONS = LEAK_SAMPLES * MIN_LEAK_BATCH
+
+# growth per call which is reported as a leak:
+#   refs   - total reference count, only debug builds have sys.gettotalrefcount()
+#   traced - bytes allocated by Python allocators, they are traced by tracemalloc
+#   rss    - resident set size, it shows memory allocated by malloc() directly, but it grows by pages
+LEAK_THRESHOLDS = { 'refs': 0.5, 'traced': 16, 'rss': 64 }
+
+# memory should grow steadily, the coefficient of determination of a linear fit should be high
+MIN_FIT = 0.8
+
+LEAKS = 'leaks'
+REPORT = 'leaks.json'
+
+# code which calls a target many times, and fits memory usage,
+# it's a part of reproducers, so that they print growth per call when they run as scripts
+# samples are stored to arrays which are allocated before calls,
+# so that storing them doesn't look like growth of memory
+LEAK_PROBE = """
+import array
+import gc
+import os
+import sys
+import tracemalloc
+
+LEAK_METRICS = ('refs', 'traced', 'rss')
+
+# stores usage of memory to a sample of every metric, -1 means that a metric is not available
+def leak_usage(usage, sample):
+    gc.collect()
+    usage['refs'][sample] = sys.gettotalrefcount() if hasattr(sys, 'gettotalrefcount') else -1
+    usage['traced'][sample] = tracemalloc.get_traced_memory()[0]
+    usage['rss'][sample] = -1
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm') as statm: usage['rss'][sample] = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+# returns growth per call and the coefficient of determination of a linear fit
+def leak_fit(xs, ys):
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    syy = sum((y - my) ** 2 for y in ys)
+    sxy = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    if syy == 0: return (0.0, 0.0)
+    return (sxy / sxx, sxy * sxy / (sxx * syy))
+
+def leak_growth(call, iterations, samples):
+    batch = max(1, iterations // samples)
+    usage = dict((metric, array.array('q', [0] * samples)) for metric in LEAK_METRICS)
+    tracing = tracemalloc.is_tracing()
+    if not tracing: tracemalloc.start()
+    try:
+        for sample in range(samples):
+            for i in range(batch):
+                try: call()
+                except Exception: pass
+            leak_usage(usage, sample)
+    finally:
+        if not tracing: tracemalloc.stop()
+    start = samples // 4
+    calls = [(sample + 1) * batch for sample in range(start, samples)]
+    growth = {}
+    for metric in LEAK_METRICS:
+        ys = list(usage[metric][start:])
+        if -1 in ys: continue
+        growth[metric] = leak_fit(calls, ys)
+    return growth
+"""
+
+# calls a function or a method many times, and measures growth of memory per call,
+# a method is called on a new instance every time, so that an instance which legally grows
+# (for example, a buffer which is written to) doesn't look like a leak
+class LeakCaller:
+
+    __slots__ = ('caller', 'iterations', 'code')
+
+    template = """
+$imports
+$extra
+$probe
+$parameter_definitions
+
+def call():
+$call
+
+growth = leak_growth(call, $iterations, $samples)
+if __name__ == '__main__': print(growth)
+"""
+
+    def __init__(self, caller, iterations = DEFAULT_LEAK_ITERATIONS):
+        self.caller = caller
+        self.iterations = iterations
+        self.prepare()
+
+    def target(self):
+        return self.caller.target()
+
+    def prepare(self):
+        self.caller.prepare()
+        if type(self.caller) == MethodCaller:
+            parameter_definitions = self.caller.constructor_parameter_definitions + self.caller.method_parameter_definitions
+            call = ['object = {0:s}({1:s})'.format(self.caller.constructor_caller.classname(),
+                                                   ', '.join(self.caller.constructor_arguments)),
+                    'object.{0:s}({1:s})'.format(self.caller.method.name, ', '.join(self.caller.method_arguments))]
+        elif type(self.caller) == FunctionCaller:
+            parameter_definitions = self.caller.parameter_definitions
+            call = ['{0:s}.{1:s}({2:s})'.format(self.caller.function.module, self.caller.function.name,
+                                                ', '.join(self.caller.function_arguments))]
+        else:
+            raise Exception('Unknown caller')
+        template = Template(LeakCaller.template)
+        self.code = template.substitute(imports = self.caller.imports.code(),
+                                        extra = '\n'.join(sorted(self.caller.extra)),
+                                        probe = LEAK_PROBE,
+                                        parameter_definitions = '\n'.join(parameter_definitions),
+                                        call = '\n'.join('    ' + line for line in call),
+                                        iterations = self.iterations,
+                                        samples = LEAK_SAMPLES)
+
+    # returns a dictionary which maps metrics to growth per call and quality of a fit
+    def call(self):
+        self.prepare()
+        return store_and_execute(self.code)['growth']
+
+    def log(self, message):
+        print_with_prefix('LeakCaller', message)
+
+# returns metrics which grow steadily by more than their thresholds per call
+def growing_metrics(growth):
+    return set(metric for metric, (per_call, fit) in growth.items()
+               if per_call >= LEAK_THRESHOLDS[metric] and fit >= MIN_FIT)
+
+# looks for parameter values which result to a successful call of a function or methods of a class,
+# then calls the target with these values many times, and then with every fuzzing value in every position,
+# a combination of values is reported if memory grows per call in two runs in a row
+# (the first run may fill caches which stop growing later)
+class LeakFuzzer(TargetCallersFuzzer):
+
+    def __init__(self, target):
+        super().__init__(target, self.check)
+        self.iterations = DEFAULT_LEAK_ITERATIONS
+        self.leaks = []
+
+    def set_iterations(self, iterations):
+        self.iterations = iterations
+
+    # returns found leaks, every leak is a dictionary with a case ID, parameter values,
+    # growth per call and code of a reproducer
+    def get_leaks(self): return self.leaks
+
+    # checks correct parameter values, and then every fuzzing value in every position,
+    # a combination of values is checked only if a single call with it succeeds,
+    # if correct values leak already, the target is reported once, since other values would show the same leak
+    def check(self, caller):
+        target = caller.target()
+        self.log('look for leaks in {0:s}'.format(target.fullname()))
+        caller = caller.clone()
+        base_values = list(caller.get_parameter_values())
+        cases = [Case(target.fullname(), LEAK_PHASE, (), (), None)]
+        cases.extend(single_position_cases(target.fullname(), LEAK_PHASE,
+                                           target.number_of_parameters(), len(self.fuzzing_values)))
+        for case in cases:
+            if not self.accept(case): continue
+            apply_case(caller, case, base_values, self.fuzzing_values)
+            if not self.run_and_dump_code(caller, case): continue
+            if self.check_case(caller, case) and len(case.positions) == 0:
+                self.log('correct parameter values leak, skip other values for {0:s}'.format(target.fullname()))
+                return
+
+    # returns true if a leak was found
+    def check_case(self, caller, case):
+        leak_caller = LeakCaller(caller, self.iterations)
+        metrics = None
+        for attempt in range(2):
+            growth = self.measure(leak_caller)
+            if growth == None: return False
+            metrics = growing_metrics(growth) if metrics == None else metrics & growing_metrics(growth)
+            if len(metrics) == 0: return False
+        growth = dict((metric, growth[metric][0]) for metric in sorted(metrics))
+        self.warn('memory grows in {0:s}: {1:s}'.format(case.id(), describe_growth(growth)))
+        self.leaks.append({ 'target': case.target, 'case': case.id(),
+                            'parameters': [value_of(value) for value in caller.get_parameter_values()],
+                            'growth': growth, 'code': leak_caller.code })
+        return True
+
+    def measure(self, leak_caller):
+        try:
+            return leak_caller.call()
+        except Exception as err:
+            self.log('exception {0}: {1}'.format(type(err), str(err)))
+            return None
+        finally:
+            Stats.get().increment_tests()
+
+    def log(self, message):
+        print_with_prefix('LeakFuzzer', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
+
+def value_of(value):
+    if isinstance(value, ParameterValue): return value.value
+    return value
+
+def describe_growth(growth):
+    return ', '.join('{0:s} {1:.2f}'.format(metric, per_call) for metric, per_call in sorted(growth.items()))
+
+# collects leaks of all targets
+#
+#   out/leaks.json      - targets, case IDs, parameter values and growth per call
+#   out/leaks/<n>.py    - reproducers which print growth per call
+class LeakReport:
+
+    def __init__(self, out):
+        self.out = out
+        self.leaks = []
+
+    def add(self, leak):
+        directory = os.path.join(self.out, LEAKS)
+        if not os.path.isdir(directory): os.makedirs(directory)
+        leak = dict(leak)
+        code = leak.pop('code')
+        filename = os.path.join(directory, '{0:d}.py'.format(len(self.leaks) + 1))
+        with open(filename, 'w') as f:
+            f.write('# case: {0:s}\n'.format(leak['case']))
+            f.write('# growth per call: {0:s}\n'.format(describe_growth(leak['growth'])))
+            f.write(code)
+        leak['reproducer'] = filename
+        self.leaks.append(leak)
+
+    def save(self):
+        if not os.path.isdir(self.out): os.makedirs(self.out)
+        with open(os.path.join(self.out, REPORT), 'w') as f:
+            json.dump(self.leaks, f, indent=4)
+        self.log('found {0:d} leaks, see {1:s}'.format(len(self.leaks), os.path.join(self.out, REPORT)))
+
+    def log(self, message):
+        print_with_prefix('LeakReport', message)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+import fcntl
+import hashlib
+import json
+import os
+
+from campaign import write_atomically
+from core import print_with_prefix
+
+DEFAULT_UNCHANGED_FRACTION = 0.1
+
+# returns a digest of C sources of a module, the sources are a dictionary which maps filenames to contents,
+# filenames are relative to a directory with sources, so that the digest doesn't depend on where sources are
+def digest_of(sources, root):
+    digest = hashlib.sha1()
+    for filename in sorted(sources):
+        digest.update(os.path.relpath(filename, root).encode('utf-8') + b'\0')
+        digest.update(sources[filename].encode('utf-8', errors='replace') + b'\0')
+    return digest.hexdigest()
+
+# returns true for a deterministic pseudo-random fraction of modules,
+# a hash of a module, its digest and a seed is mapped to a number in [0, 1)
+def is_sampled(module, digest, seed, fraction):
+    value = hashlib.sha1('{0:s}:{1:s}:{2:s}'.format(module, digest, seed).encode('utf-8')).hexdigest()
+    return int(value, 16) / 2 ** 160 < fraction
+
+# digests of C sources of modules which were fuzzed by previous runs, the file looks like
+#
+#   {
+#       "_io": "<sha1 of Modules/_io/*.c>",
+#       "_json": "<sha1 of Modules/_json.c>"
+#   }
+#
+# several fuzzers may update the same manifest, for example, during a campaign,
+# so that the manifest is read again and updated under a lock
+class Manifest:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.digests = self.read()
+
+    def read(self):
+        if not os.path.isfile(self.filename): return {}
+        with open(self.filename) as f:
+            return json.load(f)
+
+    # splits modules to ones which changed since the previous run (or are new), and unchanged ones,
+    # returns changed modules, and unchanged modules which should be fuzzed anyway,
+    # every unchanged module is fuzzed with specified probability,
+    # the sample depends only on a seed of a run, so that all fuzzers of a campaign agree on it
+    def select(self, digests, unchanged_fraction = DEFAULT_UNCHANGED_FRACTION, seed = ''):
+        changed = sorted(module for module in digests if self.digests.get(module) != digests[module])
+        unchanged = sorted(module for module in digests if self.digests.get(module) == digests[module])
+        sampled = [module for module in unchanged if is_sampled(module, digests[module], seed, unchanged_fraction)]
+        return changed, sampled
+
+    # records digests of modules, other modules keep their digests
+    def update(self, digests):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(directory): os.makedirs(directory)
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.digests = self.read()
+            self.digests.update(digests)
+            write_atomically(self.filename, json.dumps(self.digests, indent=4, sort_keys=True))
+        self.log('updated digests of {0:d} modules in {1:s}'.format(len(digests), self.filename))
+
+    def log(self, message):
+        print_with_prefix('Manifest', message)
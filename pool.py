@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import collections
+import hashlib
+import types
+
+from core import ParameterValue, FunctionCaller, MethodCaller, print_with_prefix
+
+DEFAULT_VALUE_POOL = 16
+
+# objects of these types are already among fuzzing values, so that the pool doesn't collect them
+# (subclasses such as enums are collected), functions which return their parameters return them as well
+PLAIN_TYPES = (type(None), bool, int, float, complex, str, bytes, bytearray, tuple, list, dict, set, frozenset,
+               type, range, slice, memoryview, type(NotImplemented), type(Ellipsis), types.TracebackType)
+
+# Py_TPFLAGS_HEAPTYPE, classes which are defined in Python code have it
+HEAP_TYPE = 1 << 9
+
+# collects objects which successful calls return, for example, iterators, views, bound methods
+# and internal types of modules, some of them can't be obtained in another way,
+# and they are interesting inputs to other functions of the same module,
+# the pool keeps one object of every type, and when it's full, the type which was returned least recently is evicted,
+# an object is kept as code of the call which returned it, so that a test can create the object again:
+#
+#   def returned_3f9a0c1b2d():
+#       p1 = "ololo"
+#       return _io.StringIO(p1)
+#
+#   p1 = returned_3f9a0c1b2d()
+class ValuePool:
+
+    # a pool which collects returned objects, or None
+    current = None
+
+    def __init__(self, size = DEFAULT_VALUE_POOL):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def start(self):
+        ValuePool.current = self
+
+    def stop(self):
+        ValuePool.current = None
+        self.log('collected {0:d} values: {1:s}'.format(len(self.entries), ', '.join(self.entries)))
+
+    # adds an object returned by a caller,
+    # if the pool already has an object of the same type, the type only becomes the most recent one
+    def add(self, caller, value):
+        if not is_interesting(type(value)): return
+        if type(caller) != FunctionCaller and type(caller) != MethodCaller: return
+        key = type_name(type(value))
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = producer_of(caller)
+        self.log('found a new fuzzing value: {0:s} returned by {1:s}'.format(key, caller.target().fullname()))
+        if len(self.entries) > self.size:
+            evicted, producer = self.entries.popitem(last = False)
+            self.log('evict {0:s}'.format(evicted))
+
+    # returns values which create collected objects, the least recent ones go first
+    def values(self):
+        return list(self.entries.values())
+
+    def log(self, message):
+        print_with_prefix('ValuePool', message)
+
+# returns false for types which fuzzing values already have: plain types, built-in exceptions,
+# and classes which are defined in tests (tests run in a namespace of builtins module)
+def is_interesting(clazz):
+    if clazz in PLAIN_TYPES: return False
+    if clazz.__module__ != 'builtins': return True
+    if issubclass(clazz, BaseException): return False
+    return not clazz.__flags__ & HEAP_TYPE
+
+def type_name(clazz):
+    return '{0:s}.{1:s}'.format(clazz.__module__, clazz.__qualname__)
+
+# returns a value which creates an object by calling the same function or method with the same parameters again,
+# parameters are defined inside a function, so that they don't clash with parameters of a test
+def producer_of(caller):
+    caller.prepare()
+    if type(caller) == MethodCaller:
+        definitions = list(caller.constructor_parameter_definitions)
+        definitions.append('object = {0:s}({1:s})'.format(caller.constructor_caller.classname(),
+                                                          ', '.join(caller.constructor_arguments)))
+        definitions.extend(caller.method_parameter_definitions)
+        call = 'object.{0:s}({1:s})'.format(caller.method.name, ', '.join(caller.method_arguments))
+    else:
+        definitions = list(caller.parameter_definitions)
+        call = '{0:s}.{1:s}({2:s})'.format(caller.function.module, caller.function.name,
+                                           ', '.join(caller.function_arguments))
+    lines = [line for definition in definitions for line in definition.strip('\n').split('\n')]
+    lines.append('return ' + call)
+    body = ''.join('    {0:s}\n'.format(line) for line in lines)
+    name = 'returned_' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:10]
+    extra = '\n'.join(sorted(caller.extra) + ['def {0:s}():\n{1:s}'.format(name, body)])
+    return ParameterValue(name + '()', extra, caller.imports)
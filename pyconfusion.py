@@ -2,8 +2,23 @@
 
 import argparse
 import os.path
+import time
 from fuzzer import *
 from targets import *
+from strategy import parse_strategy
+from cases import parse_shard
+from selection import Selection
+from constants import DEFAULT_MAX_CONSTANTS
+from coordinator import Coordinator, Worker
+from coordinator import DEFAULT_ADDRESS, DEFAULT_UNITS_PER_TARGET, DEFAULT_LEASE_TIMEOUT
+from campaign import Campaign, Progress
+from differential import Differential
+from archive import archive_in, extract_tests
+from results import ResultsDB, QUERIES, DEFAULT_LIMIT, query, print_rows
+from manifest import Manifest, DEFAULT_UNCHANGED_FRACTION
+from leaks import LeakFuzzer, LeakReport, DEFAULT_LEAK_ITERATIONS, MIN_LEAK_ITERATIONS
+from complexity import ComplexityFuzzer, ComplexityReport, DEFAULT_MAX_INPUT_SIZE
+from pool import ValuePool, DEFAULT_VALUE_POOL
 
 
 def parse_list(filename):
@@ -25,60 +40,338 @@ class Task:
     # read arguments returned by argparse.ArgumentParser
     def __init__(self, args):
         self.args = vars(args)
+        self.targets = None
+        self.compiled_selection = None
+        self.constants = {}
+        self.digests = {}
+        self.unchanged_modules = set()
+        self.fuzzed_digests = {}
 
     def command(self):  return self.args['command']
     def out(self):      return self.args['out']
     def finder_filter(self): return self.args['finder_filter']
     def fuzzer_filter(self): return self.args['fuzzer_filter']
     def fuzzing_data(self):  return self.args['fuzzing_data']
+    def strategy(self):      return parse_strategy(self.args['strategy'])
+    def shard(self):         return parse_shard(self.args['shard'])
+    def address(self):       return self.args['address']
+    def units_per_target(self): return self.args['units_per_target']
+    def lease_timeout(self):    return self.args['lease_timeout']
+    def profile(self):          return self.args['profile']
+    def cprofile(self):         return self.args['cprofile']
+    def sequence_length(self):  return self.args['sequence_length']
+    def sequence_strategy(self): return parse_strategy(self.args['sequence_strategy'])
+    def async_batch(self):      return self.args['async_batch']
+    def threads(self):          return self.args['threads']
+    def jobs(self):             return self.args['jobs']
+    def progress(self):         return self.args['progress']
+    def archive(self):          return self.args['archive']
+    def case(self):             return self.args['case']
+    def results(self):          return self.args['results']
+    def query(self):            return self.args['query']
+    def value(self):            return self.args['value']
+    def limit(self):            return self.args['limit']
+    def return_values(self):    return self.args['return_values']
+    def max_constants(self):    return self.args['max_constants']
+    def module_depth(self):     return self.args['module_depth']
+    def finder_jobs(self):      return self.args['finder_jobs']
+    def manifest(self):         return self.args['manifest']
+    def unchanged_fraction(self): return self.args['unchanged_fraction']
+    def manifest_seed(self):    return self.args['manifest_seed']
+    def leak_iterations(self):  return self.args['leak_iterations']
+    def max_input_size(self):   return self.args['max_input_size']
+    def value_pool(self):       return self.args['value_pool']
+
+    # returns a list of interpreters for differential mode
+    def pythons(self):      return self.list_of('pythons')
 
     # returns a list of excluded elements
-    def excludes(self):
-        if not self.args['exclude']:
-            return []
-        if os.path.isfile(self.args['exclude']):
-            return parse_list(self.args['exclude'])
-        return self.args['exclude'].split(',')
+    def excludes(self):     return self.list_of('exclude')
+
+    # returns a list of patterns which select targets to be fuzzed
+    def includes(self):
+        if not self.fuzzer_filter(): return []
+        return self.fuzzer_filter().split(',')
+
+    # returns a selection of targets built from the filter and the exclude list,
+    # the exclude list is read and compiled only once
+    def selection(self):
+        if self.compiled_selection == None:
+            self.compiled_selection = Selection(self.includes(), self.excludes())
+        return self.compiled_selection
+
+    # returns a selection which only contains the exclude list, it's used by the finder and fuzzers
+    def exclusion(self):    return self.selection().exclusion()
 
     # returns a list of modules
-    def modules(self):
-        if not self.args['modules']:
+    def modules(self):      return self.list_of('modules')
+
+    # returns a list of directories with results to be merged
+    def inputs(self):       return self.list_of('inputs')
+
+    # returns a list from a comma-separated argument, or from a file specified by the argument
+    def list_of(self, name):
+        if not self.args[name]:
             return []
-        if os.path.isfile(self.args['modules']):
-            return parse_list(self.args['modules'])
-        return self.args['modules'].split(',')
+        if os.path.isfile(self.args[name]):
+            return parse_list(self.args[name])
+        return self.args[name].split(',')
 
     def run(self):
+        profiler = None
+        if self.profile():
+            profiler = Profiler(self.profile(), self.cprofile())
+            profiler.start()
+        if self.archive() and self.out():
+            TestDump.open_archive(self.out())
+        results = None
+        if self.results() and self.command() in FUZZING_COMMANDS:
+            results = ResultsDB(self.results())
+            results.set_record_results(self.return_values())
+            results.start(self.command(), self.modules())
+        try:
+            self.run_command()
+        finally:
+            if results: results.stop()
+            TestDump.close_archives()
+            if profiler:
+                profiler.stop()
+                profiler.print()
+
+    def run_command(self):
         if   self.command() == 'targets': self.search_targets()
         elif self.command() == 'fuzzer':  self.fuzz()
+        elif self.command() == 'merge':   self.merge()
+        elif self.command() == 'coordinator': self.coordinate()
+        elif self.command() == 'worker':  self.work()
+        elif self.command() == 'campaign': self.campaign()
+        elif self.command() == 'extract': self.extract()
+        elif self.command() == 'report':  self.report()
+        elif self.command() == 'differential': self.differential()
+        elif self.command() == 'leaks':   self.leaks()
+        elif self.command() == 'complexity': self.complexity()
         else: raise Exception('Unknown command: ' + self.command())
 
     def search_targets(self):
-        return TargetFinder(self.args['src'], self.modules(), self.excludes()).run(self.finder_filter())
+        finder = TargetFinder(self.args['src'], self.modules(), self.exclusion(), self.max_constants(),
+                              self.module_depth(), self.finder_jobs())
+        targets = finder.run(self.finder_filter())
+        self.constants = finder.constants
+        self.digests = finder.module_digests()
+        if self.manifest(): self.select_changed_modules(targets)
+        return targets
+
+    # in incremental mode, modules whose C sources didn't change since the previous run are not fuzzed,
+    # but a pseudo-random sample of them is fuzzed anyway, modules without C sources are always fuzzed
+    def select_changed_modules(self, targets):
+        modules = set(target.module for target in targets if self.selects(target))
+        digests = dict((module, digest) for module, digest in self.digests.items() if module in modules)
+        changed, sampled = Manifest(self.manifest()).select(digests, self.unchanged_fraction(), self.manifest_seed())
+        self.unchanged_modules = set(digests) - set(changed) - set(sampled)
+        self.log('{0:d} modules changed since the previous run: {1:s}'.format(len(changed), ', '.join(changed)))
+        self.log('{0:d} unchanged modules are fuzzed anyway: {1:s}'.format(len(sampled), ', '.join(sampled)))
+        self.log('skip {0:d} unchanged modules'.format(len(self.unchanged_modules)))
+        self.fuzzed_digests = digests
+
+    # records digests of modules which were fuzzed, so that the next run skips them if they don't change
+    def update_manifest(self):
+        if self.manifest(): Manifest(self.manifest()).update(self.fuzzed_digests)
 
     def fuzz(self):
         targets = self.search_targets()
         if len(targets) == 0:
             self.warn('no targets! exiting ...')
             return
+        if self.shard():
+            self.log('run shard {0}'.format(self.shard()))
+        if self.threads() > 0 and not gil_disabled():
+            self.warn('GIL is enabled, races between threads are unlikely to show up')
+        progress = None
+        if self.progress(): progress = Progress(self.progress())
         extra_fuzzing_values = self.look_for_class_instances(targets)
+        # shards would collect different objects, and cases with the same IDs would get different values
+        pool = None
+        if self.value_pool() > 0 and not self.shard():
+            pool = ValuePool(self.value_pool())
+            pool.start()
+        try:
+            for target in targets:
+                # check if the line matches specified filter
+                if self.skip_fuzzing(target): continue
+                if progress:
+                    if progress.seen(target.fullname()):
+                        self.log('skip {0:s}, it was fuzzed before'.format(target.fullname()))
+                        continue
+                    progress.begin(target.fullname())
+                self.fuzz_target(target, extra_fuzzing_values, self.shard(), self.out())
+                if progress: progress.end(target.fullname())
+        finally:
+            if pool: pool.stop()
+
+        self.update_manifest()
+        if self.out(): Stats.get().save(self.out())
+
+    def fuzz_target(self, target, extra_fuzzing_values, case_filter, out):
+        with span_timer(target.fullname()):
+            self.run_fuzzer(target, extra_fuzzing_values, case_filter, out)
+
+    def run_fuzzer(self, target, extra_fuzzing_values, case_filter, out):
+        if isinstance(target, TargetFunction):
+            fuzzer = SmartFunctionFuzzer(target)
+        elif isinstance(target, TargetClass):
+            fuzzer = SmartClassFuzzer(target)
+            fuzzer.set_sequence_length(self.sequence_length())
+            fuzzer.set_sequence_strategy(self.sequence_strategy())
+            fuzzer.set_async_batch_size(self.async_batch())
+            fuzzer.set_threads(self.threads())
+        else: raise Exception('Unknown target: {0}'.format(target))
+
+        fuzzer.set_output_path(out)
+        fuzzer.set_excludes(self.selection())
+        fuzzer.set_strategy(self.strategy())
+        fuzzer.set_case_filter(case_filter)
+        fuzzer.add_fuzzing_values(extra_fuzzing_values)
+        fuzzer.add_extra_values(self.constants.get(target.module, []))
+        if ValuePool.current != None: fuzzer.add_extra_values(ValuePool.current.values())
+        fuzzer.add_general_parameter_values(extra_fuzzing_values)
+        fuzzer.run()
+
+    # serves targets to workers as work units
+    def coordinate(self):
+        targets = [target.fullname() for target in self.search_targets() if not self.skip_fuzzing(target)]
+        Coordinator(self.address(), targets, self.out(), self.units_per_target(), self.lease_timeout()).run()
+        self.update_manifest()
+
+    # takes work units from a coordinator
+    def work(self):
+        Worker(self.address(), self).run()
+
+    # fuzzes modules in parallel, every module in a separate interpreter
+    def campaign(self):
+        if not self.out():
+            raise Exception('no output directory specified')
+        campaign = Campaign(self.modules(), self.out(), self.jobs(), self.fuzzer_options())
+        campaign.run()
+        if campaign.failed_all():
+            raise Exception('could not fuzz any module, see fuzzer logs in {0:s}'.format(self.out()))
+
+    # runs the same cases on two interpreters, and reports cases with different outcomes
+    def differential(self):
+        if not self.out():
+            raise Exception('no output directory specified')
+        Differential(self.modules(), self.out(), self.jobs(), self.fuzzer_options(), self.pythons()).run()
+
+    # calls correct parameter values of targets many times, and reports targets and values
+    # which make memory grow per call
+    def leaks(self):
+        if not self.out():
+            raise Exception('no output directory specified')
+        if self.leak_iterations() < MIN_LEAK_ITERATIONS:
+            raise Exception('--leak_iterations should be at least {0:d}'.format(MIN_LEAK_ITERATIONS))
+        targets = self.search_targets()
+        report = LeakReport(self.out())
+        for target in targets:
+            if self.skip_fuzzing(target): continue
+            with span_timer(target.fullname()):
+                fuzzer = LeakFuzzer(target)
+                fuzzer.set_iterations(self.leak_iterations())
+                fuzzer.set_excludes(self.selection())
+                fuzzer.set_case_filter(self.shard())
+                fuzzer.add_fuzzing_values(self.constants.get(target.module, []))
+                fuzzer.run()
+            for leak in fuzzer.get_leaks(): report.add(leak)
+        report.save()
+
+    # times calls of targets with inputs of growing size, and reports inputs which make time grow super-linearly
+    def complexity(self):
+        if not self.out():
+            raise Exception('no output directory specified')
+        targets = self.search_targets()
+        report = ComplexityReport(self.out())
         for target in targets:
-            # check if the line matches specified filter
             if self.skip_fuzzing(target): continue
+            with span_timer(target.fullname()):
+                fuzzer = ComplexityFuzzer(target)
+                fuzzer.set_max_input_size(self.max_input_size())
+                fuzzer.set_excludes(self.selection())
+                fuzzer.set_case_filter(self.shard())
+                fuzzer.run()
+            for finding in fuzzer.get_findings(): report.add(finding)
+        report.save()
 
-            if isinstance(target, TargetFunction):
-                fuzzer = SmartFunctionFuzzer(target)
-            elif isinstance(target, TargetClass):
-                fuzzer = SmartClassFuzzer(target)
-            else: raise Exception('Unknown target: {0}'.format(target))
+    # returns options which are passed to fuzzers run by a campaign,
+    # paths become absolute because the fuzzers run in other directories
+    def fuzzer_options(self):
+        options = []
+        for name in FUZZER_OPTIONS:
+            value = self.args[name]
+            if value is None or value is False or value == '': continue
+            if name in PATH_OPTIONS and os.path.exists(value): value = os.path.abspath(value)
+            if name in FILE_OPTIONS: value = os.path.abspath(value)
+            options.append('--' + name)
+            # only store_true options go without a value, 1 == True, so that ints are checked by type
+            if not isinstance(value, bool): options.append(str(value))
+        return options
 
-            fuzzer.set_output_path(self.out())
-            fuzzer.set_excludes(self.excludes())
-            fuzzer.add_fuzzing_values(extra_fuzzing_values)
-            fuzzer.add_general_parameter_values(extra_fuzzing_values)
-            fuzzer.run()
+    # looks for targets and extra fuzzing values once for all work units
+    def load_targets(self):
+        if self.targets != None: return
+        targets = self.search_targets()
+        self.targets = {}
+        for target in targets: self.targets[target.fullname()] = target
+        self.extra_fuzzing_values = self.look_for_class_instances(targets)
+
+    # fuzzes a slice of cases for a single target
+    def fuzz_unit(self, fullname, case_filter, out):
+        self.load_targets()
+        self.fuzz_target(self.targets[fullname], self.extra_fuzzing_values, case_filter, out)
+
+    # merges results of several runs (for example, shards) to one directory,
+    # identical tests are stored only once
+    def merge(self):
+        if not self.out():
+            raise Exception('no output directory specified')
+        dump = TestDump(self.out())
+        for path in self.inputs():
+            self.log('merge results from ' + path)
+            for subdir, key, code in read_tests(path):
+                dump.store_code_once(subdir, key, code)
+            if os.path.isfile(os.path.join(path, Stats.filename)):
+                Stats.get().load(path)
+            else:
+                self.warn('no stats found in ' + path)
+        Stats.get().save(self.out())
+
+    # restores tests from archives, all tests of selected targets, or a single case
+    def extract(self):
+        if not self.out():
+            raise Exception('no output directory specified')
+        for path in self.inputs():
+            archive = archive_in(path)
+            if archive == None:
+                self.warn('no archive found in ' + path)
+                continue
+            if self.case():
+                tests = [archive.by_case[self.case()]] if self.case() in archive.by_case else []
+            else:
+                tests = []
+                for target in archive.by_target:
+                    if self.selection().selects(target): tests.extend(archive.by_target[target])
+            for filename in extract_tests(archive, tests, self.out()):
+                self.log('extract ' + filename)
+            self.log('extracted {0:d} of {1:d} tests from {2:s}'.format(len(tests), len(archive.tests), path))
+
+    # prints results of a built-in query to the results database
+    def report(self):
+        if not self.results():
+            raise Exception('no results database specified')
+        print_rows(query(self.results(), self.query(), self.value(), self.limit()))
 
     def look_for_class_instances(self, targets):
+        with span_timer('extra fuzzing values'):
+            return self.create_class_instances(targets)
+
+    def create_class_instances(self, targets):
         self.log('look for extra fuzzing values')
         values = []
         for target in targets:
@@ -101,18 +394,14 @@ class Task:
 
     # returns true if fuzzing of specified target should be skipped
     def skip_fuzzing(self, target):
-        # check if filter was specified
-        if self.fuzzer_filter() and not self.fuzzer_filter() in target.fullname():
-            return True
-
-        if self.excludes():
-            if isinstance(self.excludes(), list):
-                for exclude in self.excludes():
-                    if exclude in target.fullname(): return True
-            else:
-                if self.excludes() in target.fullname(): return True
+        return not self.selects(target) or target.module in self.unchanged_modules
 
-        return False
+    # returns true if a target matches --fuzzer_filter and --exclude,
+    # a class is selected if any of its methods is, and fuzzers check its methods with the same selection
+    def selects(self, target):
+        if isinstance(target, TargetClass):
+            return self.selection().selects_class(target.fullname(), [method.fullname() for method in target.get_methods()])
+        return self.selection().selects(target.fullname())
 
     def log(self, message):
         core.print_with_prefix('Task', message)
@@ -120,16 +409,83 @@ class Task:
     def warn(self, message):
         self.log('warning: {0:s}'.format(message))
 
+# options of a campaign which are passed to fuzzers
+FUZZER_OPTIONS = ('src', 'fuzzer_filter', 'finder_filter', 'exclude', 'fuzzing_data', 'strategy', 'shard',
+                  'sequence_length', 'sequence_strategy', 'async_batch', 'threads', 'archive', 'results', 'return_values',
+                  'max_constants', 'module_depth', 'finder_jobs', 'manifest', 'unchanged_fraction', 'manifest_seed',
+                  'value_pool')
+PATH_OPTIONS = ('src', 'exclude', 'fuzzing_data')
+FILE_OPTIONS = ('results', 'manifest')
+
+# commands which run cases, and may record them to a results database
+FUZZING_COMMANDS = ('fuzzer', 'worker')
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--src',            help='path to sources', default='./')
 parser.add_argument('--command',        help='what do you want to do?',
-                    choices=['targets', 'fuzzer'], default='targets')
-parser.add_argument('--fuzzer_filter',  help='target filter for fuzzer', default='')
+                    choices=['targets', 'fuzzer', 'merge', 'coordinator', 'worker', 'campaign', 'extract', 'report', 'differential', 'leaks', 'complexity'],
+                    default='targets')
+parser.add_argument('--fuzzer_filter',  help='comma-separated list of patterns which select targets for fuzzer', default='')
+parser.add_argument('--max_constants',  help='maximum number of integer and string constants from C sources '
+                                             'which are used as extra fuzzing values for a module, 0 means no constants',
+                    type=int, default=DEFAULT_MAX_CONSTANTS)
 parser.add_argument('--finder_filter',  help='file filter for finder', default='')
+parser.add_argument('--module_depth',   help='how deep finder explores submodules and other nested modules, '
+                                             '0 (default) means no nested modules', type=int, default=DEFAULT_MODULE_DEPTH)
+parser.add_argument('--finder_jobs',    help='number of processes which explore nested modules',
+                    type=int, default=DEFAULT_FINDER_JOBS)
+parser.add_argument('--manifest',       help='path to file with digests of C sources of modules which were fuzzed before, '
+                                             'modules whose sources did not change are skipped')
+parser.add_argument('--unchanged_fraction', help='fraction of unchanged modules which are fuzzed anyway if --manifest is set',
+                    type=float, default=DEFAULT_UNCHANGED_FRACTION)
+parser.add_argument('--manifest_seed',  help='seed which selects unchanged modules that are fuzzed anyway, '
+                                             'the current date by default', default=time.strftime('%Y-%m-%d'))
 parser.add_argument('--out',            help='path to directory for generated tests')
-parser.add_argument('--exclude',        help='comma-separated list of objects to exclude or path to exclude list', default='')
+parser.add_argument('--exclude',        help='comma-separated list of patterns to exclude or path to exclude list', default='')
 parser.add_argument('--modules',        help='comma-separated list of modules to fuzz or path to file with modules', default='')
 parser.add_argument('--fuzzing_data',   help='a script which provides data for fuzzing', default='')
+parser.add_argument('--strategy',       help='how to combine values for several parameters: '
+                                             'exhaustive, pairwise, <t>-wise or random-sample-<N>', default='exhaustive')
+parser.add_argument('--shard',          help='run only i-th of N deterministic slices of cases, for example, 2/8', default='')
+parser.add_argument('--address',        help='host:port or path to Unix socket of coordinator', default=DEFAULT_ADDRESS)
+parser.add_argument('--units_per_target', help='number of work units per target for coordinator',
+                    type=int, default=DEFAULT_UNITS_PER_TARGET)
+parser.add_argument('--lease_timeout',  help='seconds after which a work unit is given to another worker',
+                    type=int, default=DEFAULT_LEASE_TIMEOUT)
+parser.add_argument('--sequence_length', help='length of sequences of method calls on the same instance, '
+                                               '0 means no sequences', type=int, default=NO_SEQUENCES)
+parser.add_argument('--sequence_strategy', help='how to build sequences of method calls: '
+                                                 'exhaustive, pairwise, <t>-wise or random-sample-<N>', default='pairwise')
+parser.add_argument('--async_batch',    help='how many awaitables, asynchronous iterators and context managers '
+                                             'are run concurrently', type=int, default=DEFAULT_ASYNC_BATCH)
+parser.add_argument('--threads',        help='number of threads which call a method at once on the same instance, '
+                                             '0 means one thread', type=int, default=NO_THREADS)
+parser.add_argument('--jobs',           help='number of modules which a campaign fuzzes in parallel',
+                    type=int, default=os.cpu_count())
+parser.add_argument('--progress',       help='path to file where fuzzer records targets it began and finished, '
+                                             'targets listed in the file are skipped')
+parser.add_argument('--archive',        help='store tests to a single archive in the output directory '
+                                             'instead of separate files', action='store_true')
+parser.add_argument('--case',           help='ID of a case which extract command restores from archives')
+parser.add_argument('--results',        help='path to SQLite database where every case is recorded, '
+                                             'or which report command reads')
+parser.add_argument('--return_values',  help='record reprs of objects returned by functions and methods '
+                                             'to the results database', action='store_true')
+parser.add_argument('--value_pool',     help='how many objects returned by successful calls are used as extra fuzzing values, '
+                                             'one object of every type, 0 means no objects', type=int, default=DEFAULT_VALUE_POOL)
+parser.add_argument('--leak_iterations', help='how many times leaks command calls every combination of parameter values, '
+                                             'at least {0:d}'.format(MIN_LEAK_ITERATIONS),
+                    type=int, default=DEFAULT_LEAK_ITERATIONS)
+parser.add_argument('--max_input_size', help='maximum size of inputs which complexity command passes to targets',
+                    type=int, default=DEFAULT_MAX_INPUT_SIZE)
+parser.add_argument('--pythons',        help='comma-separated list of two interpreters for differential command')
+parser.add_argument('--query',          help='query which report command runs',
+                    choices=sorted(QUERIES), default='targets')
+parser.add_argument('--value',          help='parameter value for successes query, for example, \'"x" * 1048576\'')
+parser.add_argument('--limit',          help='number of rows for slowest query', type=int, default=DEFAULT_LIMIT)
+parser.add_argument('--profile',        help='path to directory for time spent in fuzzing stages and a trace of targets')
+parser.add_argument('--cprofile',       help='run cProfile as well, requires --profile', action='store_true')
+parser.add_argument('--inputs',         help='comma-separated list of directories with results to merge or extract, or path to file with directories', default='')
 
 # create task
 task = Task(parser.parse_args())
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import os
+import queue
+import re
+import reprlib
+import sqlite3
+import sys
+import threading
+import time
+
+from core import target_of, ParameterValue, FunctionCaller, MethodCaller, print_with_prefix
+
+SUCCESS = 'success'
+EXCEPTION = 'exception'
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_LIMIT = 20
+MAX_MESSAGE_LENGTH = 1000
+MAX_RESULT_LENGTH = 200
+
+# queued cases are written at least that often, so that a crash loses only the last moment of fuzzing
+FLUSH_INTERVAL = 0.5
+
+# elements of containers which a repr of a returned object shows
+MAX_RESULT_ELEMENTS = 32
+
+# seconds to wait for other processes which write to the same database, for example, during a campaign
+LOCK_TIMEOUT = 60
+
+SCHEMA = """
+create table if not exists runs (
+    id integer primary key,
+    started real,
+    command text,
+    modules text,
+    python text
+);
+create table if not exists cases (
+    id integer primary key,
+    run integer references runs(id),
+    target text,
+    case_id text,
+    parameters text,
+    outcome text,
+    exception_type text,
+    exception_message text,
+    result text,
+    duration real
+);
+create index if not exists cases_by_target on cases(target);
+create index if not exists cases_by_outcome on cases(outcome, target);
+create index if not exists cases_by_exception on cases(exception_type);
+create index if not exists cases_by_case on cases(case_id);
+"""
+
+# built-in queries for reports, every query is a description, SQL and a list of parameters which the query takes
+QUERIES = {
+    'runs': ('cases and outcomes per run', """
+        select runs.id, datetime(runs.started, 'unixepoch'), runs.modules, count(cases.id),
+               sum(cases.outcome = 'success'), sum(cases.outcome = 'exception'), round(sum(cases.duration), 3)
+        from runs left join cases on cases.run = runs.id
+        group by runs.id order by runs.id""", []),
+    'targets': ('cases and outcomes per target', """
+        select target, count(*), sum(outcome = 'success'), sum(outcome = 'exception'), round(max(duration), 6)
+        from cases group by target order by target""", []),
+    'exceptions': ('exception types per target', """
+        select target, exception_type, count(*), min(exception_message)
+        from cases where outcome = 'exception'
+        group by target, exception_type order by target, count(*) desc""", []),
+    'successes': ('targets which returned successfully with a parameter value', """
+        select target, count(*), min(case_id)
+        from cases where outcome = 'success'
+            and exists (select 1 from json_each(cases.parameters) where json_each.value = ?)
+        group by target order by target""", ['value']),
+    'slowest': ('slowest cases', """
+        select target, case_id, round(duration, 6), outcome, exception_type
+        from cases order by duration desc limit ?""", ['limit']),
+}
+
+# returns rendered parameter values of a caller
+def parameters_of(caller):
+    while not hasattr(caller, 'get_parameter_values') and hasattr(caller, 'caller'):
+        caller = caller.caller
+    if not hasattr(caller, 'get_parameter_values'): return []
+    values = []
+    for value in caller.get_parameter_values():
+        if isinstance(value, ParameterValue): value = value.value
+        values.append(str(value))
+    return values
+
+# builds bounded reprs, so that a huge fuzzed object (for example, a string of 2**20 characters)
+# is not rendered completely, bytes and bytearrays are cut before they are rendered as well
+class ResultRepr(reprlib.Repr):
+
+    def __init__(self):
+        super().__init__()
+        self.maxstring = MAX_RESULT_LENGTH
+        self.maxother = MAX_RESULT_LENGTH
+        self.maxlong = MAX_RESULT_LENGTH
+        self.maxlist = self.maxtuple = self.maxset = self.maxfrozenset = MAX_RESULT_ELEMENTS
+        self.maxdict = self.maxdeque = self.maxarray = MAX_RESULT_ELEMENTS
+
+    def repr_bytes(self, value, level):
+        return self.cut(value, repr(value[:self.maxstring]))
+
+    def repr_bytearray(self, value, level):
+        return self.cut(value, repr(value[:self.maxstring]))
+
+    def cut(self, value, text):
+        if len(value) <= self.maxstring: return text
+        return '{0:s}... len={1:d}'.format(text, len(value))
+
+RESULT_REPR = ResultRepr()
+
+# returns a repr of a returned object which doesn't depend on addresses of objects,
+# long reprs are cut, and followed by a digest of the bounded repr
+def result_repr(value):
+    try:
+        text = RESULT_REPR.repr(value)
+    except Exception as err:
+        text = 'repr() failed: {0:s}'.format(type(err).__name__)
+    text = re.sub(r' at 0x[0-9a-fA-F]+', ' at 0x...', text)
+    if len(text) > MAX_RESULT_LENGTH:
+        digest = hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest()
+        text = '{0:s}... sha1={1:s}'.format(text[:MAX_RESULT_LENGTH], digest)
+    return text
+
+# records every executed case to an SQLite database,
+# cases are queued, and a writer thread inserts them in batches in a single transaction,
+# so that fuzzing doesn't wait for the database after every case,
+# a batch is written when it's full or after FLUSH_INTERVAL seconds,
+# the database uses write-ahead logging, so that fuzzers of a campaign which share a database
+# don't block each other, and an error of the database is logged instead of stopping fuzzing
+class ResultsDB:
+
+    # a database which is currently open, or None
+    current = None
+
+    def __init__(self, filename, batch_size = DEFAULT_BATCH_SIZE):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.rows = []
+        self.queue = queue.Queue()
+        self.writer = None
+        self.record_results = False
+
+    # makes the database record reprs of objects returned by functions and methods
+    def set_record_results(self, record_results):
+        self.record_results = record_results
+
+    def start(self, command, modules):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(directory): os.makedirs(directory)
+        # the connection is used only by the writer thread once it starts
+        self.connection = sqlite3.connect(self.filename, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        self.connection.execute('pragma journal_mode=wal')
+        self.connection.executescript(SCHEMA)
+        with self.connection:
+            cursor = self.connection.execute('insert into runs (started, command, modules, python) values (?, ?, ?, ?)',
+                                             (time.time(), command, ','.join(modules), sys.version))
+        self.run = cursor.lastrowid
+        self.writer = threading.Thread(target=self.write, daemon=True)
+        self.writer.start()
+        ResultsDB.current = self
+
+    def stop(self):
+        ResultsDB.current = None
+        self.queue.put(None)
+        self.writer.join()
+        self.connection.close()
+
+    # adds a case, exception is None if the call succeeded, result is an object which the call returned
+    def add(self, caller, case, exception, duration, result = None):
+        case_id = None
+        if case != None: case_id = case.id()
+        outcome = SUCCESS
+        exception_type = None
+        exception_message = None
+        if exception != None:
+            outcome = EXCEPTION
+            exception_type = type(exception).__name__
+            exception_message = str(exception)[:MAX_MESSAGE_LENGTH]
+        rendered_result = None
+        if self.record_results and exception == None and type(caller) in (FunctionCaller, MethodCaller):
+            rendered_result = result_repr(result)
+        self.queue.put((self.run, target_of(caller), case_id, json.dumps(parameters_of(caller)),
+                        outcome, exception_type, exception_message, rendered_result, duration))
+
+    # takes cases from the queue until None, and inserts them in batches
+    def write(self):
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while True:
+            try:
+                row = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = ()
+            if row == None: break
+            if row: self.rows.append(row)
+            if len(self.rows) >= self.batch_size or time.monotonic() >= deadline:
+                self.flush()
+                deadline = time.monotonic() + FLUSH_INTERVAL
+        self.flush()
+        if len(self.rows) > 0: self.warn('lost {0:d} cases which could not be written'.format(len(self.rows)))
+
+    # inserts queued cases, they are kept if the database is not available, and written with the next batch
+    def flush(self):
+        if len(self.rows) == 0: return
+        try:
+            with self.connection:
+                self.connection.executemany('insert into cases (run, target, case_id, parameters, outcome, '
+                                            'exception_type, exception_message, result, duration) '
+                                            'values (?, ?, ?, ?, ?, ?, ?, ?, ?)', self.rows)
+            self.rows = []
+        except sqlite3.Error as err:
+            self.warn('could not write {0:d} cases to {1:s}: {2}'.format(len(self.rows), self.filename, err))
+
+    def log(self, message):
+        print_with_prefix('ResultsDB', message)
+
+    def warn(self, message):
+        self.log('warning: {0:s}'.format(message))
+
+# runs a built-in query, returns its rows
+def query(filename, name, value = None, limit = DEFAULT_LIMIT):
+    if not name in QUERIES:
+        raise Exception('Unknown query: {0}, available queries: {1}'.format(name, ', '.join(sorted(QUERIES))))
+    if not os.path.isfile(filename):
+        raise Exception('No results database: {0}'.format(filename))
+    description, sql, parameters = QUERIES[name]
+    arguments = []
+    for parameter in parameters:
+        if parameter == 'value':
+            if value == None: raise Exception('{0} query requires a value'.format(name))
+            arguments.append(value)
+        if parameter == 'limit': arguments.append(limit)
+    connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+    try:
+        return connection.execute(sql, arguments).fetchall()
+    finally:
+        connection.close()
+
+# compares cases with the same IDs in two databases, returns cases which have different outcomes,
+# exception types, or reprs of returned objects (if both databases have them),
+# every row is a target, a case ID, and an outcome, an exception type and a result from each database
+def compare(filename, other_filename):
+    connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+    try:
+        connection.execute('attach database ? as other', (other_filename,))
+        return connection.execute("""
+            select a.target, a.case_id, a.outcome, a.exception_type, a.result, b.outcome, b.exception_type, b.result
+            from cases a join other.cases b on a.case_id = b.case_id
+            where a.case_id is not null
+                and (a.outcome != b.outcome
+                     or coalesce(a.exception_type, '') != coalesce(b.exception_type, '')
+                     or (a.result is not null and b.result is not null and a.result != b.result))
+            group by a.case_id order by a.target, a.case_id""").fetchall()
+    finally:
+        connection.close()
+
+# returns a number of case IDs which are in both databases
+def common_cases(filename, other_filename):
+    connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+    try:
+        connection.execute('attach database ? as other', (other_filename,))
+        return connection.execute("""
+            select count(distinct a.case_id) from cases a join other.cases b on a.case_id = b.case_id""").fetchone()[0]
+    finally:
+        connection.close()
+
+# returns a number of cases without IDs, they can't be compared with cases in another database
+def cases_without_ids(filename):
+    connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+    try:
+        return connection.execute('select count(*) from cases where case_id is null').fetchone()[0]
+    finally:
+        connection.close()
+
+# prints rows of a query as tab-separated lines
+def print_rows(rows):
+    for row in rows:
+        print('\t'.join('' if column == None else str(column) for column in row))
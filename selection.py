@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+import fnmatch
+import re
+
+# a selection of targets is defined by include and exclude patterns,
+# a target is selected if it matches any include pattern (or there are no include patterns),
+# and doesn't match any exclude pattern
+#
+# patterns are matched against full names of targets like '_io.StringIO.read':
+#   _io.StringIO            - a dotted name, it matches if it occurs in a full name
+#                             as whole components, for example, 'StringIO' matches '_io.StringIO.read',
+#                             but 'String' doesn't
+#   _io.*IO.read*           - a glob, it matches a whole full name
+#   re:^_io\..*\.read       - a regular expression, it may match any part of a full name
+#   module:os               - a module and everything in it
+#   class:_io.StringIO      - a class and its methods
+#   method:_io.StringIO.read, function:os.system
+#                           - a single method or function
+#
+# dotted names and scopes are stored in sets, so that matching them doesn't depend
+# on the number of patterns, globs and regular expressions are compiled to a single regular expression
+
+SCOPES = ('module', 'class')
+EXACT_SCOPES = ('method', 'function')
+REGEX_PREFIX = 're:'
+GLOB_CHARACTERS = '*?['
+
+class Matcher:
+
+    def __init__(self, patterns):
+        self.names = set()
+        self.prefixes = set()
+        self.exact = set()
+        expressions = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern: continue
+            scope, separator, name = pattern.partition(':')
+            if pattern.startswith(REGEX_PREFIX):
+                expressions.append(pattern[len(REGEX_PREFIX):])
+            elif separator and scope in SCOPES:
+                self.prefixes.add(name)
+            elif separator and scope in EXACT_SCOPES:
+                self.exact.add(name)
+            elif any(c in pattern for c in GLOB_CHARACTERS):
+                expressions.append(fnmatch.translate(pattern))
+            else:
+                self.names.add(tuple(pattern.split('.')))
+        self.expression = None
+        if expressions:
+            self.expression = re.compile('|'.join('(?:{0:s})'.format(e) for e in expressions))
+        self.empty = not (self.names or self.prefixes or self.exact or self.expression)
+
+    def matches(self, fullname):
+        if self.empty: return False
+        if fullname in self.exact: return True
+        components = fullname.split('.')
+        for end in range(1, len(components) + 1):
+            if '.'.join(components[:end]) in self.prefixes: return True
+            if self.names:
+                for start in range(end):
+                    if tuple(components[start:end]) in self.names: return True
+        return self.expression != None and self.expression.search(fullname) != None
+
+    # returns true if a full name or a scope which contains it matches,
+    # for example, '_io.StringIO.read' matches if '_io.StringIO' does
+    def matches_scope(self, fullname):
+        components = fullname.split('.')
+        for end in range(len(components), 0, -1):
+            if self.matches('.'.join(components[:end])): return True
+        return False
+
+class Selection:
+
+    def __init__(self, includes = [], excludes = []):
+        self.includes = Matcher(includes)
+        self.excludes = Matcher(excludes)
+
+    # returns true if a target with specified full name should be fuzzed,
+    # a method is included if it or its class matches an include pattern
+    def selects(self, fullname):
+        if not self.includes.empty and not self.includes.matches_scope(fullname): return False
+        return not self.excludes.matches(fullname)
+
+    # returns true if a class or any of its methods should be fuzzed,
+    # methods are checked again by fuzzers
+    def selects_class(self, fullname, method_fullnames):
+        if self.excludes.matches(fullname): return False
+        if self.selects(fullname): return True
+        return any(self.selects(method_fullname) for method_fullname in method_fullnames)
+
+    def skips(self, fullname):
+        return not self.selects(fullname)
+
+    # returns a selection with the same exclude patterns but without include patterns,
+    # patterns are not compiled again
+    def exclusion(self):
+        if self.includes.empty: return self
+        selection = Selection()
+        selection.excludes = self.excludes
+        return selection
+
+NO_SELECTION = Selection()
+
+# returns a selection for specified excludes which may be a Selection,
+# a list of patterns or a single pattern
+def selection_of(excludes):
+    if isinstance(excludes, Selection): return excludes
+    if not excludes: return NO_SELECTION
+    if isinstance(excludes, str): return Selection(excludes=[excludes])
+    return Selection(excludes=excludes)
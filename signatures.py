@@ -0,0 +1,265 @@
+#!/usr/bin/python
+
+import re
+
+from core import ParameterType
+from constants import COMMENTS
+
+# format units of PyArg_Parse* functions
+# https://docs.python.org/3/c-api/arg.html
+FORMAT_UNITS = {
+    's': ParameterType.string,              'z': ParameterType.string,
+    'u': ParameterType.string,              'Z': ParameterType.string,
+    'U': ParameterType.string,              'C': ParameterType.character,
+    'y': ParameterType.byte_like_object,    'S': ParameterType.byte_like_object,
+    'Y': ParameterType.byte_array,          'c': ParameterType.byte,
+    'w': ParameterType.writable_buffer,
+    'b': ParameterType.integer,             'B': ParameterType.integer,
+    'h': ParameterType.integer,             'H': ParameterType.integer,
+    'i': ParameterType.integer,             'I': ParameterType.integer,
+    'l': ParameterType.integer,             'k': ParameterType.integer,
+    'L': ParameterType.integer,             'K': ParameterType.integer,
+    'n': ParameterType.integer,
+    'f': ParameterType.double,              'd': ParameterType.double,
+    'D': ParameterType.complex,             'p': ParameterType.boolean,
+    'O': ParameterType.any_object,
+}
+
+# units which take a buffer if they are followed by '*'
+BUFFER_UNITS = { 'y': ParameterType.buffer, 'w': ParameterType.writable_buffer }
+
+# type objects which are passed to 'O!' units and Argument Clinic's subclass_of
+TYPE_OBJECTS = {
+    'PyUnicode_Type': ParameterType.string,
+    'PyBytes_Type': ParameterType.byte_like_object,
+    'PyByteArray_Type': ParameterType.byte_array,
+    'PyLong_Type': ParameterType.integer,
+    'PyFloat_Type': ParameterType.double,
+    'PyComplex_Type': ParameterType.complex,
+    'PyBool_Type': ParameterType.boolean,
+    'PyTuple_Type': ParameterType.tuple,
+    'PyList_Type': ParameterType.list,
+    'PyDict_Type': ParameterType.dictionary,
+}
+
+# converters which are passed to 'O&' units
+CONVERTERS = {
+    'PyUnicode_FSConverter': ParameterType.string,
+    'PyUnicode_FSDecoder': ParameterType.string,
+    '_PyLong_FileDescriptor_Converter': ParameterType.integer,
+    '_Py_convert_optional_to_ssize_t': ParameterType.integer,
+}
+
+# Argument Clinic converters
+# https://devguide.python.org/development-tools/clinic/
+CLINIC_CONVERTERS = {
+    'str': ParameterType.string,                'unicode': ParameterType.string,
+    'Py_UNICODE': ParameterType.string,         'path_t': ParameterType.string,
+    'PyBytesObject': ParameterType.byte_like_object,
+    'PyByteArrayObject': ParameterType.byte_array,
+    'Py_buffer': ParameterType.buffer,          'char': ParameterType.byte,
+    'Py_UCS4': ParameterType.character,         'bool': ParameterType.boolean,
+    'double': ParameterType.double,             'float': ParameterType.double,
+    'Py_complex': ParameterType.complex,
+    'int': ParameterType.integer,               'long': ParameterType.integer,
+    'long_long': ParameterType.integer,         'short': ParameterType.integer,
+    'unsigned_char': ParameterType.integer,     'unsigned_short': ParameterType.integer,
+    'unsigned_int': ParameterType.integer,      'unsigned_long': ParameterType.integer,
+    'unsigned_long_long': ParameterType.integer,
+    'Py_ssize_t': ParameterType.integer,        'ssize_t': ParameterType.integer,
+    'size_t': ParameterType.integer,            'off_t': ParameterType.integer,
+    'slice_index': ParameterType.integer,       'fildes': ParameterType.integer,
+    'pid_t': ParameterType.integer,             'uid_t': ParameterType.integer,
+    'gid_t': ParameterType.integer,             'mode_t': ParameterType.integer,
+    'dev_t': ParameterType.integer,             'uint64': ParameterType.integer,
+    'int64': ParameterType.integer,
+}
+
+# converters of parameters which are not passed by a caller
+CLINIC_IMPLICIT_CONVERTERS = ('self', 'defining_class')
+
+# positions of formats in arguments of PyArg_Parse* calls, a format is the second argument by default
+FORMAT_POSITIONS = { 'PyArg_ParseTupleAndKeywords': 2, '_PyArg_ParseStack': 2 }
+
+PARSE_CALLS = re.compile(r'\b(PyArg_ParseTuple|PyArg_ParseTupleAndKeywords|PyArg_Parse|_PyArg_ParseStack)\s*\(')
+STRING_LITERAL = re.compile(r'\s*"((?:[^"\\\n]|\\.)*)"')
+FUNCTION_DEFINITIONS = re.compile(r'^([A-Za-z_]\w*)\s*\([^;{]*?\)\s*\{', re.MULTILINE | re.DOTALL)
+METHOD_DEFINITIONS = re.compile(r'\{\s*"(\w+)"\s*,\s*(?:\((?:[^()]|\([^()]*\))*\)\s*)*(\w+)\s*,\s*METH_')
+CLINIC_BLOCKS = re.compile(r'/\*\[clinic input\]\n(.*?)\[clinic start generated code\]\*/', re.DOTALL)
+CLINIC_PARAMETER = re.compile(r'^(\w+)(?:\s+as\s+\w+)?\s*:\s*(\w+)\s*(\((.*)\))?')
+CLINIC_DIRECTIVES = ('module ', 'class ', 'output ', 'preserve', 'dump ', 'destination ', 'set ', '@')
+
+# number of arguments which format units store values to, '#' adds a length
+STORED_ARGUMENTS = { 'O!': 2, 'O&': 2, 'es': 2, 'et': 2 }
+
+AMBIGUOUS = None
+
+# looks for parameter types of functions and methods in C sources of a module,
+# returns a dictionary which maps names of callables to tuples of parameter types,
+# names are relative to the module:
+#   - 'function' and 'Class.method' come from Argument Clinic
+#   - 'function' and 'method' come from format strings of PyArg_Parse* calls,
+#     a name is taken from the format ("O|n:bisect"), or from a method table which refers to the C function,
+#     a name which has different formats in different places is dropped
+def harvest_parameter_types(sources):
+    result = {}
+    for source in sources:
+        for name, types in clinic_parameter_types(source):
+            result[name] = types
+        for name, types in format_parameter_types(COMMENTS.sub('', source)):
+            if name in result and result[name] != types: result[name] = AMBIGUOUS
+            else: result[name] = types
+    return dict((name, types) for name, types in result.items() if types != AMBIGUOUS)
+
+# yields names and parameter types from [clinic input] blocks:
+#
+#   _io.StringIO.read
+#       size: Py_ssize_t(accept={int, NoneType}) = -1
+#       /
+#
+# a module name is dropped from names of callables, clones ("new = old") get parameters of original callables
+def clinic_parameter_types(source):
+    callables = {}
+    for block in CLINIC_BLOCKS.finditer(source):
+        name = None
+        types = []
+        indent = None
+        for line in block.group(1).split('\n'):
+            if line.strip() == '': continue
+            if name == None:
+                if line.startswith(CLINIC_DIRECTIVES): continue
+                name, separator, original = line.partition('=')
+                name = name.split()[0]
+                original = original.split('->')[0].strip()
+                if original in callables: types = list(callables[original])
+                continue
+            current_indent = len(line) - len(line.lstrip())
+            if current_indent == 0: break
+            if indent == None: indent = current_indent
+            if current_indent != indent: continue
+            match = CLINIC_PARAMETER.match(line.strip())
+            if match == None: continue
+            converter, arguments = match.group(2), match.group(4) or ''
+            if converter in CLINIC_IMPLICIT_CONVERTERS: continue
+            types.append(clinic_parameter_type(converter, arguments))
+        if name == None: continue
+        callables[name] = tuple(types)
+        yield name.partition('.')[2], callables[name]
+
+def clinic_parameter_type(converter, arguments):
+    if converter == 'object':
+        for type_object in TYPE_OBJECTS:
+            if type_object in arguments: return TYPE_OBJECTS[type_object]
+        return ParameterType.any_object
+    if converter == 'Py_buffer' and 'rwbuffer' in arguments: return ParameterType.writable_buffer
+    if converter == 'int' and 'accept={str}' in arguments: return ParameterType.character
+    return CLINIC_CONVERTERS.get(converter, ParameterType.any_object)
+
+# yields names and parameter types from format strings of PyArg_Parse* calls
+def format_parameter_types(source):
+    names = {}
+    for match in METHOD_DEFINITIONS.finditer(source):
+        names.setdefault(match.group(2), []).append(match.group(1))
+    functions = [(match.start(), match.group(1)) for match in FUNCTION_DEFINITIONS.finditer(source)]
+    for call in PARSE_CALLS.finditer(source):
+        arguments = call_arguments(source, call.end())
+        position = FORMAT_POSITIONS.get(call.group(1), 1)
+        if len(arguments) <= position: continue
+        format = string_literals(arguments[position])
+        if format == None: continue
+        # PyArg_ParseTupleAndKeywords() takes a list of keywords after a format
+        if call.group(1) == 'PyArg_ParseTupleAndKeywords': position = position + 1
+        # a format may end with ':name' of a function or ';message' of an error which is not a name
+        format = format.partition(';')[0]
+        format, separator, name = format.partition(':')
+        types = format_types(format, arguments[position + 1:])
+        if types == None: continue
+        if name != '':
+            yield name, types
+            continue
+        function = enclosing_function(functions, call.start())
+        for name in names.get(function, []): yield name, types
+
+# returns parameter types for a format, or None if the format could not be parsed,
+# type objects of 'O!' units and converters of 'O&' units are taken from arguments of the call
+def format_types(format, arguments):
+    types = []
+    argument = 0
+    i = 0
+    while i < len(format):
+        unit = format[i]
+        i = i + 1
+        if unit in '|$': continue
+        if unit == '(':
+            depth = 1
+            while i < len(format) and depth > 0:
+                if format[i] == '(': depth = depth + 1
+                if format[i] == ')': depth = depth - 1
+                if not format[i] in '()|$#*!&': argument = argument + 1
+                i = i + 1
+            types.append(ParameterType.tuple)
+            continue
+        if unit == 'e':
+            if i >= len(format): return None
+            unit = unit + format[i]
+            i = i + 1
+        elif not unit in FORMAT_UNITS: return None
+        modifier = ''
+        if i < len(format) and format[i] in '#*!&':
+            modifier = format[i]
+            i = i + 1
+        if modifier == '!' and argument < len(arguments):
+            types.append(TYPE_OBJECTS.get(arguments[argument].lstrip('&').strip(), ParameterType.any_object))
+        elif modifier == '&' and argument < len(arguments):
+            types.append(CONVERTERS.get(arguments[argument].strip(), ParameterType.any_object))
+        elif modifier == '*' and unit in BUFFER_UNITS: types.append(BUFFER_UNITS[unit])
+        elif unit.startswith('e'): types.append(ParameterType.string)
+        else: types.append(FORMAT_UNITS[unit])
+        argument = argument + STORED_ARGUMENTS.get(unit + modifier, STORED_ARGUMENTS.get(unit, 1))
+        if modifier == '#': argument = argument + 1
+    return tuple(types)
+
+# returns arguments of a call which starts at specified position (after an opening parenthesis)
+def call_arguments(source, start):
+    arguments = []
+    depth = 0
+    current = start
+    i = start
+    while i < len(source):
+        c = source[i]
+        if c == '"':
+            match = STRING_LITERAL.match(source, i)
+            if match != None:
+                i = match.end()
+                continue
+        if c in '([{': depth = depth + 1
+        if c in ')]}':
+            if depth == 0:
+                arguments.append(source[current:i].strip())
+                return arguments
+            depth = depth - 1
+        if c == ',' and depth == 0:
+            arguments.append(source[current:i].strip())
+            current = i + 1
+        i = i + 1
+    return arguments
+
+# returns a string which consists of adjacent string literals, or None if there is something else
+def string_literals(argument):
+    result = ''
+    position = 0
+    while position < len(argument):
+        match = STRING_LITERAL.match(argument, position)
+        if match == None: return None
+        result = result + match.group(1)
+        position = match.end()
+    if position == 0: return None
+    return result
+
+# returns a name of a C function which contains specified position
+def enclosing_function(functions, position):
+    name = None
+    for start, function in functions:
+        if start > position: break
+        name = function
+    return name
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+from core import ParameterValue
+
+# sizes around these powers of two are tried, a ladder stops at a limit of its type
+LADDER_EXPONENTS = (4, 8, 12, 16, 20)
+
+# outcomes of rungs, an exception is recorded by its type name
+SUCCESS = 'success'
+SKIPPED = 'skipped'
+
+# returns sizes of a ladder: 2**k - 1, 2**k, 2**k + 1 for every exponent below the limit, and the limit
+def ladder_sizes(limit):
+    sizes = []
+    for exponent in LADDER_EXPONENTS:
+        if 2 ** exponent + 1 >= limit: break
+        sizes.extend((2 ** exponent - 1, 2 ** exponent, 2 ** exponent + 1))
+    sizes.append(limit)
+    return tuple(sizes)
+
+# a family of values of the same type and growing sizes, for example, "x" * 15, "x" * 16, "x" * 17, ...
+class Ladder:
+
+    __slots__ = ('name', 'template', 'sizes', 'import_statement')
+
+    def __init__(self, name, template, limit, import_statement = None):
+        self.name = name
+        self.template = template
+        self.sizes = ladder_sizes(limit)
+        self.import_statement = import_statement
+
+    def value(self, rung):
+        return SizedValue(self.template.format(self.sizes[rung]), self, rung, self.import_statement)
+
+    # returns values for all rungs but the first one
+    def bigger_values(self):
+        return [self.value(rung) for rung in range(1, len(self.sizes))]
+
+# a value which is a rung of a ladder, only the first rung is added to fuzzing values,
+# bigger rungs are added by fuzzers
+class SizedValue(ParameterValue):
+
+    __slots__ = ('ladder', 'rung')
+
+    def __init__(self, value, ladder, rung, import_statement = None):
+        super().__init__(value, '', import_statement)
+        self.ladder = ladder
+        self.rung = rung
+
+# values which targets iterate over are limited by 2**20 elements (even ranges which are lazy),
+# buffers are backed by anonymous memory maps which take no memory until they are touched,
+# so that they may be bigger (memory maps are wrapped by memoryviews,
+# because they have close() methods, and look like coroutines)
+LADDERS = (Ladder('string', '"x" * {0}', 2 ** 20),
+           Ladder('tuple', '(42,) * {0}', 2 ** 20),
+           Ladder('range', 'range(0, {0})', 2 ** 20),
+           Ladder('bytearray', 'bytearray({0})', 2 ** 20),
+           Ladder('memoryview', 'memoryview(mmap.mmap(-1, {0}))', 2 ** 24, 'import mmap'),
+           Ladder('readonly memoryview', 'memoryview(mmap.mmap(-1, {0})).toreadonly()', 2 ** 24, 'import mmap'),
+           Ladder('non-contiguous memoryview', 'memoryview(mmap.mmap(-1, 2 * {0}))[::2]', 2 ** 24, 'import mmap'))
+
+SIZED_VALUES = tuple(ladder.value(0) for ladder in LADDERS)
+
+# decides which rungs of ladders are run for a parameter:
+# the first two rungs are always run, then a ladder grows while outcomes of the target change,
+# and stops after two rungs with the same outcome, for example, the target rejects the type whatever size is,
+# or it accepts both sizes, so that bigger sizes are not likely to behave differently,
+# a rung which was not run (for example, it belongs to another shard) doesn't stop a ladder
+class LadderState:
+
+    def __init__(self):
+        self.outcomes = {}
+
+    # returns true if a rung should be run, key identifies a parameter and a ladder
+    def allows(self, key, rung):
+        if rung < 2: return True
+        previous = self.outcomes.get((key, rung - 1))
+        if previous == SKIPPED: return False
+        if previous == None: return True
+        return previous != self.outcomes.get((key, rung - 2))
+
+    def record(self, key, rung, outcome):
+        self.outcomes[(key, rung)] = outcome
+
+    def skip(self, key, rung):
+        self.outcomes[(key, rung)] = SKIPPED
+
+# returns an outcome of a call, exception is None if the call succeeded
+def outcome_of(exception):
+    if exception == None: return SUCCESS
+    return type(exception).__name__
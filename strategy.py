@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+import itertools
+import random
+
+DEFAULT_SEED = 0
+
+# strategies build a set of test cases for a callable which has several parameters
+# each parameter position has its own number of values,
+# and each case is a tuple of value indexes, one index per parameter position,
+# strategies with the same description build the same rows, so that they are equal
+class Strategy:
+
+    # returns true if rows for the sizes are built in memory anyway, so that they are worth caching,
+    # other strategies generate rows lazily in lexicographic order
+    def builds_rows(self, sizes):
+        return False
+
+    def __eq__(self, other):
+        return isinstance(other, Strategy) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+# enumerates all possible combinations of values (cartesian product)
+class ExhaustiveStrategy(Strategy):
+
+    def rows(self, sizes):
+        return itertools.product(*[range(size) for size in sizes])
+
+    def __str__(self):
+        return 'exhaustive'
+
+# builds a covering array of specified strength with IPOG algorithm,
+# so that every combination of values for any 'strength' parameter positions
+# is covered by at least one case (strength = 2 means pairwise testing)
+class CoveringArrayStrategy(Strategy):
+
+    def __init__(self, strength):
+        if strength < 1:
+            raise Exception('unexpected strength of covering array: {0}'.format(strength))
+        self.strength = strength
+
+    def rows(self, sizes):
+        if self.strength >= len(sizes):
+            return ExhaustiveStrategy().rows(sizes)
+        return covering_array(sizes, self.strength)
+
+    def builds_rows(self, sizes):
+        return self.strength < len(sizes)
+
+    def __str__(self):
+        if self.strength == 2: return 'pairwise'
+        return '{0:d}-wise'.format(self.strength)
+
+# picks specified number of distinct random cases,
+# the cases are always the same for the same seed
+class RandomSampleStrategy(Strategy):
+
+    def __init__(self, samples, seed = DEFAULT_SEED):
+        if samples < 1:
+            raise Exception('unexpected number of samples: {0}'.format(samples))
+        self.samples = samples
+        self.seed = seed
+
+    def rows(self, sizes):
+        total = 1
+        for size in sizes: total = total * size
+        if total <= self.samples:
+            return ExhaustiveStrategy().rows(sizes)
+        numbers = random.Random(self.seed).sample(range(total), self.samples)
+        return (decode(number, sizes) for number in sorted(numbers))
+
+    def __str__(self):
+        return 'random-sample-{0:d}'.format(self.samples)
+
+DEFAULT_STRATEGY = ExhaustiveStrategy()
+
+# the number of exhaustive sequences grows too fast with their length (42 methods ** 5 steps),
+# while pairs of methods in every pair of positions are still affordable
+DEFAULT_SEQUENCE_STRATEGY = CoveringArrayStrategy(2)
+
+# converts a number to a case, the number is treated as a mixed-radix number
+# where every parameter position is a digit
+def decode(number, sizes):
+    row = []
+    for size in reversed(sizes):
+        row.append(number % size)
+        number = number // size
+    return tuple(reversed(row))
+
+# IPOG: start with all combinations for the first 'strength' positions,
+# then add positions one by one, extending existing cases first (horizontal growth),
+# and then adding new cases for combinations which are still not covered (vertical growth)
+def covering_array(sizes, strength):
+    rows = [list(row) for row in itertools.product(*[range(size) for size in sizes[:strength]])]
+    for column in range(strength, len(sizes)):
+        combos = list(itertools.combinations(range(column), strength - 1))
+        uncovered = set()
+        for combo in combos:
+            for values in itertools.product(*[range(sizes[c]) for c in combo]):
+                for value in range(sizes[column]):
+                    uncovered.add((combo, values, value))
+
+        # horizontal growth
+        for row in rows:
+            best_value = 0
+            best_tuples = []
+            for value in range(sizes[column]):
+                tuples = []
+                for combo in combos:
+                    t = (combo, tuple(row[c] for c in combo), value)
+                    if t in uncovered: tuples.append(t)
+                if len(tuples) > len(best_tuples):
+                    best_value = value
+                    best_tuples = tuples
+            row.append(best_value)
+            uncovered.difference_update(best_tuples)
+
+        # vertical growth, None means that any value can be used
+        extra_rows = []
+        for combo, values, value in sorted(uncovered):
+            for row in extra_rows:
+                if row[column] not in (None, value): continue
+                if all(row[c] in (None, v) for c, v in zip(combo, values)):
+                    break
+            else:
+                row = [None] * (column + 1)
+                extra_rows.append(row)
+            row[column] = value
+            for c, v in zip(combo, values): row[c] = v
+        rows.extend(extra_rows)
+
+    return [tuple(0 if value is None else value for value in row) for row in rows]
+
+# creates a strategy by its name:
+#   exhaustive, pairwise, <t>-wise (for example, 3-wise), random-sample-<N>
+def parse_strategy(name):
+    if not name or name == 'exhaustive':
+        return ExhaustiveStrategy()
+    if name == 'pairwise':
+        return CoveringArrayStrategy(2)
+    try:
+        if name.endswith('-wise'):
+            return CoveringArrayStrategy(int(name[:-len('-wise')]))
+        if name.startswith('random-sample-'):
+            return RandomSampleStrategy(int(name[len('random-sample-'):]))
+    except ValueError: pass
+    raise Exception('unknown strategy: {0}'.format(name))
@@ -1,10 +1,20 @@
 #!/usr/bin/python
 
+import concurrent.futures
+import multiprocessing
 import os
+import sys
 import core
 from core import *
 from enum import Enum
 from inspect import Parameter
+from selection import selection_of
+from constants import harvest_constants, DEFAULT_MAX_CONSTANTS
+from signatures import harvest_parameter_types
+from manifest import digest_of
+
+DEFAULT_MODULE_DEPTH = 0
+DEFAULT_FINDER_JOBS = 1
 
 def look_for_c_files(path):
     result = []
@@ -85,6 +95,44 @@ except: pass
     exec(code, {}, loc)
     return loc['result']
 
+# returns a real name of a module which is an item of another module,
+# or None if the module can't be imported by its dotted name, for example, "sys" imported by a module,
+# os.path can be imported as "os.path", and its real name is "posixpath"
+def nested_module_name(parent_module, module):
+    loc = {}
+    fullname = parent_module + '.' + module
+    code = """
+result = None
+try:
+    import sys
+    import {0}
+    module = {1}
+    if sys.modules.get('{1}') is module: result = module.__name__
+except: pass
+""".format(parent_module, fullname)
+    exec(code, {}, loc)
+    return loc['result']
+
+def is_main_module(module):
+    return module == '__main__' or module.endswith('.__main__')
+
+# returns names of submodules of a package, including the ones which are not imported yet,
+# __main__ submodules are skipped because importing them runs command line tools
+def submodules_of(module):
+    loc = {}
+    code = """
+result = []
+try:
+    import pkgutil
+    import {0}
+    if hasattr({0}, '__path__'):
+        result = [name for finder, name, ispkg in pkgutil.iter_modules({0}.__path__, '{0}.')
+                  if not name.endswith('.__main__')]
+except: pass
+""".format(module)
+    exec(code, {}, loc)
+    return loc['result']
+
 def is_class(module, name):
     loc = {}
     fullname = module + '.' + name
@@ -153,20 +201,46 @@ except: pass
     exec(code, {}, loc)
     return loc['signature']
 
+# looks for targets in modules which are defined in C sources, or which are specified by names
+#
+# nested modules are explored after that, for example, submodules of packages and os.path,
+# a nested module is explored only once even if several modules refer to it,
+# and only if it's not deeper than the depth limit,
+# modules at the same depth may be explored by several processes,
+# so that a native package with hundreds of submodules doesn't take ages,
+# and a submodule which crashes the interpreter on import doesn't stop the search
 class TargetFinder:
 
     NO_SRC = 'no sources'
 
-    def __init__(self, path, modules, excludes = []):
+    # a finder in a process which explores nested modules
+    worker = None
+
+    def __init__(self, path, modules, excludes = [], max_constants = DEFAULT_MAX_CONSTANTS,
+                 max_depth = DEFAULT_MODULE_DEPTH, jobs = DEFAULT_FINDER_JOBS):
         self.path = path
         self.modules = modules
-        self.excludes = excludes
+        self.excludes = selection_of(excludes)
+        self.max_constants = max_constants
+        self.max_depth = max_depth
+        self.jobs = jobs
+        self.constants = {}
+        self.parameter_types = {}
 
     def run(self, filter):
+        with stage_timer(DISCOVERY_STAGE):
+            return self.find(filter)
+
+    def find(self, filter):
         self.contents = {}
         self.classes = []
         self.targets = []
         self.native_modules = []
+        self.constants = {}
+        self.parameter_types = {}
+        self.sources = {}
+        self.nested = []
+        self.visited = set()
 
         if self.path:
             for filename in look_for_c_files(self.path):
@@ -178,19 +252,17 @@ class TargetFinder:
                 self.parse_c_file(filename)
 
         if self.modules:
-            for module in self.modules: self.look_for_targets(TargetFinder.NO_SRC, module)
+            for module in self.modules:
+                if module in self.visited: continue
+                self.look_for_targets(TargetFinder.NO_SRC, module)
 
-        return self.targets
+        self.explore_nested_modules()
 
-    def skip(self, target):
-        if self.excludes:
-            if isinstance(self.excludes, list):
-                for exclude in self.excludes:
-                    if exclude in target: return True
-            else:
-                if self.excludes in target: return True
+        return self.targets
 
-        return False
+    # returns true if an item of a module is excluded
+    def skip(self, module, item):
+        return self.excludes.skips(module + '.' + item)
 
     def parse_c_file(self, filename):
         self.log('parse file: ' + filename)
@@ -211,10 +283,51 @@ class TargetFinder:
                 if module_name == None:
                     self.warn('could not find module name for pointer: ' + pointer)
                     continue
+                # if modules are specified as well, then sources only tell more about them
+                if self.modules and not module_name in self.modules:
+                    self.log('skip module {0:s} which is not in the list of modules'.format(module_name))
+                    continue
                 self.log('found module: {0:s}'.format(module_name))
                 self.native_modules.append(module_name)
+                self.sources[module_name] = self.module_sources(filename)
+                self.look_for_constants(filename, module_name)
+                self.look_for_parameter_types(filename, module_name)
                 self.look_for_targets(filename, module_name)
 
+    # collects integer and string constants from sources of a module
+    def look_for_constants(self, filename, module):
+        if self.max_constants == 0: return
+        sources = [''.join(self.contents[f]) for f in self.module_sources(filename)]
+        self.constants[module] = harvest_constants(sources, self.max_constants)
+        self.log('found {0:d} constants in module {1:s}'.format(len(self.constants[module]), module))
+
+    # collects parameter types of functions and methods from format strings and Argument Clinic in sources of a module
+    def look_for_parameter_types(self, filename, module):
+        sources = [''.join(self.contents[f]) for f in self.module_sources(filename)]
+        self.parameter_types[module] = harvest_parameter_types(sources)
+        self.log('found parameter types of {0:d} callables in module {1:s}'
+                 .format(len(self.parameter_types[module]), module))
+
+    # returns digests of C sources of modules which were found in the sources
+    def module_digests(self):
+        root = self.path
+        if os.path.isfile(root): root = os.path.dirname(root)
+        digests = {}
+        for module, filenames in self.sources.items():
+            digests[module] = digest_of(dict((f, ''.join(self.contents[f])) for f in filenames), root)
+        return digests
+
+    # returns C files of a module which is defined in specified file,
+    # if there are no other modules in the same directory, then all C files in the directory belong to the module,
+    # for example, Modules/_io/*.c
+    def module_sources(self, filename):
+        directory = os.path.dirname(filename)
+        siblings = [f for f in self.contents if os.path.dirname(f) == directory and f.endswith('.c')]
+        for sibling in siblings:
+            if sibling != filename and any('PyModule_Create' in line for line in self.contents[sibling]):
+                return [filename]
+        return siblings
+
     def look_for_module_name(self, filename, pointer):
         content = self.contents[filename]
         found_structure = False
@@ -227,25 +340,90 @@ class TargetFinder:
             if 'PyModuleDef' in line and pointer in line:
                 found_structure = True
 
-    def look_for_targets(self, filename, module):
+    # depth is 0 for modules which are defined in C sources or specified by names, and 1 for their submodules
+    def look_for_targets(self, filename, module, depth = 0):
+        self.visited.add(module)
         try:
             __import__(module)
         except:
             self.warn('could not import module: {0}'.format(module))
             return
         for item in browse_module(module):
-            if self.skip(item):
+            if self.skip(module, item):
                 self.log('skip ' + item)
-                return
-            if item == 'True' or item == 'False': return
-            elif is_module(module, item):       self.add_module(filename, module, item)
+                continue
+            if item == 'True' or item == 'False': continue
+            elif is_module(module, item):       self.add_module(filename, module, item, depth)
             elif is_class(module, item):        self.add_class(filename, module, item)
             elif is_function(module, item):     self.add_function(filename, module, item)
             else: self.warn('unknown item in module "{0:s}": {1:s}'.format(module, item))
-
-    def add_module(self, filename, parent_module, module):
-        # TODO: explore nested modules
+        for submodule in submodules_of(module):
+            parent, separator, item = submodule.rpartition('.')
+            if self.skip(parent, item):
+                self.log('skip ' + submodule)
+                continue
+            self.add_nested_module(filename, submodule, submodule, depth + 1)
+
+    def add_module(self, filename, parent_module, module, depth):
         self.log('found module: ' + module)
+        name = nested_module_name(parent_module, module)
+        if name == None:
+            self.log('skip module {0:s} which {1:s} imports from elsewhere'.format(module, parent_module))
+            return
+        self.add_nested_module(filename, parent_module + '.' + module, name, depth + 1)
+
+    # queues a nested module for exploring, a module has a name which is used to import it,
+    # and a real name which may be different, for example, os.path and posixpath
+    def add_nested_module(self, filename, module, real_name, depth):
+        if module in self.visited or real_name in self.visited or module in (self.modules or []): return
+        if is_main_module(module) or is_main_module(real_name):
+            self.log('skip module {0:s} which runs a program on import'.format(module))
+            return
+        if depth > self.max_depth:
+            self.log('skip module {0:s} which is deeper than {1:d}'.format(module, self.max_depth))
+            return
+        self.visited.add(module)
+        self.visited.add(real_name)
+        self.nested.append((filename, module, real_name, depth))
+
+    # explores nested modules level by level until there are no new ones
+    def explore_nested_modules(self):
+        while len(self.nested) > 0:
+            nested = self.nested
+            self.nested = []
+            self.log('explore {0:d} nested modules'.format(len(nested)))
+            if self.jobs > 1 and len(nested) > 1: self.explore_in_parallel(nested)
+            else:
+                for filename, module, real_name, depth in nested:
+                    self.look_for_targets(filename, module, depth)
+
+    # every module is explored by a separate task, tasks return targets and nested modules which they found,
+    # if a process crashed, modules which it may have explored are explored again one by one,
+    # and a module which crashes a process on its own is given up
+    def explore_in_parallel(self, nested):
+        failed = self.run_tasks(nested, self.jobs)
+        for entry in failed:
+            if len(self.run_tasks([entry], 1)) > 0:
+                self.warn('could not explore module {0:s}, it crashed the process'.format(entry[1]))
+
+    # returns modules which could not be explored because a process crashed
+    def run_tasks(self, nested, jobs):
+        failed = []
+        sys.stdout.flush()
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(min(jobs, len(nested)), mp_context=context,
+                                                    initializer=set_worker, initargs=(self,)) as executor:
+            futures = [(executor.submit(explore_module, filename, module, depth), (filename, module, real_name, depth))
+                       for filename, module, real_name, depth in nested]
+            for future, entry in futures:
+                try:
+                    targets, nested_modules = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    failed.append(entry)
+                    continue
+                self.targets.extend(targets)
+                for nested_entry in nested_modules: self.add_nested_module(*nested_entry)
+        return failed
 
     def add_class(self, filename, module, classname):
         self.log('found class: ' + classname)
@@ -265,31 +443,73 @@ class TargetFinder:
 
     def add_function(self, filename, module, func_name):
         func = TargetFunction(filename, module, func_name)
-        # TODO: can we figure out parameter types here?
         self.try_to_set_parameter_types(module, func)
         self.targets.append(func)
         if func.has_unknown_parameters():   self.log('found a function with unknown parameters: ' + func_name)
         elif func.has_no_parameters():      self.log('found a function with no parameters: ' + func_name)
         else:                               self.log('found a function with {0:d} parameters: {1:s}'.format(func.number_of_parameters(), func_name))
 
+    # parameters are taken from a signature, their types are taken from C sources if they are known there,
+    # if there is no signature, then both are taken from C sources
     def try_to_set_parameter_types(self, module, target_callable):
         # TODO: try to use __text_signature__ attribute if get_signature() fails
         signature = get_signature(module, target_callable.fullname())
+        types = self.find_parameter_types(module, target_callable)
+        parameters = []
         if signature:
-            target_callable.no_unknown_parameters()
             for param in signature.parameters:
                 if param == 'self': continue
                 # TODO: how can we get info about args and kwargs?
                 if param == 'args': continue
                 if param == 'kwargs': continue
+                parameters.append(param)
+            # a signature which has only *args and **kwargs doesn't tell anything
+            if len(parameters) == 0 and 'args' in signature.parameters and types != None: signature = None
+        if signature and types != None and len(types) != len(parameters):
+            self.warn('signature of {0:s} does not match parameter types in C sources: {1}'
+                      .format(target_callable.fullname(), ', '.join(str(t) for t in types)))
+            types = None
+        if signature:
+            target_callable.no_unknown_parameters()
+            for index, param in enumerate(parameters):
                 if signature.parameters[param].default == Parameter.empty: default_value = None
                 else: default_value = signature.parameters[param].default
+                parameter_type = ParameterType.any_object
+                if types != None: parameter_type = types[index]
                 # TODO: pass default_value here, but make sure that it works correctly
-                target_callable.add_parameter(ParameterType.any_object, None)
+                target_callable.add_parameter(parameter_type, None)
+        elif types != None:
+            self.log('take parameters of {0:s} from C sources'.format(target_callable.fullname()))
+            target_callable.no_unknown_parameters()
+            for parameter_type in types: target_callable.add_parameter(parameter_type, None)
         else: self.warn('could not get a signature: ' + target_callable.fullname())
 
+    # returns parameter types which were found in C sources for a function or a method, or None
+    # a constructor may be described by a format string with a class name, for example, "|O:StringIO"
+    def find_parameter_types(self, module, target_callable):
+        known_types = self.parameter_types.get(module, {})
+        names = [target_callable.name]
+        if isinstance(target_callable, TargetMethod):
+            names.insert(0, target_callable.clazz.name + '.' + target_callable.name)
+            if target_callable.name == '__init__': names.append(target_callable.clazz.name)
+        for name in names:
+            if name in known_types: return known_types[name]
+        return None
+
     def log(self, message):
         print_with_prefix('TargetFinder', message)
 
     def warn(self, message):
         self.log('warning: {0:s}'.format(message))
+
+def set_worker(finder):
+    TargetFinder.worker = finder
+    core.Profiler.current = None
+
+# explores a nested module in a worker process, returns targets and nested modules which were found
+def explore_module(filename, module, depth):
+    finder = TargetFinder.worker
+    finder.targets = []
+    finder.nested = []
+    finder.look_for_targets(filename, module, depth)
+    return finder.targets, finder.nested